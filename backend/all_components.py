@@ -1,7 +1,14 @@
-import yfinance as yf
+import logging
+from downloader import download_bars
 import pandas as pd
-from io import BytesIO
-from scrape_tickers import get_index_components
+from exporters import write_export
+from reshape import wide_to_long, last_bars
+from ticker_plan import plan_fetch, attach_indices
+from metrics import get_logger, log_event, stage, record_export, record_missing, EXPORTS
+
+PIPELINE = 'all'
+
+logger = get_logger(__name__)
 
 def get_current_details(tickers):
     """Fetch current market data for a list of tickers"""
@@ -9,68 +16,54 @@ def get_current_details(tickers):
         if not tickers:
             return pd.DataFrame()
             
-        data = yf.download(tickers, period="1d", group_by="ticker", auto_adjust=False)
+        with stage(PIPELINE, 'download', tickers=len(tickers)):
+            data = download_bars(tickers, period="1d")
        
         if data.empty:
             return pd.DataFrame()
 
-        data.index = data.index.tz_localize(None)
-        
-        if isinstance(data.columns, pd.MultiIndex):
-            data = (data.stack(level=0, future_stack=True)
-                    .rename_axis(['Date', 'Ticker'])
-                    .reset_index()
-                    .drop(columns=['Volume']))
-        else:
-            data = data.reset_index()
-            data['Ticker'] = tickers[0]
-            data = data.drop(columns=['Volume'])
+        with stage(PIPELINE, 'reshape'):
+            data.index = data.index.tz_localize(None)
+            data = wide_to_long(data, tickers)
             
-        latest_data = data[data['Date'] == data['Date'].max()]
-        
-        # **Sort the DataFrame by Ticker**
-        latest_data = latest_data.sort_values(by=['Ticker']).groupby('Ticker').tail(1).reset_index(drop=True)
+        with stage(PIPELINE, 'filter'):
+            # Each ticker's own last bar, sorted by Ticker
+            latest_data = last_bars(data)
         
         return latest_data
 
     except Exception as e:
-        print(f"Error fetching data: {e}")
+        log_event(logger, 'fetch_failed', logging.ERROR, pipeline=PIPELINE, error=str(e))
         return pd.DataFrame()
 
-def generate_all_data(tickers=None):
-    """Generate Excel file with all components data in a single sheet"""
+def generate_all_data(output_path, tickers=None, progress=None, file_format='xlsx'):
+    """Generate an export with all components data at output_path"""
     try:
-        output = BytesIO()
         all_data = pd.DataFrame()
         
-        if tickers:
-            # Use provided tickers
-            for index, symbols in tickers.items():
-                print(f"Processing {index}...")
-                df = get_current_details(symbols)
-                if not df.empty:
-                    df['Index'] = index
-                    all_data = pd.concat([all_data, df], ignore_index=True)
-        else:
-            # Use default index components
-            components, _ = get_index_components()
-            for index, symbols in components.items():
-                print(f"Processing {index}...")
-                df = get_current_details(symbols)
-                if not df.empty:
-                    df['Index'] = index
-                    all_data = pd.concat([all_data, df], ignore_index=True)
+        # Fetch every ticker once, then attach the index labels it belongs to
+        with stage(PIPELINE, 'plan'):
+            plan = plan_fetch(tickers)
+        log_event(logger, 'processing', pipeline=PIPELINE, tickers=len(plan.symbols), indices=plan.indices)
+        plan.report(progress, 'downloading')
+        df = get_current_details(plan.symbols)
+        record_missing(PIPELINE, plan, df['Ticker'] if df is not None and not df.empty else [])
+        if df is not None and not df.empty:
+            with stage(PIPELINE, 'attach'):
+                all_data = attach_indices(df, plan)
+        plan.report(progress, 'writing')
 
-        # Write all data to a single sheet
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            if not all_data.empty:
-                cols = ['Ticker', 'Date', 'Open', 'High', 'Low', 'Close', 'Adj Close']
-                all_data = all_data[cols]
-                all_data.to_excel(writer, sheet_name='All Components', index=False)
-        
-        output.seek(0)
-        return output
+        # Write all data to a single sheet (or table) in the requested format
+        cols = ['Ticker', 'Date', 'Open', 'High', 'Low', 'Close', 'Adj Close']
+        with stage(PIPELINE, 'write', format=file_format):
+            write_export(all_data, output_path, file_format, sheet_name='All Components', columns=cols)
+        size = record_export(PIPELINE, file_format, output_path, len(all_data))
+        log_event(logger, 'export_written', pipeline=PIPELINE, format=file_format, rows=len(all_data), bytes=size)
+
+        plan.report(progress, 'done')
+        return output_path
     
     except Exception as e:
-        print(f"Error generating index data: {str(e)}")
+        EXPORTS.inc(pipeline=PIPELINE, outcome='error')
+        log_event(logger, 'export_failed', logging.ERROR, pipeline=PIPELINE, error=str(e))
         return None
@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import pandas as pd
+from market_calendar import EXCHANGE_TZ
+
+def parse_windows(value):
+    """Rolling windows from '5,20' / '5 20' / an iterable of ints; sorted, unique and positive"""
+    if isinstance(value, str):
+        value = value.replace(',', ' ').split()
+    windows = sorted({int(w) for w in value})
+    if any(w < 2 for w in windows):
+        raise ValueError('Analytics windows must be at least 2 bars')
+    return tuple(windows)
+
+# Windows used when analytics are switched on without choosing any, e.g. STOCK_DATA_ANALYTICS_WINDOWS=5,20,50
+DEFAULT_WINDOWS = parse_windows(os.environ.get('STOCK_DATA_ANALYTICS_WINDOWS', '5,20'))
+
+def resolve_windows(analytics):
+    """Windows for a pipeline's analytics argument: falsy is off, True the defaults, else parsed"""
+    if not analytics:
+        return ()
+    return DEFAULT_WINDOWS if analytics is True else parse_windows(analytics)
+
+def analytics_columns(windows, gaps=True):
+    """Derived column names in the order they are written after OHLC"""
+    columns = ['Return']
+    columns += [f'SMA {w}' for w in windows]
+    columns += [f'Volatility {w}' for w in windows]
+    return columns + ['Gap'] if gaps else columns
+
+def _layout(data, by, date):
+    """Sort by (by, date) and return the frame plus each row's group start position"""
+    data = data.sort_values([by, date], kind='stable').reset_index(drop=True)
+    codes = data[by].cat.codes.to_numpy() if isinstance(data[by].dtype, pd.CategoricalDtype) \
+        else pd.factorize(data[by])[0]
+    first = np.ones(len(data), dtype=bool)
+    first[1:] = codes[1:] != codes[:-1]
+    group_start = np.maximum.accumulate(np.where(first, np.arange(len(data)), 0))
+    return data, first, group_start
+
+def _rolling_sum(values, group_start, window):
+    """Trailing window sums and non-NaN counts that never reach back past the group start"""
+    valid = ~np.isnan(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid)))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, group_start)
+    return sums[end] - sums[start], counts[end] - counts[start]
+
+def _previous(values, first):
+    previous = np.empty_like(values)
+    previous[0] = np.nan
+    previous[1:] = values[:-1]
+    previous[first] = np.nan
+    return previous
+
+def add_analytics(data, windows, price=None, by='Ticker', date='Date'):
+    """Per-ticker Return, SMA and Volatility (rolling std of returns) columns over the rows as given.
+
+    Rows are sorted by (by, date) and every metric is one pass of NumPy over
+    the whole frame; windows hold full windows only, like rolling(w).
+    Prices default to Adj Close when present, Close otherwise.
+    """
+    if data.empty:
+        return data.reindex(columns=list(data.columns) + analytics_columns(windows, gaps=False))
+    price = price or ('Adj Close' if 'Adj Close' in data.columns else 'Close')
+    data, first, group_start = _layout(data, by, date)
+    dtype = data[price].dtype
+    values = data[price].to_numpy(dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = values / _previous(values, first) - 1
+        derived = {'Return': returns}
+        for window in windows:
+            total, count = _rolling_sum(values, group_start, window)
+            derived[f'SMA {window}'] = np.where(count == window, total / window, np.nan)
+        for window in windows:
+            total, count = _rolling_sum(returns, group_start, window)
+            squares, _ = _rolling_sum(returns * returns, group_start, window)
+            variance = np.maximum(squares - total * total / window, 0.0) / (window - 1)
+            derived[f'Volatility {window}'] = np.where(count == window, np.sqrt(variance), np.nan)
+
+    for name, column in derived.items():
+        data[name] = column.astype(dtype, copy=False)
+    return data
+
+def add_gaps(data, by='Ticker', date='Date'):
+    """Gap column: each session's first Open against the ticker's previous Close, on every row of the session.
+
+    Sessions are exchange-local days. Session starts are found in one pass and
+    numbered with a cumulative sum, so broadcasting the gap back is a single take.
+    """
+    if data.empty:
+        return data.reindex(columns=list(data.columns) + ['Gap'])
+    data, first, _ = _layout(data, by, date)
+    dates = data[date]
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_convert(EXCHANGE_TZ).dt.tz_localize(None)
+    days = dates.to_numpy().astype('datetime64[D]')
+
+    new_session = first.copy()
+    new_session[1:] |= days[1:] != days[:-1]
+    starts = np.flatnonzero(new_session)
+    opens = data['Open'].to_numpy(dtype=np.float64)
+    closes = _previous(data['Close'].to_numpy(dtype=np.float64), first)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        session_gaps = opens[starts] / closes[starts] - 1
+    session_id = np.cumsum(new_session) - 1
+    data['Gap'] = session_gaps[session_id].astype(data['Open'].dtype, copy=False)
+    return data
@@ -1,139 +1,269 @@
 import os
 import time
-import pytz
-import pandas as pd
-from io import BytesIO
 from historic_data import generate_historic_data
 from datetime import datetime, timedelta
 from all_components import generate_all_data
 from realtime_data import generate_realtime_data
-from specific_date import generate_specific_date_data
-from scrape_tickers import generate_index_name
-from apscheduler.schedulers.background import BackgroundScheduler
-from flask import Flask, render_template, request, send_file, flash, redirect
-from pathlib import Path
+from specific_date import generate_specific_date_data, expand_dates, DATE_RULES
+from scrape_tickers import generate_index_name, get_index_components
+from flask import (
+    Flask, render_template, request, send_file, flash, redirect, jsonify, Response, stream_with_context, g,
+    url_for,
+)
+from config import (
+    INDEX_COMPONENTS, MANUAL_DAILY_DIR, MANUAL_REALTIME_DIR, MANUAL_HISTORIC_SINGLE_DIR, MANUAL_HISTORIC_MULTIPLE_DIR,
+    MANUAL_HISTORIC_SPECIFIC_DIR, MANUAL_HISTORIC_PARTITIONED_DIR, ensure_data_dirs,
+)
+from scheduler import start_scheduler
+from jobs import JobManager
+from exporters import EXPORT_FORMATS, get_export_format
+from quote_stream import hub, sse_events, POLL_SECONDS as QUOTE_POLL_SECONDS
+from quote_table import table as quote_table
+from ticker_plan import plan_fetch
+from metrics import render as render_metrics, HTTP_REQUESTS, HTTP_SECONDS
+from watchlists import watchlists, summary as watchlist_summary, WatchlistError, WATCHLIST_EXTENSIONS
+from analytics import parse_windows, resolve_windows, DEFAULT_WINDOWS
+from snapshots import normalize_rule, SNAPSHOT_RULES, HISTORIC_RULE, SPECIFIC_DATE_RULE
+from archive import get_archive
+import realtime_data
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key_here"
 
-# Timezone for New York (Eastern Time)
-eastern = pytz.timezone('America/New_York')
+# Create all the required directories if they don't exist
+ensure_data_dirs()
 
-# Define the base directory where the "stock-data" folder will be located
-BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent / 'stock-data'
+jobs = JobManager()
 
-# Define the full paths for the required folders
-SCHEDULED_DATA_DIR = BASE_DIR / 'scheduled'
-SCHEDULED_DAILY_DIR = SCHEDULED_DATA_DIR / 'daily'
-SCHEDULED_REALTIME_DIR = SCHEDULED_DATA_DIR / 'realtime'
+# Longest a /jobs/<id>/file request may wait for its job to finish
+FILE_WAIT_LIMIT = float(os.environ.get('STOCK_DATA_FILE_WAIT_LIMIT', 300))
 
-MANUAL_DATA_DIR = BASE_DIR / 'manual'
-INDEX_COMPONENTS = BASE_DIR / 'index_components'
-MANUAL_DAILY_DIR = MANUAL_DATA_DIR / 'daily'
-MANUAL_REALTIME_DIR = MANUAL_DATA_DIR / 'realtime'
-MANUAL_HISTORIC_DIR = MANUAL_DATA_DIR / 'historic'
-MANUAL_HISTORIC_SINGLE_DIR = MANUAL_HISTORIC_DIR / 'Single-sheet'
-MANUAL_HISTORIC_MULTIPLE_DIR = MANUAL_HISTORIC_DIR / 'Multiple-sheet'
-MANUAL_HISTORIC_SPECIFIC_DIR = MANUAL_HISTORIC_DIR / 'Specific-sheet'
+# Every realtime poll, whichever path triggered it, refreshes the in-memory quote table
+realtime_data.engine.add_listener(quote_table.update)
 
-# Create all the required directories if they don't exist
-SCHEDULED_DATA_DIR.mkdir(parents=True, exist_ok=True)
-SCHEDULED_DAILY_DIR.mkdir(parents=True, exist_ok=True)
-SCHEDULED_REALTIME_DIR.mkdir(parents=True, exist_ok=True)
-
-MANUAL_DATA_DIR.mkdir(parents=True, exist_ok=True)
-MANUAL_DAILY_DIR.mkdir(parents=True, exist_ok=True)
-MANUAL_REALTIME_DIR.mkdir(parents=True, exist_ok=True)
-MANUAL_HISTORIC_DIR.mkdir(parents=True, exist_ok=True)
-INDEX_COMPONENTS.mkdir(parents=True, exist_ok=True)
-MANUAL_HISTORIC_SINGLE_DIR.mkdir(parents=True, exist_ok=True)
-MANUAL_HISTORIC_MULTIPLE_DIR.mkdir(parents=True, exist_ok=True)
-MANUAL_HISTORIC_SPECIFIC_DIR.mkdir(parents=True, exist_ok=True)
-
-# Function to generate and save the all data file
-# def scheduled_download_all_data():
-#     try:
-#         print("Running scheduled task: Download All Data")
-#         output = generate_all_data()
-#         if output:
-#             filename = f'scheduled_all_data_{time.strftime("%Y-%m-%d_%H%M%S")}.xlsx'
-#             file_path = os.path.join(SCHEDULED_DAILY_DIR, filename)
-#             with open(file_path, 'wb') as f:
-#                 f.write(output.getvalue())
-#             print(f"All tickers data saved as {filename}")
-#         else:
-#             print("Failed to generate all tickers data")
-#     except Exception as e:
-#         print(f"Error in scheduled task (Download All Data): {str(e)}")
-
-# # Function to generate and save the real-time data file
-# def scheduled_download_realtime_data():
-#     try:
-#         print("Running scheduled task: Download Real-time Data")
-#         output = generate_realtime_data()
-#         if output:
-#             filename = f'scheduled_realtime_data_{time.strftime("%Y-%m-%d_%H%M%S")}.xlsx'
-#             file_path = os.path.join(SCHEDULED_REALTIME_DIR, filename)
-#             with open(file_path, 'wb') as f:
-#                 f.write(output.getvalue())
-#             print(f"Realtime data saved as {filename}")
-#         else:
-#             print("Failed to generate real-time data")
-#     except Exception as e:
-#         print(f"Error in scheduled task (Download Real-time Data): {str(e)}")
-
-# # Set up scheduler
-# scheduler = BackgroundScheduler()
-
-# # Schedule 'download_all_data' at 12 PM EST
-# scheduler.add_job(scheduled_download_all_data, 'cron', hour=1, minute=0, timezone=eastern)
-
-# # Schedule 'download_realtime_data' every hour from 10 AM to 5 PM EST
-# scheduler.add_job(scheduled_download_realtime_data, 'cron', hour='10-17', minute=0, timezone=eastern)
-
-# # Start the scheduler
-# scheduler.start()
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    endpoint = request.endpoint or 'unmatched'
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_started' in g:
+        HTTP_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    return response
+
+def _requested_format():
+    """Export format chosen on the form or query string, xlsx by default"""
+    return get_export_format(request.values.get('file_format') or 'xlsx')
+
+def _requested_analytics():
+    """Analytics windows from the form or query string: None when off, True for the defaults"""
+    if request.values.get('analytics') not in ('on', 'true', '1'):
+        return None
+    windows = request.values.get('analytics_windows', '').strip()
+    return parse_windows(windows) if windows else True
+
+def _requested_snapshot():
+    """Snapshot rule from the form or query string; a snapshot_time (HH:MM) means the last bar at or before it"""
+    snapshot_time = request.values.get('snapshot_time', '').strip()
+    if snapshot_time:
+        return normalize_rule(f'at_or_before:{snapshot_time}')
+    rule = request.values.get('snapshot', '').strip()
+    return normalize_rule(rule) if rule else None
+
+def _job_dict(job):
+    """Job status plus the URL its file is served from"""
+    return dict(job.to_dict(), file_url=url_for('job_file', job_id=job.id))
+
+def _job_response(job, message):
+    """JSON for API clients, flash + redirect for the HTML form"""
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(_job_dict(job)), 202
+    flash(f"{message} Job {job.id} is {job.status}; progress at /jobs/{job.id}, file at /jobs/{job.id}/file")
+    return redirect('/')
+
+def _requested_tickers():
+    """Index -> tickers map from a saved watchlist ID or an uploaded file; empty means every index.
+
+    Uploads are parsed through the content-hash cache, so sending the same
+    file again costs a hash instead of a spreadsheet parse.
+    """
+    watchlist_id = request.values.get('watchlist_id')
+    if watchlist_id:
+        watchlist = watchlists.get(watchlist_id)
+        if watchlist is None:
+            raise WatchlistError(f"Unknown watchlist: {watchlist_id}")
+        return watchlist['tickers']
+
+    uploaded_file = request.files.get('file') if request.method == 'POST' else None
+    if not uploaded_file or uploaded_file.filename == '':
+        return {}
+    index_ticker_map, _ = watchlists.parse_cache.parse(uploaded_file.filename, uploaded_file.read())
+    return index_ticker_map
+
+def _job_tickers(index_ticker_map):
+    """Ticker map a job key is built from: the request's own, or the default components it stands for"""
+    return index_ticker_map or get_index_components()[0]
 
 @app.route('/', methods=['GET'])
 def index():
-    return render_template('index.html')
+    return render_template('index.html', export_formats=EXPORT_FORMATS.values(), date_rules=DATE_RULES,
+                           watchlists=[watchlist_summary(w) for w in watchlists.list()],
+                           watchlist_extensions=','.join(WATCHLIST_EXTENSIONS),
+                           analytics_windows=', '.join(map(str, DEFAULT_WINDOWS)),
+                           snapshot_rules={rule: label for rule, label in SNAPSHOT_RULES.items() if ':' not in rule})
+
+@app.route('/watchlists', methods=['GET'])
+def list_watchlists():
+    return jsonify([watchlist_summary(w) for w in watchlists.list()])
+
+@app.route('/watchlists', methods=['POST'])
+def create_watchlist():
+    """Save an uploaded xlsx/csv/txt ticker file under a name; later requests pass its watchlist_id"""
+    wants_json = request.accept_mimetypes.best == 'application/json'
+    try:
+        uploaded_file = request.files.get('file')
+        if not uploaded_file or uploaded_file.filename == '':
+            raise WatchlistError('Please choose a ticker file')
+        watchlist = watchlists.create(request.form.get('name'), uploaded_file.filename, uploaded_file.read())
+    except WatchlistError as e:
+        if wants_json:
+            return jsonify({'error': str(e)}), 400
+        flash(str(e))
+        return redirect('/')
+
+    if wants_json:
+        return jsonify(watchlist), 201
+    flash(f"Watchlist '{watchlist['name']}' saved with ID {watchlist['id']}")
+    return redirect('/')
+
+@app.route('/watchlists/<watchlist_id>', methods=['GET'])
+def get_watchlist(watchlist_id):
+    watchlist = watchlists.get(watchlist_id)
+    if watchlist is None:
+        return jsonify({'error': 'Unknown watchlist'}), 404
+    return jsonify(watchlist)
+
+@app.route('/watchlists/<watchlist_id>', methods=['DELETE'])
+def delete_watchlist(watchlist_id):
+    if not watchlists.delete(watchlist_id):
+        return jsonify({'error': 'Unknown watchlist'}), 404
+    return '', 204
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage timings, export and error counters in the Prometheus text format"""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify([_job_dict(job) for job in jobs.list()])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(_job_dict(job))
+
+@app.route('/jobs/<job_id>/file', methods=['GET', 'HEAD'])
+def job_file(job_id):
+    """Stream a finished job's export from disk with Range, ETag and conditional GET support.
+
+    ?wait=N holds the request up to N seconds (at most FILE_WAIT_LIMIT) for a
+    running job; otherwise an unfinished job answers 202 with its status.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    wait = min(float(request.args.get('wait') or 0), FILE_WAIT_LIMIT)
+    if job.finished_at is None and wait > 0:
+        job = jobs.wait(job_id, wait) or job
+    if job.finished_at is None:
+        response = jsonify(_job_dict(job))
+        response.status_code = 202
+        response.headers['Retry-After'] = '2'
+        return response
+    if job.status != 'done' or not job.file_path:
+        return jsonify(dict(_job_dict(job), error=job.error or 'Job produced no file')), 409
+    try:
+        stat = os.stat(job.file_path)
+    except OSError:
+        return jsonify({'error': 'File is no longer available'}), 410
+
+    # Cache hits are links to the same artifact, so identical results share an ETag
+    etag = f'{job.key[:32]}-{stat.st_size}-{int(stat.st_mtime)}'
+    return send_file(job.file_path, as_attachment=True, download_name=os.path.basename(job.file_path),
+                     conditional=True, etag=etag, last_modified=stat.st_mtime, max_age=0)
+
+@app.route('/api/archive/<dataset>', methods=['GET'])
+def api_archive(dataset):
+    """Archived snapshot rows for ?from=&to= (exchange-local days), narrowed by ?index= and ?tickers="""
+    indices = [i.strip() for i in request.args.get('index', '').split(',') if i.strip()]
+    tickers = [t.strip() for t in request.args.get('tickers', '').split(',') if t.strip()]
+    try:
+        data = get_archive().query(dataset, request.args.get('from'), request.args.get('to'),
+                                   indices=indices or None, tickers=tickers or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    return Response(data.to_json(orient='records', date_format='iso'), content_type='application/json')
+
+@app.route('/stream/quotes', methods=['GET'])
+def stream_quotes():
+    """Server-sent events with per-ticker quote updates from the shared realtime poller"""
+    tickers = [t.strip() for t in request.args.get('tickers', '').split(',') if t.strip()] or None
+    last_seq = int(request.headers.get('Last-Event-ID') or request.args.get('since') or 0)
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(sse_events(hub, tickers, last_seq)),
+                    mimetype='text/event-stream', headers=headers)
+
+@app.route('/api/quotes', methods=['GET'])
+def api_quotes():
+    """Latest quotes for ?tickers=A,B and/or ?index=SP500 from the in-memory quote table, refreshed once per poll interval"""
+    try:
+        tickers = [t.strip() for t in request.args.get('tickers', '').split(',') if t.strip()]
+        indices = [i.strip() for i in request.args.get('index', '').split(',') if i.strip()]
+
+        plan = plan_fetch()
+        for index in indices:
+            tickers.extend(symbol for symbol, member_of in plan.membership.items() if index in member_of)
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            return jsonify({'error': 'Pass tickers and/or index'}), 400
+
+        # Tickers not checked within a poll interval are polled again; the engine only fetches newer bars
+        stale = quote_table.stale(tickers, QUOTE_POLL_SECONDS)
+        if stale:
+            realtime_data.engine.poll(stale)
+            quote_table.touch(stale)
+
+        quotes = quote_table.lookup(tickers)
+        for quote in quotes:
+            quote['indices'] = plan.membership.get(quote['ticker'], [])
+        return jsonify(quotes)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/download_all_data', methods=['GET', 'POST'])
 def download_all_data():
     try:
-        index_ticker_map = {}
-        # Check if a file was uploaded
-        if request.method == 'POST' and 'file' in request.files:
-            uploaded_file = request.files['file']
-            
-            if uploaded_file.filename != '' and uploaded_file.filename.endswith(('.xlsx', '.xls')):
-                # Read tickers from uploaded file
-                df_tickers = pd.read_excel(uploaded_file)
-                if 'Ticker' not in df_tickers.columns or 'Index' not in df_tickers.columns:
-                    flash("Excel file must contain 'Ticker' and 'Index' columns")
-                    return redirect('/')
-                    
-                for index, ticker in df_tickers.groupby('Index'):
-                    index_ticker_map[index] = ticker['Ticker'].unique().tolist()
-                output = generate_all_data(tickers=index_ticker_map)
-            else:
-                output = generate_all_data()
-        else:
-            output = generate_all_data()
-
-        if output:
-            filename = f'Market data-All data-singlesheet-manual-{time.strftime("%d%m%y_%H%M%S")}.xlsx'
-            file_path = os.path.join(MANUAL_DAILY_DIR, filename)
-
-            # Save the generated data to the file path
-            with open(file_path, 'wb') as f:
-                f.write(output.getvalue())
-        
-            # Flash a success message and redirect to the desired page
-            flash(f"Data saved successfully.")
-            return redirect('/')
-        
-        flash("Failed to generate all tickers data")
+        index_ticker_map = _requested_tickers()
+
+        export_format = _requested_format()
+
+        filename = f'Market data-All data-singlesheet-manual-{time.strftime("%d%m%y_%H%M%S")}{export_format.extension}'
+        file_path = os.path.join(MANUAL_DAILY_DIR, filename)
+
+        def run(job):
+            return generate_all_data(file_path, tickers=index_ticker_map or None, progress=job.update_progress,
+                                     file_format=export_format.name)
+
+        job = jobs.submit('all_data', run, {'file_format': export_format.name}, _job_tickers(index_ticker_map),
+                          output_path=file_path)
+        return _job_response(job, "All tickers data download started.")
+    except WatchlistError as e:
+        flash(str(e))
         return redirect('/')
     except Exception as e:
         flash(f"Error generating all tickers data: {str(e)}")
@@ -142,39 +272,24 @@ def download_all_data():
 @app.route('/download_realtime_data', methods=['GET', 'POST'])
 def download_realtime_data():
     try:
-        index_ticker_map = {}
-        # Check if a file was uploaded
-        if request.method == 'POST' and 'file' in request.files:
-            uploaded_file = request.files['file']
-            
-            if uploaded_file.filename != '' and uploaded_file.filename.endswith(('.xlsx', '.xls')):
-                # Read tickers from uploaded file
-                df_tickers = pd.read_excel(uploaded_file)
-                if 'Ticker' not in df_tickers.columns or 'Index' not in df_tickers.columns:
-                    flash("Excel file must contain 'Ticker' and 'Index' columns")
-                    return redirect('/')
-                    
-                for index, ticker in df_tickers.groupby('Index'):
-                    index_ticker_map[index] = ticker['Ticker'].unique().tolist()
-                output = generate_realtime_data(tickers=index_ticker_map)
-            else:
-                output = generate_realtime_data()
-        else:
-            output = generate_realtime_data()
-
-        if output:
-            filename = f'Market data-Realtime-singlesheet-manual-{time.strftime("%d%m%y_%H%M%S")}.xlsx'
-            file_path = os.path.join(MANUAL_REALTIME_DIR, filename)
-
-            # Save the generated data to the file path
-            with open(file_path, 'wb') as f:
-                f.write(output.getvalue())
-        
-            # Flash a success message and redirect to the desired page
-            flash(f"Realtime data saved successfully.")
-            return redirect('/')
-        
-        flash("Failed to generate realtime data")
+        index_ticker_map = _requested_tickers()
+
+        export_format = _requested_format()
+        analytics = _requested_analytics()
+
+        filename = f'Market data-Realtime-singlesheet-manual-{time.strftime("%d%m%y_%H%M%S")}{export_format.extension}'
+        file_path = os.path.join(MANUAL_REALTIME_DIR, filename)
+
+        def run(job):
+            return generate_realtime_data(file_path, tickers=index_ticker_map or None, progress=job.update_progress,
+                                          file_format=export_format.name, analytics=analytics)
+
+        # Job keys hold the resolved settings, so changed defaults never reuse results built with the old ones
+        params = {'file_format': export_format.name, 'analytics': list(resolve_windows(analytics))}
+        job = jobs.submit('realtime', run, params, _job_tickers(index_ticker_map), output_path=file_path)
+        return _job_response(job, "Realtime data download started.")
+    except WatchlistError as e:
+        flash(str(e))
         return redirect('/')
     except Exception as e:
         flash(f"Error generating realtime data: {str(e)}")
@@ -183,48 +298,52 @@ def download_realtime_data():
 @app.route('/download_specific_date', methods=['GET', 'POST'])
 def download_specific_date():
     try:
-        index_ticker_map = {}
         # Check if it's a POST request
         if request.method == 'POST' and 'specific_date' in request.form:
             
             specific_date = request.form['specific_date']
 
-            # Check if file was uploaded
-            if 'file' in request.files:
-                uploaded_file = request.files['file']
-                if uploaded_file.filename != '' and uploaded_file.filename.endswith(('.xlsx', '.xls')):
-                    # Read tickers from uploaded file
-                    df_tickers = pd.read_excel(uploaded_file)
-                    if 'Ticker' not in df_tickers.columns or 'Index' not in df_tickers.columns:
-                        flash("Excel file must contain 'Ticker' and 'Index' columns")
-                        return redirect('/')
-                        
-                    for index, ticker in df_tickers.groupby('Index'):
-                        index_ticker_map[index] = ticker['Ticker'].unique().tolist()
-                    
-                    output = generate_specific_date_data(specific_date, tickers=index_ticker_map)
-                else:
-                    output = generate_specific_date_data(specific_date)
-            else:
-                output = generate_specific_date_data(specific_date)
-
-            if output:
-                # Generate filename and save file
-                filename = f'Market data-specific-date-singlesheet-manual-{time.strftime("%d%m%y")}-{specific_date}.xlsx'
-                file_path = os.path.join(MANUAL_HISTORIC_SPECIFIC_DIR, filename)
-                
-                with open(file_path, 'wb') as f:
-                    f.write(output.getvalue())
-                
-                flash("Data saved successfully.")
-                return redirect('/')
+            index_ticker_map = _requested_tickers()
+
+            export_format = _requested_format()
+
+            # Several snapshots: a rule over [specific_date, range_end] or an explicit list of extra dates
+            date_rule = request.form.get('date_rule', '')
+            if date_rule:
+                range_end = request.form.get('range_end') or specific_date
+                dates = [day.isoformat() for day in expand_dates(specific_date, range_end, date_rule)]
+                if not dates:
+                    flash("No dates match the selected rule")
+                    return redirect('/')
             else:
-                flash("Failed to generate data for the specific date")
-                return redirect('/')
+                extra_dates = request.form.get('extra_dates', '').replace(',', ' ').split()
+                dates = sorted({specific_date, *(datetime.strptime(d, '%Y-%m-%d').strftime('%Y-%m-%d') for d in extra_dates)})
+            per_date_sheets = request.form.get('per_date_sheets') == 'on'
+            analytics = _requested_analytics()
+            snapshot = _requested_snapshot()
+            label = dates[0] if len(dates) == 1 else f'{dates[0]}_to_{dates[-1]}'
+
+            filename = f'Market data-specific-date-singlesheet-manual-{time.strftime("%d%m%y-%H%M%S")}-{label}{export_format.extension}'
+            file_path = os.path.join(MANUAL_HISTORIC_SPECIFIC_DIR, filename)
+
+            def run(job):
+                return generate_specific_date_data(file_path, dates if len(dates) > 1 else dates[0],
+                                                   tickers=index_ticker_map or None, progress=job.update_progress,
+                                                   file_format=export_format.name, per_date_sheets=per_date_sheets,
+                                                   analytics=analytics, snapshot=snapshot)
+
+            params = {'dates': dates, 'file_format': export_format.name, 'per_date_sheets': per_date_sheets,
+                      'analytics': list(resolve_windows(analytics)),
+                      'snapshot': snapshot or SPECIFIC_DATE_RULE}
+            job = jobs.submit('specific_date', run, params, _job_tickers(index_ticker_map), output_path=file_path)
+            return _job_response(job, f"Download for {label} started.")
         else:
             flash("Please submit the form with a valid date")
             return redirect('/')
             
+    except WatchlistError as e:
+        flash(str(e))
+        return redirect('/')
     except Exception as e:
         flash(f"Error processing request: {str(e)}")
         return redirect('/')
@@ -232,24 +351,12 @@ def download_specific_date():
 @app.route('/download', methods=['POST'])
 def download():
     try:
-        index_ticker_map = {}
         period_type = request.form['period_type']
         export_format = request.form['export_format']
-        
-        if 'file' in request.files:
-            uploaded_file = request.files['file']
-            
-            if uploaded_file and uploaded_file.filename.endswith(('.xlsx', '.xls')):
-                df_tickers = pd.read_excel(uploaded_file)
-                if 'Ticker' not in df_tickers.columns or 'Index' not in df_tickers.columns:
-                    flash("Excel file must contain 'Ticker' and 'Index' columns")
-                    return redirect('/')
-                
-                for index, ticker in df_tickers.groupby('Index'):
-                    index_ticker_map[index] = ticker['Ticker'].unique().tolist()
-            elif uploaded_file.filename != '':
-                flash('Invalid file format. Please upload an Excel file.')
-                return redirect('/')
+        file_format = _requested_format()
+        analytics = _requested_analytics()
+        snapshot = _requested_snapshot()
+        index_ticker_map = _requested_tickers()
 
         # Handle date range, weeks, or days input
         if period_type == 'date':
@@ -283,41 +390,36 @@ def download():
             start_date = start_date_obj.strftime('%Y-%m-%d')
             end_date = end_date_obj.strftime('%Y-%m-%d')
 
-        # Create Excel file in memory
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            if index_ticker_map:
-                if export_format == 'single':
-                    sheet_type = 'singlesheet'
-                    output = generate_historic_data(start_date, end_date, tickers=index_ticker_map)
-                else:
-                    sheet_type = 'multisheet'
-                    output = generate_historic_data(start_date, end_date, tickers=index_ticker_map, multisheet=True)
-            else:
-                if export_format == 'single':
-                    sheet_type = 'singlesheet'
-                    output = generate_historic_data(start_date, end_date)
-                else:
-                    sheet_type = 'multisheet'
-                    output = generate_historic_data(start_date, end_date, tickers=None, multisheet=True)                 
-            
-
-        output.seek(0)
-        filename = f'Market data-historic-{sheet_type}-manual-{time.strftime("%d%m%y-%H%M%S")}-range {start_date.replace("-", "")}-{end_date.replace("-", "")}.xlsx'
-        
-        # Replace the file_path line in download route with:
-        if export_format == 'single':
-            file_path = os.path.join(MANUAL_HISTORIC_SINGLE_DIR, filename)
+        # per_ticker / per_index write one file per partition, zipped together with a manifest
+        partition_files = {'per_ticker': 'Ticker', 'per_index': 'Index'}.get(export_format)
+        multisheet = export_format == 'multiple'
+        if partition_files:
+            sheet_type = f'partitioned-{partition_files.lower()}'
+            directory = MANUAL_HISTORIC_PARTITIONED_DIR
+            extension = '.zip'
         else:
-            file_path = os.path.join(MANUAL_HISTORIC_MULTIPLE_DIR, filename)
-            
-        with open(file_path, 'wb') as f:
-            f.write(output.getvalue())
-        
-        # Flash success message and redirect
-        flash(f"File successfully saved.")
-        return redirect('/')
+            sheet_type = 'multisheet' if multisheet else 'singlesheet'
+            directory = MANUAL_HISTORIC_MULTIPLE_DIR if multisheet else MANUAL_HISTORIC_SINGLE_DIR
+            extension = file_format.extension
+
+        filename = f'Market data-historic-{sheet_type}-manual-{time.strftime("%d%m%y-%H%M%S")}-range {start_date.replace("-", "")}-{end_date.replace("-", "")}{extension}'
+        file_path = os.path.join(directory, filename)
+
+        def run(job):
+            return generate_historic_data(file_path, start_date, end_date,
+                                          tickers=index_ticker_map or None, multisheet=multisheet,
+                                          progress=job.update_progress, file_format=file_format.name,
+                                          partition_files=partition_files, analytics=analytics, snapshot=snapshot)
 
+        params = {'start_date': start_date, 'end_date': end_date, 'export_format': export_format,
+                  'file_format': file_format.name, 'analytics': list(resolve_windows(analytics)),
+                  'snapshot': snapshot or HISTORIC_RULE}
+        job = jobs.submit('historic', run, params, _job_tickers(index_ticker_map), output_path=file_path)
+        return _job_response(job, "Historic data download started.")
+
+    except WatchlistError as e:
+        flash(str(e))
+        return redirect('/')
     except ValueError as ve:
         flash('Invalid input format. Please check your inputs.')
         return redirect('/')
@@ -328,19 +430,18 @@ def download():
 @app.route('/download-index-components')
 def download_index_components():
     try:
-        output = generate_index_name()
-        filename = f'index_components_{time.strftime("%Y-%m-%d_%H%M%S")}.xlsx'
-        file_path = os.path.join(INDEX_COMPONENTS, filename)
-        
-        # Save the generated data to the file path
-        with open(file_path, 'wb') as f:
-            f.write(output.getvalue())
-        
-        flash("Index components data saved successfully.")
-        return redirect('/')
+        def run(job):
+            filename = f'index_components_{time.strftime("%Y-%m-%d_%H%M%S")}.xlsx'
+            return generate_index_name(os.path.join(INDEX_COMPONENTS, filename))
+
+        job = jobs.submit('index_components', run, {})
+        return _job_response(job, "Index components download started.")
     except Exception as e:
         flash(f"Error saving index components data: {str(e)}")
         return redirect('/')
     
 if __name__ == '__main__':
+    # The debug reloader runs this module twice; only the serving child schedules jobs
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_scheduler()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,316 @@
+"""Compaction of the realtime and daily snapshot exports into a partitioned Parquet archive.
+
+    archive/<dataset>/date=YYYY-MM-DD/index=<Index>.parquet
+    archive/manifest.json
+
+Every compaction reads the export files it has not seen yet, folds their rows
+into the (date, index) partitions they touch, keeps one row per (Ticker, Date,
+Index) from the most recent capture, and rewrites only those partitions. The
+manifest lists the ingested files and every partition with its row count and
+date span, so a range query opens just the partitions it needs. Ingested raw
+exports older than RAW_RETENTION_DAYS are deleted afterwards.
+"""
+import os
+import json
+import time
+import logging
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from config import (
+    ARCHIVE_DIR, BASE_DIR, MANUAL_DAILY_DIR, MANUAL_REALTIME_DIR, SCHEDULED_DAILY_DIR, SCHEDULED_REALTIME_DIR,
+)
+from market_calendar import EXCHANGE_TZ
+from snapshots import local_minutes
+from shared_cache import get_shared_cache
+from metrics import get_logger, log_event, stage
+
+PIPELINE = 'archive'
+
+# dataset -> (export folders, zone the exported naive dates are in)
+DATASETS = {
+    'realtime': ((MANUAL_REALTIME_DIR, SCHEDULED_REALTIME_DIR), EXCHANGE_TZ),
+    'daily': ((MANUAL_DAILY_DIR, SCHEDULED_DAILY_DIR), EXCHANGE_TZ),
+}
+
+SOURCE_EXTENSIONS = ('.xlsx', '.parquet', '.arrow', '.csv.gz')
+
+# Days an ingested raw export is kept next to the archive; 0 keeps them forever
+RAW_RETENTION_DAYS = float(os.environ.get('STOCK_DATA_ARCHIVE_RAW_RETENTION_DAYS', 30))
+
+# Days of archived partitions kept; 0 keeps them forever
+RETENTION_DAYS = float(os.environ.get('STOCK_DATA_ARCHIVE_RETENTION_DAYS', 0))
+
+# Processes parsing export files; workbooks dominate the time of a first compaction
+READ_WORKERS = int(os.environ.get('STOCK_DATA_ARCHIVE_WORKERS', min(4, os.cpu_count() or 1)))
+
+MANIFEST_PATH = ARCHIVE_DIR / 'manifest.json'
+
+# Rows with no index label (spreadsheet exports of tickers outside every known index)
+UNLISTED = 'Unlisted'
+
+KEY_COLUMNS = ['Ticker', 'Date', 'Index']
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+
+logger = get_logger(__name__)
+
+def _source_key(path):
+    try:
+        return str(path.relative_to(BASE_DIR))
+    except ValueError:
+        return str(path)
+
+def _read_source(path):
+    """Rows of one export file with the archive columns, or None when it holds no snapshot table"""
+    path = str(path)
+    if path.endswith('.xlsx'):
+        sheets = pd.read_excel(path, sheet_name=None)
+        frames = [frame for frame in sheets.values() if {'Ticker', 'Date'} <= set(frame.columns)]
+        data = pd.concat(frames, ignore_index=True) if frames else None
+    elif path.endswith('.parquet'):
+        data = pd.read_parquet(path)
+    elif path.endswith('.arrow'):
+        data = pd.read_feather(path)
+    else:
+        data = pd.read_csv(path, parse_dates=['Date'])
+    if data is None or data.empty or not {'Ticker', 'Date'} <= set(data.columns):
+        return None
+    columns = [c for c in ['Ticker', 'Date', *PRICE_COLUMNS, 'Index'] if c in data.columns]
+    data = data[columns].copy()
+    data['Ticker'] = data['Ticker'].astype(str)
+    data['Date'] = pd.to_datetime(data['Date'])
+    if data['Date'].dt.tz is not None:
+        data['Date'] = data['Date'].dt.tz_convert(EXCHANGE_TZ).dt.tz_localize(None)
+    if 'Index' in data.columns:
+        data['Index'] = data['Index'].astype(str)
+    return data
+
+def _read_batch(paths):
+    """Read several sources; runs in a pool process"""
+    results = []
+    for path in paths:
+        try:
+            results.append((path, _read_source(path), None))
+        except Exception as e:
+            results.append((path, None, str(e)))
+    return results
+
+def _read_sources(paths, workers):
+    if workers <= 1 or len(paths) <= 1:
+        return _read_batch(paths)
+    batches = [paths[i::workers * 2] for i in range(min(len(paths), workers * 2))]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return [result for batch in pool.map(_read_batch, batches) for result in batch]
+
+def _label_indices(data, membership):
+    """Give rows without an Index label one row per index their ticker currently belongs to"""
+    if 'Index' not in data.columns:
+        data = data.assign(Index=np.nan)
+    unlabelled = data['Index'].isna()
+    if not unlabelled.any():
+        return data
+    # Spreadsheets repeat a ticker once per index without naming it, so collapse those copies first
+    rows = data[unlabelled].drop(columns='Index').drop_duplicates(['Ticker', 'Date', '_captured'], keep='last')
+    pairs = pd.DataFrame([(symbol, index) for symbol, indices in membership.items() for index in indices],
+                         columns=['Ticker', 'Index'])
+    rows = rows.merge(pairs, on='Ticker', how='left')
+    rows['Index'] = rows['Index'].fillna(UNLISTED)
+    return pd.concat([data[~unlabelled], rows], ignore_index=True)
+
+def _partition_path(dataset, day, index):
+    safe_index = ''.join(ch if ch.isalnum() or ch in '._^-' else '_' for ch in str(index)) or UNLISTED
+    return ARCHIVE_DIR / dataset / f'date={day}' / f'index={safe_index}.parquet'
+
+def _write_partition(path, data):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.partial')
+    pq.write_table(pa.Table.from_pandas(data, preserve_index=False), tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+class Archive:
+    """The partitioned Parquet archive and its manifest"""
+
+    def __init__(self, directory=ARCHIVE_DIR, datasets=DATASETS):
+        self.directory = directory
+        self.manifest_path = directory / 'manifest.json'
+        self.datasets = datasets
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'sources': {}, 'partitions': {}}
+
+    def _save_manifest(self, manifest):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def pending_sources(self, manifest=None):
+        """(dataset, path) of every export file not ingested yet, or changed since"""
+        manifest = manifest or self.load_manifest()
+        pending = []
+        for dataset, (directories, _) in self.datasets.items():
+            for directory in directories:
+                if not directory.is_dir():
+                    continue
+                for path in sorted(directory.iterdir()):
+                    if not path.name.endswith(SOURCE_EXTENSIONS) or path.name.startswith('~$'):
+                        continue
+                    seen = manifest['sources'].get(_source_key(path))
+                    stat = path.stat()
+                    if seen is None or seen['mtime'] != stat.st_mtime or seen['size'] != stat.st_size:
+                        pending.append((dataset, path))
+        return pending
+
+    def compact(self, membership=None, workers=READ_WORKERS, dry_run=False):
+        """Ingest new exports, rewrite the partitions they touch and apply retention; returns a summary.
+
+        membership (ticker -> indices) labels spreadsheet rows, which carry no
+        Index column; by default it is the current index components.
+        """
+        with get_shared_cache().lease(PIPELINE, 'compact', ttl=3600) as holder:
+            if not holder:
+                log_event(logger, 'compaction_skipped', reason='another process is compacting')
+                return {'skipped': True}
+            return self._compact(membership, workers, dry_run)
+
+    def _compact(self, membership, workers, dry_run):
+        manifest = self.load_manifest()
+        pending = self.pending_sources(manifest)
+        summary = {'sources': len(pending), 'rows': 0, 'partitions': 0, 'failed': [], 'deleted_raw': 0,
+                   'expired_partitions': 0}
+        if dry_run:
+            summary['pending'] = [_source_key(path) for _, path in pending]
+            return summary
+
+        if pending:
+            with stage(PIPELINE, 'read', files=len(pending)):
+                results = _read_sources([path for _, path in pending], workers)
+            dataset_of = {str(path): dataset for dataset, path in pending}
+            frames = {}
+            for path, data, error in results:
+                path = str(path)
+                stat = os.stat(path)
+                if error is not None:
+                    log_event(logger, 'source_unreadable', logging.WARNING, file=path, error=error)
+                    summary['failed'].append(_source_key(type(ARCHIVE_DIR)(path)))
+                    continue
+                rows = 0 if data is None else len(data)
+                if rows:
+                    data['_captured'] = stat.st_mtime
+                    frames.setdefault(dataset_of[path], []).append(data)
+                manifest['sources'][_source_key(type(ARCHIVE_DIR)(path))] = {
+                    'dataset': dataset_of[path], 'mtime': stat.st_mtime, 'size': stat.st_size, 'rows': rows,
+                    'ingested_at': time.time(),
+                }
+
+            if frames and membership is None and any('Index' not in f.columns for fs in frames.values() for f in fs):
+                from ticker_plan import plan_fetch
+                membership = plan_fetch().membership
+            for dataset, dataset_frames in frames.items():
+                with stage(PIPELINE, 'merge', dataset=dataset):
+                    data = _label_indices(pd.concat(dataset_frames, ignore_index=True), membership or {})
+                    summary['rows'] += len(data)
+                    summary['partitions'] += self._merge_partitions(manifest, dataset, data)
+
+        with stage(PIPELINE, 'retention'):
+            summary['expired_partitions'] = self._expire_partitions(manifest)
+            summary['deleted_raw'] = self._expire_raw(manifest)
+        self._save_manifest(manifest)
+        log_event(logger, 'archive_compacted', **{k: v for k, v in summary.items() if k != 'failed'},
+                  failed=len(summary['failed']))
+        return summary
+
+    def _merge_partitions(self, manifest, dataset, data):
+        """Fold new rows into their (date, index) partitions; returns how many were rewritten"""
+        days, _ = local_minutes(data['Date'], self.datasets[dataset][1])
+        data['_day'] = days.astype(str)
+        written = 0
+        for (day, index), rows in data.groupby(['_day', 'Index'], sort=True, observed=True):
+            path = _partition_path(dataset, day, index)
+            if path.exists():
+                rows = pd.concat([pd.read_parquet(path), rows], ignore_index=True)
+            # Overlapping snapshots of the same bar keep the latest capture
+            rows = (rows.sort_values('_captured', kind='stable')
+                    .drop_duplicates(KEY_COLUMNS, keep='last')
+                    .drop(columns='_day', errors='ignore')
+                    .sort_values(['Date', 'Ticker']).reset_index(drop=True))
+            _write_partition(path, rows)
+            manifest['partitions'][str(path.relative_to(self.directory))] = {
+                'dataset': dataset, 'date': day, 'index': str(index), 'rows': len(rows),
+                'tickers': int(rows['Ticker'].nunique()), 'bytes': path.stat().st_size,
+                'first': rows['Date'].min().isoformat(), 'last': rows['Date'].max().isoformat(),
+            }
+            written += 1
+        return written
+
+    def _expire_partitions(self, manifest):
+        if RETENTION_DAYS <= 0:
+            return 0
+        cutoff = (datetime.date.today() - datetime.timedelta(days=RETENTION_DAYS)).isoformat()
+        expired = [key for key, entry in manifest['partitions'].items() if entry['date'] < cutoff]
+        for key in expired:
+            try:
+                os.remove(self.directory / key)
+            except OSError:
+                pass
+            del manifest['partitions'][key]
+        return len(expired)
+
+    def _expire_raw(self, manifest):
+        """Delete ingested exports past RAW_RETENTION_DAYS and forget sources that no longer exist"""
+        cutoff = time.time() - RAW_RETENTION_DAYS * 86400
+        deleted = 0
+        for key, entry in list(manifest['sources'].items()):
+            path = BASE_DIR / key
+            if RAW_RETENTION_DAYS > 0 and entry['mtime'] < cutoff and path.exists():
+                try:
+                    os.remove(path)
+                    deleted += 1
+                except OSError as e:
+                    log_event(logger, 'raw_delete_failed', logging.WARNING, file=key, error=str(e))
+                    continue
+            if not path.exists():
+                del manifest['sources'][key]
+        return deleted
+
+    def partitions(self, dataset, start=None, end=None, indices=None):
+        """Manifest entries of the partitions a query over [start, end] and indices touches"""
+        start = str(start)[:10] if start else None
+        end = str(end)[:10] if end else None
+        indices = set(indices) if indices else None
+        return {key: entry for key, entry in self.load_manifest()['partitions'].items()
+                if entry['dataset'] == dataset
+                and (start is None or entry['date'] >= start)
+                and (end is None or entry['date'] <= end)
+                and (indices is None or entry['index'] in indices)}
+
+    def query(self, dataset, start=None, end=None, indices=None, tickers=None, columns=None):
+        """Archived rows of a dataset for exchange-local days in [start, end], optionally narrowed"""
+        if dataset not in self.datasets:
+            raise ValueError(f"Unknown archive dataset: {dataset} (available: {', '.join(self.datasets)})")
+        selected = self.partitions(dataset, start, end, indices)
+        filters = [('Ticker', 'in', list(tickers))] if tickers else None
+        with stage(PIPELINE, 'query', dataset=dataset, partitions=len(selected)):
+            frames = [pd.read_parquet(self.directory / key, columns=columns, filters=filters) for key in sorted(selected)]
+            frames = [frame for frame in frames if not frame.empty]
+            if not frames:
+                return pd.DataFrame(columns=columns or ['Ticker', 'Date', *PRICE_COLUMNS, 'Index'])
+            data = pd.concat(frames, ignore_index=True).drop(columns='_captured', errors='ignore')
+        return data.sort_values([c for c in ('Date', 'Ticker') if c in data.columns]).reset_index(drop=True)
+
+_archive = None
+
+def get_archive():
+    global _archive
+    if _archive is None:
+        _archive = Archive()
+    return _archive
@@ -0,0 +1,153 @@
+import sqlite3
+import datetime
+import pandas as pd
+import pytz
+from config import CACHE_DIR
+from market_calendar import trading_sessions
+from reshape import PRICE_DTYPE
+from sqlite_util import chunks
+
+BAR_STORE_PATH = CACHE_DIR / 'bars.sqlite'
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bars (
+    ticker TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    open REAL, high REAL, low REAL, close REAL, adj_close REAL, volume REAL,
+    PRIMARY KEY (ticker, interval, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    ticker TEXT NOT NULL,
+    interval TEXT NOT NULL,
+    day TEXT NOT NULL,
+    PRIMARY KEY (ticker, interval, day)
+) WITHOUT ROWID;
+"""
+
+def _exchange_today():
+    return datetime.datetime.now(pytz.timezone('America/New_York')).date()
+
+class BarStore:
+    """On-disk OHLC bars keyed by (ticker, interval, timestamp) with a per-day coverage index.
+
+    Timestamps are stored as UTC epoch seconds and returned as naive UTC datetimes.
+    A day is only recorded as covered once it is in the past, since earlier
+    trading days never change while the current one is still being filled in.
+    """
+
+    def __init__(self, path=BAR_STORE_PATH):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def missing_ranges(self, tickers, interval, start_date, end_date):
+        """Group tickers by the (start, end) day ranges they still need, end exclusive.
+
+        Only trading sessions are checked, so weekends and holidays never count
+        as gaps and consecutive missing sessions merge into one range.
+        """
+        days = trading_sessions(start_date, end_date)
+        if not days:
+            return {}
+
+        covered = {ticker: set() for ticker in tickers}
+        with self._connect() as conn:
+            for chunk in chunks(list(tickers)):
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f"SELECT ticker, day FROM coverage WHERE interval = ? AND day BETWEEN ? AND ? "
+                    f"AND ticker IN ({placeholders})",
+                    [interval, days[0].isoformat(), days[-1].isoformat(), *chunk],
+                )
+                for ticker, day in rows:
+                    covered[ticker].add(day)
+
+        gaps = {}
+        for ticker in tickers:
+            ranges = []
+            previous_missing = False
+            for day in days:
+                if day.isoformat() in covered[ticker]:
+                    previous_missing = False
+                    continue
+                if previous_missing:
+                    ranges[-1] = (ranges[-1][0], day + datetime.timedelta(days=1))
+                else:
+                    ranges.append((day, day + datetime.timedelta(days=1)))
+                previous_missing = True
+            if ranges:
+                gaps.setdefault(tuple(ranges), []).append(ticker)
+        return gaps
+
+    def save(self, data, interval):
+        """Upsert a long frame with Date (naive UTC), Ticker and price columns"""
+        if data is None or data.empty:
+            return
+
+        frame = data.dropna(subset=['Open', 'High', 'Low', 'Close'], how='all')
+        ts = frame['Date'].astype('datetime64[s]').astype('int64')
+        rows = zip(
+            frame['Ticker'].astype(str), [interval] * len(frame), ts.tolist(),
+            *(frame[col].astype(float).where(frame[col].notna(), None).tolist() for col in PRICE_COLUMNS)
+        )
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def mark_covered(self, tickers, interval, start_day, end_day):
+        """Record [start_day, end_day) as fetched for the tickers, skipping today and later"""
+        today = _exchange_today()
+        days = [d.date().isoformat() for d in pd.date_range(start_day, end_day, freq='D', inclusive='left')
+                if d.date() < today]
+        if not days:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO coverage VALUES (?, ?, ?)",
+                ((ticker, interval, day) for ticker in tickers for day in days),
+            )
+
+    def load(self, tickers, interval, start, end):
+        """Read bars for the tickers in [start, end) as a long frame"""
+        start_ts = int(pd.Timestamp(start).timestamp())
+        end_ts = int(pd.Timestamp(end).timestamp())
+        frames = []
+        with self._connect() as conn:
+            for chunk in chunks(list(tickers)):
+                placeholders = ','.join('?' * len(chunk))
+                frames.append(pd.read_sql_query(
+                    f"SELECT ts, ticker, open, high, low, close, adj_close, volume FROM bars "
+                    f"WHERE interval = ? AND ts >= ? AND ts < ? AND ticker IN ({placeholders}) "
+                    f"ORDER BY ts, ticker",
+                    conn, params=[interval, start_ts, end_ts, *chunk],
+                ))
+
+        data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if data.empty:
+            return pd.DataFrame()
+
+        data.columns = ['Date', 'Ticker', *PRICE_COLUMNS]
+        data['Date'] = pd.to_datetime(data['Date'], unit='s')
+        data['Ticker'] = data['Ticker'].astype('category')
+        if PRICE_DTYPE != data['Open'].dtype:
+            data[PRICE_COLUMNS] = data[PRICE_COLUMNS].astype(PRICE_DTYPE)
+        return data.sort_values(['Date', 'Ticker']).reset_index(drop=True)
+
+_store = None
+
+def get_bar_store():
+    """Shared store instance, opened on first use"""
+    global _store
+    if _store is None:
+        _store = BarStore()
+    return _store
@@ -0,0 +1,414 @@
+"""Offline benchmark for the generate_* pipelines.
+
+Every case runs in a fresh process against a synthetic market: yf.download and
+the SlickCharts pages are replaced by deterministic fakes, and all caches and
+outputs live in a temporary STOCK_DATA_DIR, so timings are repeatable and no
+network is touched. Results are saved as JSON for comparison across commits:
+
+    python benchmark.py --tickers 500 --formats xlsx,parquet
+    python benchmark.py --compare benchmark-abc1234.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import argparse
+import datetime
+import tempfile
+import platform
+import statistics
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+PIPELINES = ['all', 'realtime', 'specific_date', 'historic', 'historic_multisheet', 'historic_partitioned', 'index']
+
+# Pipelines that always write a spreadsheet regardless of the requested format
+XLSX_ONLY = {'index'}
+
+SESSION_OPEN = datetime.time(9, 30)
+SESSION_MINUTES = 390
+
+_INTERVAL_MINUTES = {'1m': 1, '2m': 2, '5m': 5, '15m': 15, '30m': 30, '60m': 60, '90m': 90, '1h': 60}
+
+class FakeMarket:
+    """Deterministic stand-in for yf.download returning wide (Ticker, Price) frames.
+
+    Intraday bars start at the open of every NYSE session in the requested
+    range; bars_per_session caps how many each session gets. The same request
+    always produces the same prices.
+    """
+
+    def __init__(self, as_of, bars_per_session=None, latency=0.0, seed=0):
+        self.as_of = pd.Timestamp(as_of).date()
+        self.bars_per_session = bars_per_session
+        self.latency = latency
+        self.seed = seed
+        self.calls = 0
+
+    def _sessions(self, start, end, period):
+        from market_calendar import trading_sessions, previous_trading_day
+
+        if period:
+            count = int(period[:-1]) if period.endswith('d') else 1
+            last = previous_trading_day(self.as_of)
+            return trading_sessions(last - datetime.timedelta(days=count * 2 + 7), last)[-count:]
+
+        start_day = pd.Timestamp(start).tz_convert('America/New_York').date() \
+            if pd.Timestamp(start).tzinfo else pd.Timestamp(start).date()
+        if end is None:
+            end_day = self.as_of
+        else:
+            end_day = pd.Timestamp(end).date() - datetime.timedelta(days=1)
+        return trading_sessions(start_day, min(end_day, self.as_of))
+
+    def _index(self, sessions, interval):
+        if interval == '1d':
+            return pd.DatetimeIndex(sessions).tz_localize('America/New_York').rename('Date')
+
+        step = _INTERVAL_MINUTES[interval]
+        count = -(-SESSION_MINUTES // step)
+        if self.bars_per_session:
+            count = min(count, self.bars_per_session)
+        offsets = pd.to_timedelta(np.arange(count) * step, unit='m')
+        opens = pd.DatetimeIndex([datetime.datetime.combine(day, SESSION_OPEN) for day in sessions])
+        if opens.empty:
+            return pd.DatetimeIndex([], tz='UTC', name='Datetime')
+        stamps = (opens.tz_localize('America/New_York').tz_convert('UTC').values[:, None]
+                  + offsets.values[None, :]).ravel()
+        return pd.DatetimeIndex(stamps).tz_localize('UTC').rename('Datetime')
+
+    def download(self, tickers, start=None, end=None, period=None, interval='1d', **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+
+        index = self._index(self._sessions(start, end, period), interval)
+        if start is not None and pd.Timestamp(start).tzinfo is not None:
+            index = index[index >= pd.Timestamp(start)]
+        if index.empty or not tickers:
+            return pd.DataFrame()
+
+        key = f"{','.join(tickers)}|{index[0]}|{interval}|{self.seed}".encode()
+        rng = np.random.default_rng(zlib.crc32(key))
+        shape = (len(index), len(tickers))
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.002, shape), axis=0))
+        open_ = close * (1 + rng.normal(0, 0.001, shape))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.001, shape)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.001, shape)))
+        volume = rng.integers(1_000, 1_000_000, shape).astype(float)
+
+        values = np.stack([open_, high, low, close, close, volume], axis=2).reshape(len(index), -1)
+        columns = pd.MultiIndex.from_product(
+            [tickers, ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']], names=['Ticker', 'Price'])
+        return pd.DataFrame(values, index=index, columns=columns)
+
+def synthetic_components(count):
+    """Overlapping SP500 / Nasdaq100 / DowJones memberships over count synthetic symbols"""
+    symbols = [f'SYN{i:05d}' for i in range(count)]
+    return {
+        'SP500': symbols[:max(1, count * 4 // 5)],
+        'Nasdaq100': symbols[count * 3 // 5:],
+        'DowJones': symbols[::max(1, count // 30)][:30],
+    }
+
+def fake_components_page(symbols):
+    """HTML shaped like a SlickCharts components table"""
+    rows = ''.join(
+        f'<tr><td>{rank}</td><td><a href="/symbol/{symbol}">{symbol} Corp</a></td>'
+        f'<td><a href="/symbol/{symbol}">{symbol}</a></td><td>0.1%</td></tr>'
+        for rank, symbol in enumerate(symbols, start=1)
+    )
+    return (
+        '<html><body><table class="table table-hover table-borderless table-sm">'
+        f'<thead><tr><th>#</th><th>Company</th><th>Symbol</th><th>Weight</th></tr></thead>'
+        f'<tbody>{rows}</tbody></table></body></html>'
+    ).encode()
+
+class _FakeResponse:
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+class FakePageSource:
+    """requests.Session stand-in serving synthetic component pages by URL"""
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get(self, url, headers=None, timeout=None):
+        return _FakeResponse(self.pages[url])
+
+class _StageTimer:
+    """Accumulates wall time per stage around wrapped callables"""
+
+    def __init__(self):
+        self.durations = {}
+        self.rows = 0
+
+    def add(self, stage, seconds):
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def wrap(self, stage, func, count_rows=False):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+                if count_rows and args:
+                    self.rows += len(args[0])
+        return wrapper
+
+    def wrap_sink(self, stage, sink_class):
+        """ExcelSink subclass timed from open to the finished file, counting the rows written"""
+        timer = self
+
+        class TimedSink(sink_class):
+            def __enter__(self):
+                self._started = time.perf_counter()
+                return super().__enter__()
+
+            def __exit__(self, *exc_info):
+                try:
+                    return super().__exit__(*exc_info)
+                finally:
+                    timer.add(stage, time.perf_counter() - self._started)
+
+            def write_frame(self, df, *args, **kwargs):
+                timer.rows += len(df)
+                return super().write_frame(df, *args, **kwargs)
+
+        return TimedSink
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def _run_case(case):
+    """Run one pipeline/format case in this (fresh) process and return its measurements"""
+    workdir = tempfile.mkdtemp(prefix='stock-bench-')
+    os.environ['STOCK_DATA_DIR'] = workdir
+    # The upstream rate limit would dominate synthetic timings
+    os.environ.setdefault('YF_REQUESTS_PER_SECOND', '1000000')
+    if not case['verbose']:
+        os.environ['STOCK_DATA_LOG_LEVEL'] = 'WARNING'
+
+    import yfinance as yf
+    import scrape_tickers
+    import exporters
+    import metrics
+    import all_components
+    import realtime_data
+    import specific_date
+    import historic_data
+    from market_calendar import trading_sessions
+
+    market = FakeMarket(case['as_of'], case['bars'], case['latency'])
+    yf.download = market.download
+
+    components = synthetic_components(case['tickers'])
+    pages = {url: fake_components_page(components[index])
+             for index, url in scrape_tickers.INDICES.items() if isinstance(url, str)}
+    scrape_tickers._get_session = lambda: FakePageSource(pages)
+
+    timer = _StageTimer()
+    scrape_tickers.refresh_index_components = timer.wrap('scrape', scrape_tickers.refresh_index_components)
+    for module in (all_components, realtime_data, specific_date, historic_data):
+        module.download_bars = timer.wrap('download', module.download_bars)
+        module.write_export = timer.wrap('write', module.write_export, count_rows=True)
+    historic_data.write_partitioned = timer.wrap('write', historic_data.write_partitioned, count_rows=True)
+    scrape_tickers.ExcelSink = timer.wrap_sink('write', scrape_tickers.ExcelSink)
+
+    sessions = trading_sessions(pd.Timestamp(case['as_of']) - pd.Timedelta(days=case['sessions'] * 2 + 14),
+                                case['as_of'])[-case['sessions']:]
+    pipeline, file_format = case['pipeline'], case['format']
+    extension = '.zip' if pipeline == 'historic_partitioned' else exporters.get_export_format(file_format).extension
+    output_path = os.path.join(workdir, f"{pipeline}{extension}")
+
+    analytics = case['analytics'] or None
+
+    def run():
+        if pipeline == 'all':
+            return all_components.generate_all_data(output_path, file_format=file_format)
+        if pipeline == 'realtime':
+            return realtime_data.generate_realtime_data(output_path, file_format=file_format, analytics=analytics)
+        if pipeline == 'specific_date':
+            dates = sessions[-case['snapshot_dates']:]
+            return specific_date.generate_specific_date_data(
+                output_path, dates[0] if len(dates) == 1 else dates, file_format=file_format, analytics=analytics)
+        if pipeline in ('historic', 'historic_multisheet', 'historic_partitioned'):
+            return historic_data.generate_historic_data(
+                output_path, sessions[0], sessions[-1], file_format=file_format,
+                multisheet=pipeline == 'historic_multisheet',
+                partition_files='Ticker' if pipeline == 'historic_partitioned' else None, analytics=analytics)
+        if pipeline == 'index':
+            return scrape_tickers.generate_index_name(output_path)
+        raise ValueError(f"Unknown pipeline: {pipeline}")
+
+    try:
+        if case['warm']:
+            # Fill the bar store, components cache and realtime state before measuring
+            run()
+            timer.durations.clear()
+            timer.rows = 0
+            market.calls = 0
+        instrumented = metrics.STAGE_SECONDS.sums()
+        base_rss = _peak_rss_mb()
+        started = time.perf_counter()
+        result = run()
+        wall = time.perf_counter() - started
+
+        stages = {stage: round(seconds, 4) for stage, seconds in timer.durations.items()}
+        stages['transform'] = round(max(0.0, wall - sum(timer.durations.values())), 4)
+        pipeline_stages = {f'{key[0]}.{key[1]}': round(total - instrumented.get(key, 0.0), 4)
+                           for key, total in metrics.STAGE_SECONDS.sums().items()
+                           if total - instrumented.get(key, 0.0) > 0}
+        return {
+            'pipeline': pipeline,
+            'format': file_format,
+            'ok': bool(result) and os.path.exists(output_path),
+            'wall_s': round(wall, 4),
+            'stages_s': stages,
+            'pipeline_stages_s': pipeline_stages,
+            'rows': timer.rows,
+            'rows_per_s': round(timer.rows / wall, 1) if wall else None,
+            'output_bytes': os.path.getsize(output_path) if os.path.exists(output_path) else 0,
+            'base_rss_mb': base_rss,
+            'peak_rss_mb': _peak_rss_mb(),
+            'download_calls': market.calls,
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def summarize(results):
+    """Median wall time, rows/sec and peak RSS per (pipeline, format)"""
+    grouped = {}
+    for result in results:
+        grouped.setdefault((result['pipeline'], result['format']), []).append(result)
+
+    summary = []
+    for (pipeline, file_format), runs in grouped.items():
+        summary.append({
+            'pipeline': pipeline,
+            'format': file_format,
+            'runs': len(runs),
+            'ok': all(run['ok'] for run in runs),
+            'wall_s': round(statistics.median(run['wall_s'] for run in runs), 4),
+            'rows': runs[0]['rows'],
+            'rows_per_s': round(statistics.median(run['rows_per_s'] or 0 for run in runs), 1),
+            'peak_rss_mb': max((run['peak_rss_mb'] or 0) for run in runs),
+        })
+    return summary
+
+def _print_table(summary, baseline=None):
+    previous = {(row['pipeline'], row['format']): row for row in (baseline or [])}
+    header = f"{'pipeline':<20} {'format':<8} {'wall s':>9} {'rows':>9} {'rows/s':>11} {'peak MB':>8}"
+    print(header + ('  vs baseline' if baseline else ''))
+    for row in summary:
+        line = (f"{row['pipeline']:<20} {row['format']:<8} {row['wall_s']:>9.3f} {row['rows']:>9} "
+                f"{row['rows_per_s']:>11.1f} {row['peak_rss_mb']:>8.1f}")
+        if not row['ok']:
+            line += '  FAILED'
+        old = previous.get((row['pipeline'], row['format']))
+        if old and old['wall_s']:
+            line += f"  {row['wall_s'] / old['wall_s']:.2f}x"
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pipelines', default=','.join(PIPELINES),
+                        help='Comma-separated pipelines to run (default: all of them)')
+    parser.add_argument('--formats', default=None, help='Comma-separated export formats (default: every format)')
+    parser.add_argument('--tickers', type=int, default=500, help='Synthetic symbols across the scraped indices')
+    parser.add_argument('--bars', type=int, default=None, help='Cap on bars per session (default: a full session)')
+    parser.add_argument('--sessions', type=int, default=20, help='Trading sessions covered by historic exports')
+    parser.add_argument('--snapshot-dates', type=int, default=1, help='Dates in the specific-date export')
+    parser.add_argument('--as-of', default='2024-06-14', help='Last session of the synthetic market')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated seconds per yf.download call')
+    parser.add_argument('--analytics', default=None,
+                        help="Analytics windows for realtime, specific-date and historic, e.g. '5,20' (default: off)")
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case, each in a fresh process')
+    parser.add_argument('--warm', action='store_true', help='Measure a second run with warm local caches')
+    parser.add_argument('--output', default=None, help='Results JSON path (default: benchmark-<commit>.json)')
+    parser.add_argument('--compare', default=None, help='Earlier results JSON to compare wall times against')
+    parser.add_argument('--verbose', action='store_true', help='Show pipeline output')
+    args = parser.parse_args(argv)
+
+    from exporters import EXPORT_FORMATS
+
+    pipelines = [name.strip() for name in args.pipelines.split(',') if name.strip()]
+    unknown = set(pipelines) - set(PIPELINES)
+    if unknown:
+        parser.error(f"Unknown pipelines: {', '.join(sorted(unknown))}")
+    formats = [name.strip() for name in (args.formats or ','.join(EXPORT_FORMATS)).split(',') if name.strip()]
+    unknown = set(formats) - set(EXPORT_FORMATS)
+    if unknown:
+        parser.error(f"Unknown formats: {', '.join(sorted(unknown))}")
+
+    cases = []
+    for pipeline in pipelines:
+        for file_format in (['xlsx'] if pipeline in XLSX_ONLY else formats):
+            for _ in range(args.repeat):
+                cases.append({
+                    'pipeline': pipeline, 'format': file_format, 'tickers': args.tickers, 'bars': args.bars,
+                    'sessions': args.sessions, 'snapshot_dates': args.snapshot_dates, 'as_of': args.as_of,
+                    'latency': args.latency, 'warm': args.warm, 'verbose': args.verbose, 'analytics': args.analytics,
+                })
+
+    # One process per case keeps caches cold and makes peak RSS attributable to that case
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(_run_case, case).result())
+
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'verbose')},
+        'summary': summarize(results),
+        'results': results,
+    }
+
+    output = args.output or f"benchmark-{commit or 'local'}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('summary')
+    _print_table(report['summary'], baseline)
+    print(f"Results saved to {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Command-line batch runner for the export pipelines, without the web server.
+
+    python cli.py run historic --from 2024-01-01 --to 2024-03-31 --index SP500,DowJones --format parquet
+    python cli.py run realtime --tickers-file watch.csv --workers 4 --fan-out chunks
+    python cli.py run specific-date --date 2024-05-31 --rule monthly --to 2024-12-31 --dry-run
+    python cli.py indices
+    python cli.py archive compact
+    python cli.py archive query realtime --from 2024-05-01 --to 2024-05-31 --index SP500 --output may.parquet
+
+With --workers above 1 the indices (or ticker chunks) run as separate
+processes, each writing its own file. pandas, yfinance and the pipelines are
+only imported once a command needs them, so --help starts instantly and
+--dry-run never touches the network unless it has to resolve --index.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import config
+
+# pipeline -> (module, generate function)
+PIPELINES = {
+    'historic': ('historic_data', 'generate_historic_data'),
+    'specific-date': ('specific_date', 'generate_specific_date_data'),
+    'realtime': ('realtime_data', 'generate_realtime_data'),
+    'all': ('all_components', 'generate_all_data'),
+    'index-components': ('scrape_tickers', 'generate_index_name'),
+}
+
+def _output_dir(args):
+    if args.pipeline == 'historic':
+        if args.partition:
+            return config.MANUAL_HISTORIC_PARTITIONED_DIR
+        return config.MANUAL_HISTORIC_MULTIPLE_DIR if args.multisheet else config.MANUAL_HISTORIC_SINGLE_DIR
+    return {
+        'specific-date': config.MANUAL_HISTORIC_SPECIFIC_DIR,
+        'realtime': config.MANUAL_REALTIME_DIR,
+        'all': config.MANUAL_DAILY_DIR,
+        'index-components': config.INDEX_COMPONENTS,
+    }[args.pipeline]
+
+def _extension(args):
+    if args.pipeline == 'index-components':
+        return '.xlsx'
+    if args.pipeline == 'historic' and args.partition:
+        return '.zip'
+    from exporters import get_export_format
+    return get_export_format(args.format).extension
+
+def _split_csv(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+def _requested_tickers(args):
+    """Index -> tickers map from --tickers-file / --watchlist, narrowed by --index; None means every index"""
+    tickers = None
+    if args.tickers_file:
+        from watchlists import parse_ticker_file
+        with open(args.tickers_file, 'rb') as f:
+            tickers = parse_ticker_file(args.tickers_file, f.read())
+    elif args.watchlist:
+        from watchlists import watchlists
+        watchlist = watchlists.get(args.watchlist)
+        if watchlist is None:
+            raise SystemExit(f"Unknown watchlist: {args.watchlist}")
+        tickers = watchlist['tickers']
+
+    indices = _split_csv(args.index)
+    if indices:
+        if tickers is None:
+            from scrape_tickers import get_index_components
+            tickers, _ = get_index_components()
+        unknown = [index for index in indices if index not in tickers]
+        if unknown:
+            raise SystemExit(f"Unknown indices: {', '.join(unknown)} (available: {', '.join(tickers)})")
+        tickers = {index: tickers[index] for index in indices}
+    return tickers
+
+def _chunk_maps(tickers, chunks):
+    """Split an index map into `chunks` maps over disjoint ticker sets, keeping each ticker's indices"""
+    membership = {}
+    for index, symbols in tickers.items():
+        for symbol in symbols:
+            membership.setdefault(symbol, []).append(index)
+    symbols = list(membership)
+    size = -(-len(symbols) // max(1, chunks))
+    maps = []
+    for start in range(0, len(symbols), size or 1):
+        part = symbols[start:start + size]
+        chunk = {}
+        for symbol in part:
+            for index in membership[symbol]:
+                chunk.setdefault(index, []).append(symbol)
+        maps.append(chunk)
+    return maps
+
+def _plan_units(args):
+    """(label, ticker map or None, output path) for every process the run is split into"""
+    directory = os.path.dirname(args.output) if args.output else str(_output_dir(args))
+    extension = _extension(args)
+    if args.output:
+        name = os.path.basename(args.output)
+        stem = name[:-len(extension)] if name.endswith(extension) else name
+    else:
+        stem = f'Market data-{args.pipeline}-cli-{time.strftime("%d%m%y-%H%M%S")}'
+
+    tickers = _requested_tickers(args)
+    if args.workers <= 1 or args.pipeline == 'index-components':
+        return [('all', tickers, os.path.join(directory, stem + extension))]
+
+    if tickers is None:
+        from scrape_tickers import get_index_components
+        tickers, _ = get_index_components()
+    if args.fan_out == 'index':
+        maps = [(index, {index: symbols}) for index, symbols in tickers.items()]
+    else:
+        chunks = _chunk_maps(tickers, args.chunks or args.workers)
+        maps = [(f'part{n:03d}', chunk) for n, chunk in enumerate(chunks, 1)]
+    return [(label, chunk, os.path.join(directory, f'{stem}-{label}{extension}')) for label, chunk in maps]
+
+def _pipeline_kwargs(args):
+    """Keyword arguments of the generate_* function besides output_path and tickers"""
+    if args.pipeline == 'index-components':
+        return {}
+    kwargs = {'file_format': args.format}
+    if args.pipeline in ('historic', 'specific-date', 'realtime') and args.analytics:
+        kwargs['analytics'] = True if args.analytics == 'default' else args.analytics
+    if args.pipeline in ('historic', 'specific-date') and args.snapshot:
+        from snapshots import normalize_rule
+        kwargs['snapshot'] = normalize_rule(args.snapshot)
+    if args.pipeline == 'historic':
+        if args.days:
+            end = datetime.date.today()
+            kwargs['start_date'], kwargs['end_date'] = (end - datetime.timedelta(days=args.days)).isoformat(), end.isoformat()
+        else:
+            if not (args.start and args.end):
+                raise SystemExit('historic needs --from and --to, or --days')
+            kwargs['start_date'], kwargs['end_date'] = args.start, args.end
+        kwargs['multisheet'] = args.multisheet
+        kwargs['partition_files'] = {'ticker': 'Ticker', 'index': 'Index'}.get(args.partition)
+    elif args.pipeline == 'specific-date':
+        dates = [d for value in args.date for d in _split_csv(value)]
+        if args.rule:
+            if not (dates or args.start):
+                raise SystemExit('--rule needs a --date or --from to start at')
+            from specific_date import expand_dates
+            dates = [day.isoformat() for day in expand_dates(args.start or dates[0], args.end or dates[0], args.rule)]
+        if not dates:
+            raise SystemExit('specific-date needs --date (or --rule with a range)')
+        kwargs['specific_date'] = dates[0] if len(dates) == 1 else sorted(set(dates))
+        kwargs['roll'] = not args.no_roll
+        kwargs['per_date_sheets'] = args.per_date_sheets
+    return kwargs
+
+def _run_unit(pipeline, output_path, tickers, kwargs):
+    """Run one generate_* call; executed in a pool worker when fanning out"""
+    import importlib
+    module_name, function_name = PIPELINES[pipeline]
+    generate = getattr(importlib.import_module(module_name), function_name)
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    started = time.perf_counter()
+    if pipeline == 'index-components':
+        result = generate(output_path)
+    else:
+        result = generate(output_path, tickers=tickers or None, **kwargs)
+    return result, round(time.perf_counter() - started, 3)
+
+def cmd_run(args):
+    if args.quiet:
+        os.environ['STOCK_DATA_LOG_LEVEL'] = 'WARNING'
+    kwargs = _pipeline_kwargs(args)
+    units = _plan_units(args)
+
+    if args.dry_run:
+        for label, tickers, output_path in units:
+            count = len({s for symbols in tickers.values() for s in symbols}) if tickers else 'all'
+            print(json.dumps({'unit': label, 'tickers': count, 'indices': list(tickers) if tickers else 'all',
+                              'output': output_path, 'params': kwargs}, default=str))
+        return 0
+
+    failed = 0
+    if len(units) == 1:
+        label, tickers, output_path = units[0]
+        result, seconds = _run_unit(args.pipeline, output_path, tickers, kwargs)
+        failed += not result
+        print(json.dumps({'unit': label, 'ok': bool(result), 'output': result, 'seconds': seconds}))
+        return 1 if failed else 0
+
+    # Each worker already is one of the cores, so its partitioned writes stay in-process
+    os.environ.setdefault('STOCK_DATA_EXPORT_WORKERS', '1')
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(args.workers, len(units)), mp_context=context) as executor:
+        futures = {executor.submit(_run_unit, args.pipeline, output_path, tickers, kwargs): label
+                   for label, tickers, output_path in units}
+        for future in as_completed(futures):
+            try:
+                result, seconds = future.result()
+            except Exception as e:
+                result, seconds = None, None
+                print(json.dumps({'unit': futures[future], 'ok': False, 'error': str(e)}))
+            else:
+                print(json.dumps({'unit': futures[future], 'ok': bool(result), 'output': result, 'seconds': seconds}))
+            failed += not result
+    return 1 if failed else 0
+
+def cmd_indices(args):
+    from scrape_tickers import get_index_components
+    components, _ = get_index_components()
+    for index, symbols in components.items():
+        print(f'{index}\t{len(symbols)}')
+    return 0
+
+def cmd_archive(args):
+    from archive import get_archive, DATASETS
+    if args.dataset not in DATASETS:
+        raise SystemExit(f"Unknown archive dataset: {args.dataset} (available: {', '.join(DATASETS)})")
+    archive = get_archive()
+    if args.action == 'compact':
+        print(json.dumps(archive.compact(workers=args.workers, dry_run=args.dry_run), default=str))
+        return 0
+    data = archive.query(args.dataset, args.start, args.end, indices=_split_csv(args.index) or None,
+                         tickers=_split_csv(args.tickers) or None)
+    if args.output:
+        from exporters import write_export
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        write_export(data, args.output, args.format, sheet_name='Archive', columns=list(data.columns))
+    print(json.dumps({'dataset': args.dataset, 'rows': len(data), 'output': args.output}))
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Run the stock data export pipelines without the web app')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Run one pipeline and write its export')
+    run.add_argument('pipeline', choices=list(PIPELINES))
+    run.add_argument('--from', dest='start', help='First date (historic range, or start of a specific-date --rule)')
+    run.add_argument('--to', dest='end', help='Last date (historic range, or end of a specific-date --rule)')
+    run.add_argument('--days', type=int, help='Historic: the last N days instead of --from/--to')
+    run.add_argument('--date', action='append', default=[], help='Specific date(s), comma-separated or repeated')
+    run.add_argument('--rule', help='Specific-date repeat rule: daily, weekly, monthly or a weekday')
+    run.add_argument('--no-roll', action='store_true', help='Skip closed days instead of using the previous session')
+    run.add_argument('--per-date-sheets', action='store_true', help='One sheet (row group) per specific date')
+    run.add_argument('--multisheet', action='store_true', help='Historic: one sheet (row group) per ticker')
+    run.add_argument('--partition', choices=['ticker', 'index'], help='Historic: zip of one file per ticker or index')
+    run.add_argument('--analytics', nargs='?', const='default',
+                     help='Add returns, SMA, volatility and gaps; optional windows such as 5,20')
+    run.add_argument('--snapshot', help='Bar kept per session: close (default), first_after_open or at_or_before:HH:MM')
+    run.add_argument('--index', help='Comma-separated indices to export (default: every index)')
+    run.add_argument('--tickers-file', help='xlsx/xls/csv with Ticker and Index columns, or a txt list')
+    run.add_argument('--watchlist', help='ID of a saved watchlist')
+    run.add_argument('--format', default='xlsx', help='Export format: xlsx, parquet, arrow or csv.gz')
+    run.add_argument('--output', help='Output file (fan-out adds -<index> or -partNNN before the extension)')
+    run.add_argument('--workers', type=int, default=1, help='Processes to fan out over; 0 means one per core')
+    run.add_argument('--fan-out', choices=['index', 'chunks'], default='index',
+                     help='Split into one process per index, or into ticker chunks')
+    run.add_argument('--chunks', type=int, help='Number of ticker chunks (default: --workers)')
+    run.add_argument('--dry-run', action='store_true', help='Print the planned units and outputs, then exit')
+    run.add_argument('--quiet', action='store_true', help='Only log warnings and errors')
+    run.set_defaults(func=cmd_run)
+
+    archive = commands.add_parser('archive', help='Compact snapshot exports into the Parquet archive, or query it')
+    archive.add_argument('action', choices=['compact', 'query'])
+    archive.add_argument('dataset', nargs='?', default='realtime', help='Dataset to query: realtime or daily')
+    archive.add_argument('--from', dest='start', help='First exchange-local day to query')
+    archive.add_argument('--to', dest='end', help='Last exchange-local day to query')
+    archive.add_argument('--index', help='Comma-separated indices to query')
+    archive.add_argument('--tickers', help='Comma-separated tickers to query')
+    archive.add_argument('--output', help='Write the query result to this file')
+    archive.add_argument('--format', default='parquet', help='Format of --output: xlsx, parquet, arrow or csv.gz')
+    archive.add_argument('--workers', type=int, default=None, help='Processes parsing export files')
+    archive.add_argument('--dry-run', action='store_true', help='List the files a compaction would ingest')
+    archive.set_defaults(func=cmd_archive)
+
+    indices = commands.add_parser('indices', help='List the known indices and their component counts')
+    indices.set_defaults(func=cmd_indices)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'archive' and args.workers is None:
+        from archive import READ_WORKERS
+        args.workers = READ_WORKERS
+    if getattr(args, 'workers', 1) == 0:
+        args.workers = os.cpu_count() or 1
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
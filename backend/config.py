@@ -0,0 +1,41 @@
+import os
+from pathlib import Path
+
+# Define the base directory where the "stock-data" folder will be located (STOCK_DATA_DIR overrides it)
+BASE_DIR = Path(os.environ.get('STOCK_DATA_DIR') or Path(__file__).resolve().parent.parent.parent.parent / 'stock-data')
+
+# Local caches that are reused between requests (bar store, scraped components, ...)
+CACHE_DIR = BASE_DIR / 'cache'
+
+# Compacted Parquet archive of the realtime and daily snapshot exports
+ARCHIVE_DIR = BASE_DIR / 'archive'
+
+# Saved ticker watchlists, referenced by ID from the download forms
+WATCHLIST_DIR = BASE_DIR / 'watchlists'
+
+# Define the full paths for the required folders
+SCHEDULED_DATA_DIR = BASE_DIR / 'scheduled'
+SCHEDULED_DAILY_DIR = SCHEDULED_DATA_DIR / 'daily'
+SCHEDULED_REALTIME_DIR = SCHEDULED_DATA_DIR / 'realtime'
+
+MANUAL_DATA_DIR = BASE_DIR / 'manual'
+INDEX_COMPONENTS = BASE_DIR / 'index_components'
+MANUAL_DAILY_DIR = MANUAL_DATA_DIR / 'daily'
+MANUAL_REALTIME_DIR = MANUAL_DATA_DIR / 'realtime'
+MANUAL_HISTORIC_DIR = MANUAL_DATA_DIR / 'historic'
+MANUAL_HISTORIC_SINGLE_DIR = MANUAL_HISTORIC_DIR / 'Single-sheet'
+MANUAL_HISTORIC_MULTIPLE_DIR = MANUAL_HISTORIC_DIR / 'Multiple-sheet'
+MANUAL_HISTORIC_SPECIFIC_DIR = MANUAL_HISTORIC_DIR / 'Specific-sheet'
+MANUAL_HISTORIC_PARTITIONED_DIR = MANUAL_HISTORIC_DIR / 'Partitioned'
+
+# Export folders the web app writes into; the CLI only creates the one it writes to
+DATA_DIRS = (
+    SCHEDULED_DAILY_DIR, SCHEDULED_REALTIME_DIR, MANUAL_DAILY_DIR, MANUAL_REALTIME_DIR, INDEX_COMPONENTS,
+    MANUAL_HISTORIC_SINGLE_DIR, MANUAL_HISTORIC_MULTIPLE_DIR, MANUAL_HISTORIC_SPECIFIC_DIR,
+    MANUAL_HISTORIC_PARTITIONED_DIR,
+)
+
+def ensure_data_dirs():
+    """Create every export folder (importing this module never touches the disk)"""
+    for directory in DATA_DIRS:
+        directory.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,164 @@
+import os
+import time
+import random
+import logging
+import threading
+import yfinance as yf
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import get_logger, log_event, UPSTREAM_ERRORS
+
+# Tunables, overridable from the environment
+CHUNK_SIZE = int(os.environ.get('YF_CHUNK_SIZE', 100))
+MIN_CHUNK_SIZE = int(os.environ.get('YF_MIN_CHUNK_SIZE', 10))
+MAX_CHUNK_SIZE = int(os.environ.get('YF_MAX_CHUNK_SIZE', 250))
+WORKERS = int(os.environ.get('YF_WORKERS', 4))
+REQUESTS_PER_SECOND = float(os.environ.get('YF_REQUESTS_PER_SECOND', 20))
+MAX_RETRIES = int(os.environ.get('YF_MAX_RETRIES', 3))
+TARGET_LATENCY = float(os.environ.get('YF_TARGET_LATENCY', 20))
+
+logger = get_logger(__name__)
+
+class TokenBucket:
+    """Blocking token bucket; yfinance issues roughly one HTTP request per ticker"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+class AdaptiveChunkSize:
+    """Additive increase / multiplicative decrease of the chunk size from observed latency and errors"""
+
+    def __init__(self, initial, minimum, maximum, target_latency):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def current(self):
+        with self._lock:
+            return self.size
+
+    def record(self, chunk_size, latency, failed):
+        with self._lock:
+            if failed or latency > self.target_latency:
+                self.size = max(self.minimum, self.size // 2)
+            elif chunk_size >= self.size:
+                self.size = min(self.maximum, self.size + max(1, self.size // 10))
+
+# Shared across calls so concurrent jobs stay under one upstream budget
+_bucket = TokenBucket(REQUESTS_PER_SECOND, max(MAX_CHUNK_SIZE, 1))
+_chunk_size = AdaptiveChunkSize(CHUNK_SIZE, MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, TARGET_LATENCY)
+
+def _as_multiindex(data, tickers):
+    """Single-ticker downloads can come back with flat columns; make them (Ticker, Price)"""
+    if isinstance(data.columns, pd.MultiIndex):
+        return data
+    data = data.copy()
+    data.columns = pd.MultiIndex.from_product([[tickers[0]], data.columns])
+    return data
+
+def _unpriced(data, tickers):
+    """Requested tickers without a single priced bar in a download.
+
+    yf.download catches per-ticker errors (rate limits included) itself and
+    leaves those tickers missing or all-NaN, so this is the only failure
+    signal it gives.
+    """
+    if data is None or data.empty:
+        return list(tickers)
+    prices = data.loc[:, data.columns.get_level_values(1) != 'Volume']
+    priced = prices.notna().any().groupby(level=0).any()
+    priced = {str(ticker).upper() for ticker, has_bars in priced.items() if has_bars}
+    return [ticker for ticker in tickers if ticker.upper() not in priced]
+
+def _download_chunk(tickers, kwargs):
+    """Download one chunk, retrying the tickers that errored or came back without bars with exponential backoff.
+
+    Returns (frame, failed) where failed lists the tickers still without bars
+    after every retry.
+    """
+    frames = []
+    pending = list(tickers)
+    for attempt in range(MAX_RETRIES + 1):
+        _bucket.acquire(len(pending))
+        started = time.monotonic()
+        try:
+            data = yf.download(pending, group_by='ticker', auto_adjust=False, progress=False, **kwargs)
+            data = _as_multiindex(data, pending) if data is not None and not data.empty else None
+        except Exception as e:
+            log_event(logger, 'download_failed', logging.WARNING, tickers=len(pending), attempt=attempt + 1,
+                      error=str(e))
+            data = None
+        missing = _unpriced(data, pending)
+        _chunk_size.record(len(pending), time.monotonic() - started, bool(missing))
+
+        if len(missing) < len(pending):
+            unpriced = {ticker.upper() for ticker in missing}
+            frames.append(data.loc[:, ~data.columns.get_level_values(0).str.upper().isin(unpriced)])
+        if not missing:
+            break
+        UPSTREAM_ERRORS.inc(source='yfinance', index='')
+        pending = missing
+        if attempt < MAX_RETRIES:
+            log_event(logger, 'download_retry', logging.WARNING, tickers=len(pending), attempt=attempt + 1)
+            time.sleep(min(30, 2 ** attempt) + random.uniform(0, 1))
+
+    if not frames:
+        return pd.DataFrame(), missing
+    return (frames[0] if len(frames) == 1 else pd.concat(frames, axis=1).sort_index()), missing
+
+def download_bars(tickers, failed=None, **kwargs):
+    """yf.download for any number of tickers, split into adaptive chunks on a bounded pool.
+
+    Accepts the same keyword arguments as yf.download (start, end, period,
+    interval, ...) and returns one wide frame with (Ticker, Price) columns.
+    Tickers that still had no bars after every retry (errors, throttling, or
+    nothing traded) are appended to the failed list when one is given.
+    """
+    tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+    if not tickers:
+        return pd.DataFrame()
+
+    frames = []
+    remaining = list(tickers)
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        pending = set()
+        while remaining or pending:
+            # Keep at most WORKERS chunks in flight, sized from the latest observations
+            while remaining and len(pending) < WORKERS:
+                size = _chunk_size.current()
+                chunk, remaining = remaining[:size], remaining[size:]
+                future = executor.submit(_download_chunk, chunk, kwargs)
+                pending.add(future)
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                data, chunk_failed = future.result()
+                if failed is not None:
+                    failed.extend(chunk_failed)
+                if not data.empty:
+                    frames.append(data)
+
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, axis=1).sort_index()
@@ -0,0 +1,55 @@
+import os
+import xlsxwriter
+import pandas as pd
+
+# Rows converted from the DataFrame per batch written to the worksheet
+CHUNK_ROWS = 10000
+
+class ExcelSink:
+    """Stream DataFrames into an xlsx file with constant memory, then move it into place.
+
+    Rows are flushed to disk as they are written instead of building the whole
+    workbook in memory. The file is written next to `path` and renamed over it
+    only once the workbook is complete, so readers never see a partial file.
+    """
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        self.path = str(path)
+        self.tmp_path = f"{self.path}.partial"
+        self.chunk_rows = chunk_rows
+        self.workbook = None
+
+    def __enter__(self):
+        self.workbook = xlsxwriter.Workbook(self.tmp_path, {
+            'constant_memory': True,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+            'remove_timezone': True,
+        })
+        self.header_format = self.workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.workbook.close()
+        except Exception:
+            if exc_type is None:
+                raise
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        return False
+
+    def write_frame(self, df, sheet_name):
+        """Write a DataFrame (header + rows, no index) to a new worksheet chunk by chunk"""
+        worksheet = self.workbook.add_worksheet(str(sheet_name)[:31])
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], self.header_format)
+
+        row = 1
+        for start in range(0, len(df), self.chunk_rows):
+            chunk = df.iloc[start:start + self.chunk_rows]
+            values = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+            for record in values:
+                worksheet.write_row(row, 0, [v.to_pydatetime() if isinstance(v, pd.Timestamp) else v for v in record])
+                row += 1
+        return row - 1
@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from excel_sink import ExcelSink
+
+# Processes serializing partitioned exports; defaults to one per core
+EXPORT_WORKERS = int(os.environ.get('STOCK_DATA_EXPORT_WORKERS', os.cpu_count() or 1))
+
+class ExportFormat:
+    """A registered output format and the function that writes it"""
+
+    def __init__(self, name, extension, label, writer, columnar):
+        self.name = name
+        self.extension = extension
+        self.label = label
+        self.writer = writer
+        self.columnar = columnar
+
+EXPORT_FORMATS = {}
+
+def register_format(name, extension, label, columnar=True):
+    """Register writer(data, path, sheet_name, partition_by) under a format name"""
+    def decorator(writer):
+        EXPORT_FORMATS[name] = ExportFormat(name, extension, label, writer, columnar)
+        return writer
+    return decorator
+
+def get_export_format(name):
+    if name not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {name}")
+    return EXPORT_FORMATS[name]
+
+def _export_columns(data, export_format, columns):
+    if export_format.columnar and 'Index' in data.columns and 'Index' not in columns:
+        columns = columns + ['Index']
+    return data[columns] if not data.empty else pd.DataFrame(columns=columns)
+
+def write_export(data, output_path, file_format, sheet_name, columns, partition_by=None):
+    """Write data in the requested format and return output_path.
+
+    Spreadsheets keep the familiar column layout; columnar formats also keep the
+    Index column so they can be partitioned and filtered by index downstream.
+    """
+    export_format = get_export_format(file_format)
+    data = _export_columns(data, export_format, columns)
+    export_format.writer(data, output_path, sheet_name, partition_by)
+    return output_path
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Shared process pool, started on first use; spawn keeps it safe to create from worker threads"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _partition_filename(key, extension, used):
+    name = re.sub(r'[^A-Za-z0-9._^=-]+', '_', str(key)).strip('.') or 'partition'
+    filename, suffix = f'{name}{extension}', 1
+    while filename.lower() in used:
+        suffix += 1
+        filename = f'{name}-{suffix}{extension}'
+    used.add(filename.lower())
+    return filename
+
+def _write_partition_batch(batch, directory, file_format, sheet_name):
+    """Write each (key, filename, frame) of a batch as its own file; runs in a pool process"""
+    export_format = get_export_format(file_format)
+    written = []
+    for key, filename, frame in batch:
+        path = os.path.join(directory, filename)
+        export_format.writer(frame, path, sheet_name, None)
+        written.append({'key': key, 'file': filename, 'rows': len(frame), 'bytes': os.path.getsize(path)})
+    return written
+
+def write_partitioned(data, output_path, file_format, sheet_name, columns, partition_by, workers=None):
+    """Write one file per partition_by value and bundle them into a zip with a manifest.json.
+
+    Partitions are serialized in parallel on the shared process pool, in
+    batches so each process writes several files per round-trip.
+    """
+    export_format = get_export_format(file_format)
+    workers = EXPORT_WORKERS if workers is None else workers
+    if partition_by not in columns:
+        if not data.empty and partition_by not in data.columns:
+            raise ValueError(f"Cannot partition by {partition_by}: no such column")
+        columns = columns + [partition_by]
+    data = _export_columns(data, export_format, columns)
+    data = _sorted_for_partitions(data, partition_by).reset_index(drop=True)
+
+    used = set()
+    partitions = [(str(key), _partition_filename(key, export_format.extension, used), data.iloc[start:stop])
+                  for key, start, stop in _partitions(data, partition_by)]
+
+    # Round-robin batches keep the per-process row counts roughly even
+    batch_count = min(len(partitions), max(1, workers) * 4)
+    batches = [partitions[i::batch_count] for i in range(batch_count)]
+
+    directory = tempfile.mkdtemp(prefix='partitions-', dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        if workers <= 1 or len(batches) <= 1:
+            results = [_write_partition_batch(batch, directory, file_format, sheet_name) for batch in batches]
+        else:
+            pool = _get_pool()
+            futures = [pool.submit(_write_partition_batch, batch, directory, file_format, sheet_name)
+                       for batch in batches]
+            try:
+                results = [future.result() for future in futures]
+            except Exception:
+                _reset_pool()
+                raise
+
+        written = sorted((entry for batch in results for entry in batch), key=lambda entry: entry['file'])
+        manifest = {
+            'created_at': time.time(),
+            'format': export_format.name,
+            'partition_by': partition_by,
+            'columns': list(data.columns),
+            'rows': int(sum(entry['rows'] for entry in written)),
+            'partitions': written,
+        }
+
+        # Every format already compresses its own files, so the archive just stores them
+        tmp_path = _partial_path(output_path)
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            archive.writestr('manifest.json', json.dumps(manifest, indent=2))
+            for entry in written:
+                archive.write(os.path.join(directory, entry['file']), entry['file'])
+        os.replace(tmp_path, output_path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return output_path
+
+def _partitions(data, partition_by):
+    """Yield (key, start, stop) slices of data, which must be sorted by partition_by"""
+    values = data[partition_by].to_numpy()
+    if len(values) == 0:
+        return
+    boundaries = np.flatnonzero(values[1:] != values[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    stops = np.concatenate((boundaries, [len(values)]))
+    for start, stop in zip(starts, stops):
+        yield values[start], int(start), int(stop)
+
+def _sorted_for_partitions(data, partition_by):
+    if partition_by and partition_by in data.columns:
+        return data.sort_values(partition_by, kind='stable')
+    return data
+
+def _require_pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ValueError("This export format requires pyarrow (pip install pyarrow)")
+    return pa
+
+def _partial_path(path):
+    return f"{path}.partial"
+
+@register_format('xlsx', '.xlsx', 'Excel workbook', columnar=False)
+def _write_xlsx(data, path, sheet_name, partition_by):
+    with ExcelSink(path) as sink:
+        if data.empty:
+            return
+        if partition_by:
+            # One worksheet per partition, without the now redundant partition column
+            for key, group in data.groupby(partition_by, sort=True, observed=True):
+                sink.write_frame(group.drop(columns=partition_by), sheet_name=str(key)[:31])
+        else:
+            sink.write_frame(data, sheet_name=sheet_name)
+
+@register_format('parquet', '.parquet', 'Parquet')
+def _write_parquet(data, path, sheet_name, partition_by):
+    pa = _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    # Row groups follow the partition column so readers can skip whole tickers/indices
+    partition_by = partition_by or ('Index' if 'Index' in data.columns else None)
+    data = _sorted_for_partitions(data, partition_by)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+
+    tmp_path = _partial_path(path)
+    with pq.ParquetWriter(tmp_path, table.schema, compression='zstd') as writer:
+        if partition_by and table.num_rows:
+            for _, start, stop in _partitions(data, partition_by):
+                writer.write_table(table.slice(start, stop - start), row_group_size=stop - start)
+        else:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+@register_format('arrow', '.arrow', 'Arrow IPC (Feather v2)')
+def _write_arrow(data, path, sheet_name, partition_by):
+    pa = _require_pyarrow()
+
+    partition_by = partition_by or ('Index' if 'Index' in data.columns else None)
+    data = _sorted_for_partitions(data, partition_by)
+    table = pa.Table.from_pandas(data, preserve_index=False)
+
+    tmp_path = _partial_path(path)
+    options = pa.ipc.IpcWriteOptions(compression='zstd')
+    with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        if partition_by and table.num_rows:
+            for _, start, stop in _partitions(data, partition_by):
+                writer.write_table(table.slice(start, stop - start))
+        else:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+@register_format('csv.gz', '.csv.gz', 'CSV (gzip)')
+def _write_csv_gz(data, path, sheet_name, partition_by):
+    tmp_path = _partial_path(path)
+    data.to_csv(tmp_path, index=False, compression={'method': 'gzip', 'compresslevel': 6})
+    os.replace(tmp_path, path)
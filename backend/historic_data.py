@@ -1,88 +1,157 @@
-import yfinance as yf
+import logging
+from downloader import download_bars
 import pandas as pd
-import datetime
-from io import BytesIO
-from scrape_tickers import get_index_components
+from exporters import write_export, write_partitioned
+from reshape import wide_to_long
+from analytics import resolve_windows, analytics_columns, add_analytics, add_gaps
+from snapshots import select_snapshots, normalize_rule, HISTORIC_RULE
+from ticker_plan import plan_fetch, attach_indices
+from bar_store import get_bar_store
+from market_calendar import EXCHANGE_TZ, trim_to_sessions
+from metrics import get_logger, log_event, stage, record_export, record_missing, EXPORTS
 
-def get_current_details(ticker, start_date, end_date):
-    """Fetch stock data for a given ticker and date range"""
+INTERVAL = '90m'
+
+PIPELINE = 'historic'
+
+logger = get_logger(__name__)
+
+def _to_long(df, tickers):
+    """Reshape a downloaded frame to one row per (Date, Ticker) with naive UTC dates"""
+    if df.index.tz is not None:
+        df.index = df.index.tz_convert('UTC').tz_localize(None)
+
+    # Volume is kept since the bar store persists it
+    return wide_to_long(df, tickers, drop=())
+
+def _fill_gaps(store, tickers, start_date, end_date):
+    """Download only the day ranges the local bar store does not cover yet.
+
+    Only tickers that came back with bars are marked covered. yfinance gives
+    the same empty answer for an error and for a range without trades, so
+    tickers without bars are asked for again next run instead of being
+    treated as empty for good.
+    """
+    for ranges, symbols in store.missing_ranges(tickers, INTERVAL, start_date, end_date).items():
+        for range_start, range_end in ranges:
+            failed = []
+            with stage(PIPELINE, 'download', tickers=len(symbols), start=range_start, end=range_end):
+                df = download_bars(symbols, failed=failed, start=range_start, end=range_end, interval=INTERVAL)
+            returned = set()
+            if not df.empty:
+                with stage(PIPELINE, 'reshape'):
+                    bars = _to_long(df, symbols)
+                with stage(PIPELINE, 'store'):
+                    store.save(bars, INTERVAL)
+                returned = set(bars.dropna(subset=['Open', 'High', 'Low', 'Close'], how='all')['Ticker'])
+            returned -= set(failed)
+            covered = [symbol for symbol in symbols if symbol in returned]
+            if len(covered) < len(symbols):
+                log_event(logger, 'coverage_skipped', logging.WARNING, pipeline=PIPELINE,
+                          tickers=len(symbols) - len(covered), start=range_start, end=range_end)
+            if covered:
+                store.mark_covered(covered, INTERVAL, range_start, range_end)
+
+def get_current_details(ticker, start_date, end_date, windows=(), snapshot=None):
+    """Fetch one bar per ticker and session in a date range, picked by the snapshot rule.
+
+    With windows, analytics over those windows follow the OHLC columns.
+    """
     try:
-        print(f"Fetching data from {start_date} to {end_date}...")
-        
+        tickers = [ticker] if isinstance(ticker, str) else list(ticker)
+
+        # Closed days at either end of the window are never requested
+        sessions = trim_to_sessions(start_date, end_date)
+        if sessions is None:
+            log_event(logger, 'no_sessions', logging.WARNING, start=start_date, end=end_date)
+            return None
+        start_date, end_date = sessions
+
         # Adjust end date using pandas date offset
         end_date_adjusted = pd.to_datetime(end_date) + pd.DateOffset(days=1)
-        
-        # Fetch data within the given date range
-        df = yf.download(ticker, start=start_date, end=end_date_adjusted, interval='90m', group_by='ticker', auto_adjust=False)
-        
+
+        # Past days come from the local bar store, only the gaps go over the network
+        store = get_bar_store()
+        _fill_gaps(store, tickers, start_date, end_date)
+        with stage(PIPELINE, 'load'):
+            df = store.load(tickers, INTERVAL, start_date, end_date_adjusted)
+
         if df.empty:
             return None
-        
-        # Convert index (Datetime) to US/Eastern time and make it naive
-        df.index = df.index.tz_localize(None)
-        
-        # Handle multi-index if necessary
-        if isinstance(df.columns, pd.MultiIndex):
-            df = df.stack(level=0, future_stack=True).rename_axis(['Date', 'Ticker']).reset_index()
-        else:
-            df = df.reset_index()
-            df['Ticker'] = ticker
-
-        # Drop the Volume column
-        df = df.drop(columns=['Volume'])
-
-        # Filter for specific date and time
-        df['Time'] = df['Date'].dt.time
-        df['DateOnly'] = df['Date'].dt.date
-        latest_data = df[df['Time'] == datetime.time(19, 30)]
+
+        # Stored dates are naive UTC; exports carry naive exchange-local dates, like the specific-date ones
+        df['Date'] = df['Date'].dt.tz_localize('UTC').dt.tz_convert(EXCHANGE_TZ).dt.tz_localize(None)
+
+        # Opening gaps need every bar of a session, so they are found before the daily filter
+        if windows:
+            with stage(PIPELINE, 'analytics', step='gaps'):
+                df = add_gaps(df)
+
+        with stage(PIPELINE, 'filter'):
+            # Drop the Volume column
+            df = df.drop(columns=['Volume'])
+
+            latest_data = select_snapshots(df, snapshot or HISTORIC_RULE, tz=EXCHANGE_TZ)
+
+        if windows:
+            with stage(PIPELINE, 'analytics', step='rolling', windows=list(windows)):
+                latest_data = add_analytics(latest_data, windows)
         
         return latest_data
                 
     except Exception as e:
-        print(f"Error fetching data for {ticker}: {e}")
+        log_event(logger, 'fetch_failed', logging.ERROR, pipeline=PIPELINE, error=str(e))
         return None
     
-def generate_historic_data(start_date, end_date, tickers=None, multisheet=None):
-    """Generate Excel file with specific date data in a single sheet"""
+def generate_historic_data(output_path, start_date, end_date, tickers=None, multisheet=None, progress=None,
+                           file_format='xlsx', partition_files=None, analytics=None, snapshot=None):
+    """Generate an export with historic data at output_path, partitioned per ticker if multisheet.
+
+    With partition_files ('Ticker' or 'Index') every partition becomes its own
+    file, written in parallel, and output_path is a zip of them plus a manifest.
+    With analytics (True for the default windows, or a list of windows) daily
+    returns, moving averages, volatility and opening gaps follow the OHLC columns.
+    snapshot picks the bar kept per session (see snapshots.SNAPSHOT_RULES);
+    the session's last bar by default.
+    """
     try:
-        output = BytesIO()
         all_data = pd.DataFrame()
+        windows = resolve_windows(analytics)
+        snapshot = normalize_rule(snapshot or HISTORIC_RULE)
         
-        if tickers:
-            # Use provided tickers
-            for index, symbols in tickers.items():
-                print(f"Processing {index} for {start_date} to {end_date}...")
-                df = get_current_details(symbols, start_date, end_date)
-                if not df.empty:
-                    df['Index'] = index
-                    all_data = pd.concat([all_data, df], ignore_index=True)
-        else:
-            # Use default index components
-            components, _ = get_index_components()
-            for index, symbols in components.items():
-                print(f"Processing {index} for {start_date} to {end_date}...")
-                df = get_current_details(symbols, start_date, end_date)
-                if not df.empty:
-                    df['Index'] = index
-                    all_data = pd.concat([all_data, df], ignore_index=True)
-
-        # Write all data to a single sheet
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        # Fetch every ticker once, then attach the index labels it belongs to
+        with stage(PIPELINE, 'plan'):
+            plan = plan_fetch(tickers)
+        log_event(logger, 'processing', pipeline=PIPELINE, tickers=len(plan.symbols), indices=plan.indices,
+                  start=start_date, end=end_date, snapshot=snapshot)
+        plan.report(progress, 'downloading')
+        df = get_current_details(plan.symbols, start_date, end_date, windows, snapshot)
+        record_missing(PIPELINE, plan, df['Ticker'].unique() if df is not None and not df.empty else [])
+        if df is not None and not df.empty:
+            with stage(PIPELINE, 'attach'):
+                all_data = attach_indices(df, plan)
+        plan.report(progress, 'writing')
+
+        # Multisheet exports get one sheet (or row group) per ticker
+        cols = ['Ticker', 'Date', 'Open', 'High', 'Low', 'Close', 'Adj Close']
+        if windows:
+            cols += analytics_columns(windows)
+        with stage(PIPELINE, 'write', format=file_format, multisheet=bool(multisheet), partition_files=partition_files):
             if not all_data.empty:
-                cols = ['Ticker', 'Date', 'Open', 'High', 'Low', 'Close', 'Adj Close']
-                all_data = all_data[cols]
                 all_data = all_data.sort_values(['Ticker', 'Date'])
-                
-                if multisheet:
-                    for ticker, group in all_data.groupby('Ticker'):
-                        sheet_data = group.drop('Ticker', axis=1)
-                        sheet_name = str(ticker)[:31]
-                        sheet_data.to_excel(writer, sheet_name=sheet_name, index=False)
-                else:
-                    all_data.to_excel(writer, sheet_name='Historic Data', index=False)
-        output.seek(0)
-        return output
+            if partition_files:
+                write_partitioned(all_data, output_path, file_format, sheet_name='Historic Data', columns=cols,
+                                  partition_by=partition_files)
+            else:
+                write_export(all_data, output_path, file_format, sheet_name='Historic Data', columns=cols,
+                             partition_by='Ticker' if multisheet else None)
+        size = record_export(PIPELINE, file_format, output_path, len(all_data))
+        log_event(logger, 'export_written', pipeline=PIPELINE, format=file_format, rows=len(all_data), bytes=size)
+
+        plan.report(progress, 'done')
+        return output_path
     
     except Exception as e:
-        print(f"Error generating specific date data: {str(e)}")
+        EXPORTS.inc(pipeline=PIPELINE, outcome='error')
+        log_event(logger, 'export_failed', logging.ERROR, pipeline=PIPELINE, error=str(e))
         return None
\ No newline at end of file
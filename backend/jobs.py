@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import get_logger, log_event, track_exports
+from result_cache import ResultCache, result_ttl, incomplete_ttl
+from shared_cache import get_shared_cache
+
+# Number of pipelines allowed to run at the same time
+JOB_WORKERS = int(os.environ.get('STOCK_DATA_JOB_WORKERS', 2))
+
+# Seconds other worker processes can still look a job up by id
+JOB_RECORD_TTL = int(os.environ.get('STOCK_DATA_JOB_RECORD_TTL', 24 * 60 * 60))
+
+# Seconds between checks while waiting on a job another process runs
+REMOTE_POLL_SECONDS = 0.5
+
+logger = get_logger(__name__)
+
+class Job:
+    """A queued pipeline run and the progress it has reported so far"""
+
+    def __init__(self, kind, params, key):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.key = key
+        self.status = 'queued'
+        self.progress = {}
+        self.file_path = None
+        self.cached = False
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.pid = os.getpid()
+        self.on_change = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    @classmethod
+    def from_record(cls, record):
+        """Read-only copy of a job another worker process published"""
+        job = cls.__new__(cls)
+        job.__dict__.update({name: record.get(name) for name in
+                             ('id', 'kind', 'params', 'key', 'status', 'file_path', 'error', 'created_at',
+                              'finished_at', 'pid')})
+        job.progress = record.get('progress') or {}
+        job.cached = record.get('cached', False)
+        job.on_change = None
+        job._lock = threading.Lock()
+        job._finished = threading.Event()
+        if job.finished_at is not None:
+            job._finished.set()
+        return job
+
+    def finish(self):
+        self.finished_at = time.time()
+        self._finished.set()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished or timeout seconds passed; True if it finished"""
+        return self._finished.wait(timeout)
+
+    def update_progress(self, index, state):
+        with self._lock:
+            self.progress[index] = state
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'id': self.id,
+                'kind': self.kind,
+                'params': self.params,
+                'status': self.status,
+                'progress': dict(self.progress),
+                'file_path': str(self.file_path) if self.file_path else None,
+                'cached': self.cached,
+                'error': self.error,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+            }
+
+def job_key(kind, params, tickers=None):
+    """Identity of a job: same pipeline, parameters and ticker set"""
+    normalized_tickers = {str(index): sorted(map(str, symbols)) for index, symbols in (tickers or {}).items()}
+    payload = json.dumps({'kind': kind, 'params': params, 'tickers': normalized_tickers}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class JobManager:
+    """Runs pipelines on a bounded worker pool and coalesces identical in-flight jobs.
+
+    Jobs submitted with an output_path are also served from the result cache:
+    a finished identical job that wrote data rows is linked to the new path
+    instead of being rerun. Every state change is published to the shared
+    cache, so with several worker processes any of them can report on a job
+    and identical submissions coalesce onto the one already running anywhere.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, keep=200, cache=None, shared=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stock-job')
+        self.cache = cache if cache is not None else ResultCache()
+        self.shared = shared if shared is not None else get_shared_cache()
+        self._jobs = {}
+        self._inflight = {}
+        self._keep = keep
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, params, tickers=None, output_path=None):
+        """Queue func(job) -> file path, or return the identical job that is already running.
+
+        With output_path (where func writes) a cached identical result is linked
+        there and the job is done straight away.
+        """
+        key = job_key(kind, params, tickers)
+        with self._lock:
+            existing = self._inflight.get(key)
+            if existing is not None:
+                return existing
+        existing = self._remote_inflight(key)
+        if existing is not None:
+            return existing
+
+        job = Job(kind, params, key)
+        job.on_change = self._publish
+        if output_path and self.cache.fetch(key, output_path, kind):
+            job.file_path = output_path
+            job.cached = True
+            job.status = 'done'
+            job.finish()
+            with self._lock:
+                self._jobs[job.id] = job
+                self._prune()
+            self._publish(job)
+            return job
+
+        with self._lock:
+            existing = self._inflight.get(key)
+            if existing is not None:
+                return existing
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+            self._prune()
+        self._publish(job)
+        self.shared.set('inflight', key, job.id, ttl=JOB_RECORD_TTL)
+
+        ttl = result_ttl(kind, params) if output_path else None
+        self._executor.submit(self._run, job, func, output_path, ttl)
+        return job
+
+    def _publish(self, job):
+        self.shared.set('jobs', job.id, dict(job.to_dict(), key=job.key, pid=job.pid), ttl=JOB_RECORD_TTL)
+
+    def _remote(self, job_id):
+        record = self.shared.get('jobs', job_id)
+        return Job.from_record(record) if record else None
+
+    def _remote_inflight(self, key):
+        """The unfinished job for key that a live worker process is running, if any"""
+        job_id = self.shared.get('inflight', key)
+        job = self._remote(job_id) if job_id else None
+        if job is None or job.finished_at is not None or job.pid == os.getpid() or not _alive(job.pid):
+            return None
+        return job
+
+    def get(self, job_id):
+        """A job of this process, or a snapshot of one another worker process published"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._remote(job_id)
+
+    def list(self):
+        with self._lock:
+            jobs = dict(self._jobs)
+        for record in self.shared.values('jobs'):
+            if record['id'] not in jobs:
+                jobs[record['id']] = Job.from_record(record)
+        return sorted(jobs.values(), key=lambda job: job.created_at)
+
+    def wait(self, job_id, timeout):
+        """The job once it has finished or timeout seconds passed, whichever process runs it"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.wait(timeout)
+            return job
+        deadline = time.monotonic() + timeout
+        job = self._remote(job_id)
+        while job is not None and job.finished_at is None and time.monotonic() < deadline:
+            time.sleep(REMOTE_POLL_SECONDS)
+            job = self._remote(job_id)
+        return job
+
+    def _run(self, job, func, output_path=None, ttl=None):
+        job.status = 'running'
+        self._publish(job)
+        try:
+            with track_exports() as exported:
+                file_path = func(job)
+            if file_path:
+                job.file_path = file_path
+                job.status = 'done'
+                # An export without rows (upstream down, nothing traded yet) is served but never reused;
+                # one with tickers missing is only reused briefly, so the missing ones are retried soon
+                if output_path and exported['rows']:
+                    if exported['missing']:
+                        ttl = incomplete_ttl(ttl)
+                        log_event(logger, 'result_cache_incomplete', kind=job.kind, job=job.id,
+                                  missing=exported['missing'], ttl=ttl)
+                    self.cache.store(job.key, file_path, ttl, job.kind)
+                elif output_path:
+                    log_event(logger, 'result_cache_skipped', kind=job.kind, job=job.id, reason='no_rows')
+            else:
+                job.status = 'failed'
+                job.error = 'No data was generated'
+        except Exception as e:
+            log_event(logger, 'job_failed', logging.ERROR, kind=job.kind, job=job.id, error=str(e))
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            with self._lock:
+                if self._inflight.get(job.key) is job:
+                    del self._inflight[job.key]
+            job.finish()
+            self._publish(job)
+            if self.shared.get('inflight', job.key) == job.id:
+                self.shared.delete('inflight', job.key)
+
+    def _prune(self):
+        """Forget the oldest finished jobs once more than `keep` are tracked"""
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        for job in sorted(finished, key=lambda j: j.finished_at)[:max(0, len(self._jobs) - self._keep)]:
+            del self._jobs[job.id]
+
+def _alive(pid):
+    """Whether a process with this id still runs on this host"""
+    if os.name == 'nt':
+        # Signals other than the console events terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists under another user
+    return True
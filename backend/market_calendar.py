@@ -0,0 +1,155 @@
+import datetime
+import threading
+import numpy as np
+import pytz
+
+EXCHANGE_TZ = pytz.timezone('America/New_York')
+
+# One-off full-day closures that no recurring rule covers
+SPECIAL_CLOSURES = {
+    datetime.date(2001, 9, 11), datetime.date(2001, 9, 12), datetime.date(2001, 9, 13),
+    datetime.date(2001, 9, 14), datetime.date(2004, 6, 11), datetime.date(2007, 1, 2),
+    datetime.date(2012, 10, 29), datetime.date(2012, 10, 30), datetime.date(2018, 12, 5),
+    datetime.date(2025, 1, 9),
+}
+
+def _easter(year):
+    """Gregorian Easter Sunday (anonymous computus)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+def _nth_weekday(year, month, weekday, n):
+    """n-th (1-based) weekday of a month, or the last one when n is -1"""
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    last = next_month - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+def _observed(day):
+    """Saturday holidays move to Friday, Sunday holidays to Monday"""
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+def nyse_holidays(year):
+    """Full-day NYSE holidays for a year"""
+    holidays = set()
+
+    # New Year's Day is not moved back into the previous year when it falls on a Saturday
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.add(_observed(new_year))
+
+    if year >= 1998:
+        holidays.add(_nth_weekday(year, 1, 0, 3))   # Martin Luther King Jr. Day
+    holidays.add(_nth_weekday(year, 2, 0, 3))       # Washington's Birthday
+    holidays.add(_easter(year) - datetime.timedelta(days=2))  # Good Friday
+    holidays.add(_nth_weekday(year, 5, 0, -1))      # Memorial Day
+    if year >= 2022:
+        holidays.add(_observed(datetime.date(year, 6, 19)))  # Juneteenth
+    holidays.add(_observed(datetime.date(year, 7, 4)))       # Independence Day
+    holidays.add(_nth_weekday(year, 9, 0, 1))       # Labor Day
+    holidays.add(_nth_weekday(year, 11, 3, 4))      # Thanksgiving
+    holidays.add(_observed(datetime.date(year, 12, 25)))     # Christmas
+
+    holidays.update(day for day in SPECIAL_CLOSURES if day.year == year)
+    return holidays
+
+# Years covered by the precomputed session index; dates outside fall back to the rules
+CALENDAR_FIRST_YEAR = 1990
+CALENDAR_YEARS_AHEAD = 2
+
+_sessions = None
+_sessions_lock = threading.Lock()
+
+def _as_date(day):
+    if isinstance(day, datetime.datetime):
+        return day.date()
+    if isinstance(day, datetime.date):
+        return day
+    return datetime.date.fromisoformat(str(day)[:10])
+
+def _session_index():
+    """Sorted datetime64[D] array of every NYSE session in the calendar range, built once"""
+    global _sessions
+    if _sessions is None:
+        with _sessions_lock:
+            if _sessions is None:
+                last_year = datetime.date.today().year + CALENDAR_YEARS_AHEAD
+                days = np.arange(np.datetime64(f'{CALENDAR_FIRST_YEAR}-01-01'),
+                                 np.datetime64(f'{last_year + 1}-01-01'), dtype='datetime64[D]')
+                days = days[np.is_busday(days)]
+                holidays = np.array(sorted(day for year in range(CALENDAR_FIRST_YEAR, last_year + 1)
+                                           for day in nyse_holidays(year)), dtype='datetime64[D]')
+                _sessions = days[~np.isin(days, holidays)]
+    return _sessions
+
+def _in_index(day):
+    sessions = _session_index()
+    return sessions[0] <= np.datetime64(day) <= sessions[-1]
+
+def is_trading_day(day):
+    """True for weekdays that are not NYSE holidays"""
+    day = _as_date(day)
+    if not _in_index(day):
+        return day.weekday() < 5 and day not in nyse_holidays(day.year)
+    sessions = _session_index()
+    position = np.searchsorted(sessions, np.datetime64(day))
+    return bool(position < len(sessions) and sessions[position] == np.datetime64(day))
+
+def trading_sessions(start, end):
+    """Trading days in [start, end] as datetime.date objects"""
+    start, end = _as_date(start), _as_date(end)
+    if not (_in_index(start) and _in_index(end)):
+        return [day.date() for day in _calendar_days(start, end) if is_trading_day(day.date())]
+    sessions = _session_index()
+    lo = np.searchsorted(sessions, np.datetime64(start), side='left')
+    hi = np.searchsorted(sessions, np.datetime64(end), side='right')
+    return sessions[lo:hi].astype(object).tolist()
+
+def _calendar_days(start, end):
+    day = datetime.datetime.combine(start, datetime.time())
+    while day.date() <= end:
+        yield day
+        day += datetime.timedelta(days=1)
+
+def previous_trading_day(day, inclusive=True):
+    """Nearest session on or before day (strictly before when inclusive is False)"""
+    day = _as_date(day)
+    if not inclusive:
+        day -= datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return day
+
+def next_trading_day(day, inclusive=True):
+    """Nearest session on or after day (strictly after when inclusive is False)"""
+    day = _as_date(day)
+    if not inclusive:
+        day += datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+    return day
+
+def trim_to_sessions(start, end):
+    """Shrink [start, end] to its first and last trading sessions, or None if it has none"""
+    sessions = trading_sessions(start, end)
+    if not sessions:
+        return None
+    return sessions[0], sessions[-1]
+
+def exchange_now():
+    return datetime.datetime.now(EXCHANGE_TZ)
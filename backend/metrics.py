@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Upper bounds in seconds; exports run from milliseconds (cached) to minutes (cold historic)
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LOG_LEVEL = os.environ.get('STOCK_DATA_LOG_LEVEL', 'INFO').upper()
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event plus the event's fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def _configure_logger():
+    logger = logging.getLogger('stock_data')
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
+
+_logger = _configure_logger()
+
+def get_logger(name):
+    """Child of the stock_data logger, so every module shares the JSON handler"""
+    return _logger.getChild(name)
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """Log an event name with structured fields; skipped cheaply when the level is disabled"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in items)
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+
+    def sums(self):
+        """Total observed value per label tuple"""
+        with self._lock:
+            return {key: total for key, (_, _, total) in self._series.items()}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, ([*counts], count, total)) for key, (counts, count, total) in self._series.items())
+        for key, (counts, count, total) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', f'{bound:g}')])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total:.6f}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+REGISTRY = []
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+STAGE_SECONDS = _register(Histogram(
+    'stock_data_stage_seconds', 'Time spent in each pipeline stage', ['pipeline', 'stage']))
+ROWS_WRITTEN = _register(Counter(
+    'stock_data_rows_written_total', 'Rows written to exports', ['pipeline', 'format']))
+BYTES_WRITTEN = _register(Counter(
+    'stock_data_bytes_written_total', 'Bytes of export files written', ['pipeline', 'format']))
+EXPORTS = _register(Counter(
+    'stock_data_exports_total', 'Finished exports by outcome', ['pipeline', 'outcome']))
+UPSTREAM_ERRORS = _register(Counter(
+    'stock_data_upstream_errors_total', 'Failed upstream requests', ['source', 'index']))
+MISSING_TICKERS = _register(Counter(
+    'stock_data_missing_tickers_total', 'Requested tickers that came back without data', ['pipeline', 'index']))
+RESULT_CACHE = _register(Counter(
+    'stock_data_result_cache_total', 'Result cache lookups by outcome', ['kind', 'outcome']))
+HTTP_REQUESTS = _register(Counter(
+    'stock_data_http_requests_total', 'HTTP requests served', ['endpoint', 'method', 'status']))
+HTTP_SECONDS = _register(Histogram(
+    'stock_data_http_request_seconds', 'HTTP request latency', ['endpoint']))
+
+_stage_logger = get_logger('stages')
+
+@contextmanager
+def stage(pipeline, name, **fields):
+    """Time one pipeline stage into STAGE_SECONDS and a debug log line"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, pipeline=pipeline, stage=name)
+        log_event(_stage_logger, 'stage', logging.DEBUG, pipeline=pipeline, stage=name,
+                  seconds=round(elapsed, 4), **fields)
+
+_exports = threading.local()
+
+@contextmanager
+def track_exports():
+    """Yield a dict totalling the rows written and the tickers without data this thread records inside the block"""
+    previous = getattr(_exports, 'totals', None)
+    _exports.totals = totals = {'rows': 0, 'missing': 0}
+    try:
+        yield totals
+    finally:
+        _exports.totals = previous
+
+def _track(name, count):
+    totals = getattr(_exports, 'totals', None)
+    if totals is not None:
+        totals[name] += count
+
+def record_export(pipeline, file_format, output_path, rows):
+    """Count rows and bytes of a finished export"""
+    _track('rows', rows)
+    ROWS_WRITTEN.inc(rows, pipeline=pipeline, format=file_format)
+    try:
+        size = os.path.getsize(output_path)
+    except OSError:
+        size = 0
+    BYTES_WRITTEN.inc(size, pipeline=pipeline, format=file_format)
+    EXPORTS.inc(pipeline=pipeline, outcome='ok')
+    return size
+
+def record_missing(pipeline, plan, found):
+    """Count tickers of the plan without data, per index they belong to"""
+    found = set(found)
+    missing = {}
+    for symbol, indices in plan.membership.items():
+        if symbol not in found:
+            for index in indices:
+                missing[index] = missing.get(index, 0) + 1
+    for index, count in missing.items():
+        MISSING_TICKERS.inc(count, pipeline=pipeline, index=index)
+    _track('missing', sum(1 for symbol in plan.membership if symbol not in found))
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import Counter, deque
+import pandas as pd
+import realtime_data
+from ticker_plan import plan_fetch
+from metrics import get_logger, log_event
+
+# Seconds between upstream polls; 1m bars make faster polling pointless
+POLL_SECONDS = float(os.environ.get('REALTIME_POLL_SECONDS', 60))
+# Quotes kept per ticker for clients that reconnect or fall behind
+BUFFER_SIZE = int(os.environ.get('REALTIME_BUFFER_SIZE', 120))
+# The poller stops after this many seconds without subscribers
+IDLE_SECONDS = float(os.environ.get('REALTIME_IDLE_SECONDS', 300))
+
+logger = get_logger(__name__)
+
+def _quote(row):
+    def value(column):
+        v = row[column]
+        return None if pd.isna(v) else float(v)
+
+    return {
+        'ticker': row['Ticker'],
+        'time': row['Date'].isoformat(),
+        'open': value('Open'),
+        'high': value('High'),
+        'low': value('Low'),
+        'close': value('Close'),
+        'adj_close': value('Adj Close'),
+    }
+
+class QuoteHub:
+    """One shared realtime poller feeding bounded per-ticker ring buffers.
+
+    Each published quote gets a sequence number; subscribers remember the last
+    one they sent and wait on a condition for newer quotes, so the number of
+    connected clients never changes how often upstream is polled.
+    """
+
+    def __init__(self, poll_seconds=POLL_SECONDS, buffer_size=BUFFER_SIZE, idle_seconds=IDLE_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.buffer_size = buffer_size
+        self.idle_seconds = idle_seconds
+        self._buffers = {}
+        # Tickers outside the default universe, counted per subscriber so they stop being polled once unwatched
+        self._extra_tickers = Counter()
+        self._seq = 0
+        self._subscribers = 0
+        self._last_active = time.monotonic()
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def publish(self, bars):
+        """Append changed quotes to their ticker buffers and wake subscribers"""
+        if bars is None or bars.empty:
+            return
+        with self._cond:
+            for _, row in bars.iterrows():
+                quote = _quote(row)
+                buffer = self._buffers.setdefault(quote['ticker'], deque(maxlen=self.buffer_size))
+                if buffer and {k: v for k, v in buffer[-1].items() if k != 'seq'} == quote:
+                    continue
+                self._seq += 1
+                quote['seq'] = self._seq
+                buffer.append(quote)
+            self._cond.notify_all()
+
+    def _universe(self):
+        with self._cond:
+            extra = set(self._extra_tickers)
+        symbols = plan_fetch().symbols
+        return symbols + sorted(extra - set(symbols))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._subscribers == 0 and time.monotonic() - self._last_active > self.idle_seconds:
+                    self._thread = None
+                    return
+            try:
+                self.publish(realtime_data.engine.poll(self._universe()))
+            except Exception as e:
+                log_event(logger, 'poll_failed', logging.ERROR, error=str(e))
+            time.sleep(self.poll_seconds)
+
+    def _ensure_running(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='quote-poller', daemon=True)
+            self._thread.start()
+
+    def snapshot(self, tickers=None):
+        """Latest buffered quote per ticker"""
+        with self._cond:
+            names = self._buffers.keys() if tickers is None else [t for t in tickers if t in self._buffers]
+            return [self._buffers[name][-1] for name in names if self._buffers[name]]
+
+    def _since(self, tickers, seq):
+        names = self._buffers.keys() if tickers is None else [t for t in tickers if t in self._buffers]
+        updates = [quote for name in names for quote in self._buffers[name] if quote['seq'] > seq]
+        return sorted(updates, key=lambda quote: quote['seq'])
+
+    def subscribe(self, tickers=None, last_seq=0, heartbeat=15):
+        """Yield lists of new quotes (empty lists as heartbeats) for the tickers, forever"""
+        tickers = list(dict.fromkeys(tickers)) if tickers is not None else None
+        with self._cond:
+            if tickers:
+                self._extra_tickers.update(tickers)
+            self._subscribers += 1
+            self._ensure_running()
+            # New clients start from the latest quote per ticker instead of replaying the buffers
+            initial = self.snapshot(tickers) if not last_seq else []
+            if not last_seq:
+                last_seq = self._seq
+        try:
+            if initial:
+                yield sorted(initial, key=lambda quote: quote['seq'])
+            while True:
+                with self._cond:
+                    updates = self._since(tickers, last_seq)
+                    if not updates:
+                        self._cond.wait(timeout=heartbeat)
+                        updates = self._since(tickers, last_seq)
+                if updates:
+                    last_seq = updates[-1]['seq']
+                yield updates
+        finally:
+            with self._cond:
+                if tickers:
+                    self._extra_tickers.subtract(tickers)
+                    self._extra_tickers = +self._extra_tickers
+                self._subscribers -= 1
+                self._last_active = time.monotonic()
+
+def sse_events(hub, tickers=None, last_seq=0):
+    """Format hub updates as text/event-stream messages"""
+    for updates in hub.subscribe(tickers, last_seq):
+        if not updates:
+            yield ": keep-alive\n\n"
+            continue
+        for quote in updates:
+            yield f"id: {quote['seq']}\nevent: quote\ndata: {json.dumps(quote)}\n\n"
+
+hub = QuoteHub()
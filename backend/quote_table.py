@@ -0,0 +1,100 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+
+class QuoteTable:
+    """Latest quote per ticker in preallocated NumPy columns with a ticker -> row index.
+
+    Updates write into the existing arrays in place; storage only grows (by
+    doubling) when more distinct tickers arrive than there are rows. Each row
+    also records when it was last checked upstream, so readers can tell a
+    quiet ticker from one nobody has asked about lately.
+    """
+
+    def __init__(self, capacity=1024):
+        self._prices = np.full((capacity, len(PRICE_FIELDS)), np.nan)
+        self._timestamps = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[s]')
+        self._checked = np.full(capacity, -np.inf)
+        self._tickers = []
+        self._rows = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self._rows
+
+    def _grow(self, needed):
+        capacity = len(self._timestamps)
+        while capacity < needed:
+            capacity *= 2
+        old = len(self._timestamps)
+        prices = np.full((capacity, len(PRICE_FIELDS)), np.nan)
+        prices[:old] = self._prices
+        timestamps = np.full(capacity, np.datetime64('NaT'), dtype='datetime64[s]')
+        timestamps[:old] = self._timestamps
+        checked = np.full(capacity, -np.inf)
+        checked[:old] = self._checked
+        self._prices, self._timestamps, self._checked = prices, timestamps, checked
+
+    def _row_for(self, ticker):
+        row = self._rows.get(ticker)
+        if row is None:
+            row = len(self._tickers)
+            self._rows[ticker] = row
+            self._tickers.append(ticker)
+        return row
+
+    def update(self, bars):
+        """Write the latest bar per ticker from a long frame (Date, Ticker, prices)"""
+        if bars is None or bars.empty:
+            return
+        latest = bars.sort_values('Date').groupby('Ticker', observed=True).tail(1)
+        dates = pd.to_datetime(latest['Date'])
+        if dates.dt.tz is not None:
+            dates = dates.dt.tz_convert('UTC').dt.tz_localize(None)
+
+        with self._lock:
+            rows = np.fromiter((self._row_for(t) for t in latest['Ticker']), dtype=np.int64, count=len(latest))
+            if len(self._tickers) > len(self._timestamps):
+                self._grow(len(self._tickers))
+            self._prices[rows] = latest[PRICE_FIELDS].to_numpy(dtype=np.float64)
+            self._timestamps[rows] = dates.to_numpy().astype('datetime64[s]')
+            self._checked[rows] = time.monotonic()
+
+    def touch(self, tickers):
+        """Record that the tickers were just checked upstream, whether or not a new bar came back"""
+        with self._lock:
+            rows = [self._rows[ticker] for ticker in tickers if ticker in self._rows]
+            self._checked[rows] = time.monotonic()
+
+    def stale(self, tickers, max_age):
+        """Tickers that are missing or were last checked upstream more than max_age seconds ago"""
+        cutoff = time.monotonic() - max_age
+        with self._lock:
+            return [ticker for ticker in tickers
+                    if ticker not in self._rows or self._checked[self._rows[ticker]] < cutoff]
+
+    def lookup(self, tickers):
+        """Quotes for the tickers that are present, in request order"""
+        with self._lock:
+            found = [(ticker, self._rows[ticker]) for ticker in tickers if ticker in self._rows]
+            if not found:
+                return []
+            rows = np.array([row for _, row in found], dtype=np.int64)
+            prices = self._prices[rows]
+            timestamps = self._timestamps[rows]
+
+        quotes = []
+        for (ticker, _), values, ts in zip(found, prices.tolist(), timestamps):
+            quote = {'ticker': ticker, 'time': None if np.isnat(ts) else f"{ts}Z"}
+            for field, value in zip(PRICE_FIELDS, values):
+                quote[field.lower().replace(' ', '_')] = None if value != value else value
+            quotes.append(quote)
+        return quotes
+
+table = QuoteTable()
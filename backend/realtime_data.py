@@ -1,76 +1,313 @@
-import yfinance as yf
+import os
+import hashlib
+import logging
+import threading
 import pandas as pd
-from io import BytesIO
-from scrape_tickers import get_index_components
+from downloader import download_bars
+from exporters import write_export
+from reshape import wide_to_long, last_bars
+from analytics import resolve_windows, analytics_columns, add_analytics, add_gaps
+from ticker_plan import plan_fetch, attach_indices
+from shared_cache import get_shared_cache
+from market_calendar import EXCHANGE_TZ, is_trading_day, previous_trading_day
+from snapshots import OPEN_MINUTE, CLOSE_MINUTE
+from metrics import get_logger, log_event, stage, record_export, record_missing, EXPORTS
 
-def get_current_details(tickers):
-    """Fetch current market data for a list of tickers"""
+PIPELINE = 'realtime'
+
+logger = get_logger(__name__)
+
+# Beyond this many minutes without a bar a ticker is refilled instead of fetched incrementally;
+# it covers the hourly scheduled snapshots so those stay incremental
+MAX_GAP_MINUTES = int(os.environ.get('REALTIME_MAX_GAP_MINUTES', 90))
+
+# Incremental tickers whose last bars lie within this many minutes of each other share one download
+SINCE_GROUP_MINUTES = int(os.environ.get('REALTIME_SINCE_GROUP_MINUTES', 5))
+
+# Recent 1m bars kept per ticker for the analytics columns; 0 keeps the latest bar only
+HISTORY_BARS = int(os.environ.get('REALTIME_HISTORY_BARS', 120))
+
+# Latest bars another worker process downloaded this many seconds ago or less are used as they are;
+# 0 keeps every process on its own downloads
+SHARED_SECONDS = float(os.environ.get('REALTIME_SHARED_SECONDS', 30))
+
+_BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close']
+
+def _to_long(data, tickers):
+    """Reshape a downloaded 1m frame to one row per (Date, Ticker) with UTC dates, dropping empty bars"""
+    if data.index.tz is None:
+        data.index = data.index.tz_localize('UTC')
+    else:
+        data.index = data.index.tz_convert('UTC')
+
+    data = wide_to_long(data, tickers)
+    return data.dropna(subset=['Open', 'High', 'Low', 'Close'], how='all')
+
+def _minute_of_day(local):
+    return local.hour * 60 + local.minute
+
+def _latest_session(local_now):
+    """The session the newest bars belong to at an exchange-local time, and whether it is still trading"""
+    today = local_now.date()
+    minute = _minute_of_day(local_now)
+    if is_trading_day(today) and minute >= OPEN_MINUTE:
+        return today, minute < CLOSE_MINUTE
+    return previous_trading_day(today, inclusive=False), False
+
+def _group_by_seen(seen_by_ticker, window):
+    """[(since, tickers)] batches of tickers whose last bars lie within window of the batch's oldest"""
+    groups = []
+    for ticker, seen in sorted(seen_by_ticker.items(), key=lambda item: item[1]):
+        if groups and seen - groups[-1][0] <= window:
+            groups[-1][1].append(ticker)
+        else:
+            groups.append((seen, [ticker]))
+    return groups
+
+class RealtimeEngine:
+    """Keeps the latest 1m bar per ticker and only downloads bars newer than the last one seen.
+
+    A ticker is refilled with a full-day download the first time it is polled,
+    when its last bar belongs to an earlier session, or when it has not
+    produced a bar for longer than max_gap during trading hours. Once the
+    session has closed, tickers already holding its closing bar are not
+    fetched again until the next open. Incremental tickers are batched by
+    their last bar, so one stale ticker does not widen every ticker's window.
+    The last history_bars bars per ticker are kept as well, for intraday
+    analytics.
+
+    With shared_seconds set, worker processes publish their newest bars to the
+    shared cache and take each other's recent ones instead of downloading the
+    same tickers again. Shared entries carry the latest bar only, so analytics
+    history still comes from a process's own downloads.
+    """
+
+    def __init__(self, max_gap=pd.Timedelta(minutes=MAX_GAP_MINUTES), history_bars=HISTORY_BARS,
+                 shared_seconds=SHARED_SECONDS, since_group=pd.Timedelta(minutes=SINCE_GROUP_MINUTES)):
+        self.max_gap = max_gap
+        self.since_group = since_group
+        self.history_bars = history_bars
+        self.shared_seconds = shared_seconds
+        self._latest = pd.DataFrame()
+        self._history = pd.DataFrame()
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """Call listener(bars) with the newest bar per ticker after every poll that found data"""
+        self._listeners.append(listener)
+
+    def _last_seen(self):
+        if self._latest.empty:
+            return {}
+        return dict(zip(self._latest['Ticker'], self._latest['Date']))
+
+    def _plan(self, tickers, now):
+        """Split tickers into full refills and (since, tickers) incremental batches, leaving out closed ones"""
+        last_seen = self._last_seen()
+        session, trading = _latest_session(now.tz_convert(EXCHANGE_TZ))
+        refill, incremental = [], {}
+        for ticker in tickers:
+            seen = last_seen.get(ticker)
+            local = seen.tz_convert(EXCHANGE_TZ) if seen is not None else None
+            if local is None or local.date() < session or (trading and now - seen > self.max_gap):
+                refill.append(ticker)
+            elif not trading and local.date() == session and _minute_of_day(local) >= CLOSE_MINUTE - 1:
+                # Already holds the closing bar; nothing new comes until the next open
+                continue
+            else:
+                incremental[ticker] = seen
+        return refill, _group_by_seen(incremental, self.since_group)
+
+    def _merge(self, bars, history=True):
+        """Fold new bars into the per-ticker latest-bar state, and into the history unless history is False"""
+        if bars.empty:
+            return bars
+        newest = bars.sort_values('Date').groupby('Ticker', observed=True).tail(1)
+        combined = pd.concat([self._latest, newest], ignore_index=True) if not self._latest.empty else newest
+        self._latest = combined.sort_values('Date').groupby('Ticker', observed=True).tail(1).reset_index(drop=True)
+        if self.history_bars and history:
+            # Re-fetched minutes replace the copy that may still have been forming
+            history = pd.concat([self._history, bars], ignore_index=True) if not self._history.empty else bars
+            history = history.drop_duplicates(['Ticker', 'Date'], keep='last').sort_values(['Ticker', 'Date'])
+            self._history = history.groupby('Ticker', observed=True).tail(self.history_bars).reset_index(drop=True)
+        return newest
+
+    def _shared_bars(self, tickers):
+        """Latest bars other processes published within shared_seconds, for those tickers that have one"""
+        if not self.shared_seconds or not tickers:
+            return pd.DataFrame()
+        records = get_shared_cache().get_many('quotes', tickers, max_age=self.shared_seconds)
+        if not records:
+            return pd.DataFrame()
+        bars = pd.DataFrame.from_dict(records, orient='index').rename_axis('Ticker').reset_index()
+        bars['Date'] = pd.to_datetime(bars['Date'], utc=True)
+        return bars
+
+    def _publish(self, bars):
+        if not self.shared_seconds or bars.empty:
+            return
+        columns = [c for c in _BAR_COLUMNS if c in bars.columns]
+        frame = bars[columns].set_index(bars['Ticker'].astype(str))
+        frame.insert(0, 'Date', bars['Date'].map(pd.Timestamp.isoformat).to_numpy())
+        get_shared_cache().set_many('quotes', frame.to_dict('index'), ttl=self.shared_seconds)
+
+    def _take_shared(self, tickers, updates):
+        """Merge the shared bars for tickers into the state and return the tickers still to download"""
+        bars = self._shared_bars(tickers)
+        if bars.empty:
+            return tickers
+        with self._lock:
+            # Only bars newer than the ones held here count, so a process never just re-reads its own
+            last_seen = self._last_seen()
+            if last_seen:
+                seen = pd.to_datetime(bars['Ticker'].map(last_seen), utc=True)
+                bars = bars[seen.isna() | (bars['Date'] > seen)]
+            if bars.empty:
+                return tickers
+            # Shared entries are latest bars only; keeping them out of the history keeps analytics on full series
+            updates.append(self._merge(bars, history=False))
+        served = set(bars['Ticker'])
+        log_event(logger, 'shared_quotes_used', pipeline=PIPELINE, tickers=len(served))
+        return [ticker for ticker in tickers if ticker not in served]
+
+    def poll(self, tickers):
+        """Bring the state up to date for the tickers and return their latest bars"""
+        tickers = list(tickers)
+        updates = []
+        if not self.shared_seconds:
+            self._download(tickers, updates)
+        else:
+            pending = self._take_shared(tickers, updates)
+            if pending:
+                # Workers polling the same universe queue behind one download and reuse what it publishes
+                universe = hashlib.sha1(','.join(sorted(pending)).encode()).hexdigest()
+                with get_shared_cache().lease('quotes', universe, ttl=60, wait=self.shared_seconds) as holder:
+                    if not holder:
+                        pending = self._take_shared(pending, updates)
+                    self._download(pending, updates)
+
+        for bars in updates:
+            for listener in self._listeners:
+                listener(bars)
+
+        return self.latest(tickers)
+
+    def _download(self, tickers, updates):
+        """Refill or incrementally fetch the tickers, appending each batch's newest bars to updates"""
+        if not tickers:
+            return
+        with self._lock:
+            refill, batches = self._plan(tickers, pd.Timestamp.now(tz='UTC'))
+
+        if refill:
+            self._fetch(refill, updates, mode='refill', period="1d")
+        for since, batch in batches:
+            # The last seen minute is fetched again since it may still have been forming
+            self._fetch(batch, updates, mode='incremental', start=since)
+
+    def _fetch(self, tickers, updates, mode, **window):
+        with stage(PIPELINE, 'download', mode=mode, tickers=len(tickers)):
+            data = download_bars(tickers, interval="1m", **window)
+        if not data.empty:
+            with stage(PIPELINE, 'reshape'):
+                bars = _to_long(data, tickers)
+            with self._lock:
+                updates.append(self._merge(bars))
+            self._publish(updates[-1])
+
+    def latest(self, tickers=None):
+        """Latest known bar per ticker without any network access"""
+        with self._lock:
+            latest = self._latest
+        if latest.empty:
+            return pd.DataFrame()
+        if tickers is not None:
+            latest = latest[latest['Ticker'].isin(list(tickers))]
+        return latest.copy()
+
+    def history(self, tickers=None):
+        """Recent bars per ticker, oldest first, without any network access"""
+        with self._lock:
+            history = self._history
+        if history.empty:
+            return pd.DataFrame()
+        if tickers is not None:
+            history = history[history['Ticker'].isin(list(tickers))]
+        return history.copy()
+
+    def reset(self):
+        with self._lock:
+            self._latest = pd.DataFrame()
+            self._history = pd.DataFrame()
+
+# Shared by every realtime request so polls only transfer what changed since the last one
+engine = RealtimeEngine()
+
+def get_current_details(tickers, windows=()):
+    """Fetch current market data for a list of tickers, with intraday analytics over windows if any"""
     try:
         if not tickers:
             return pd.DataFrame()
-            
-        data = yf.download(tickers, period="1d", interval="1m", group_by="ticker", auto_adjust=False)
-       
+
+        data = engine.poll(tickers)
+
         if data.empty:
             return pd.DataFrame()
 
-        data.index = data.index.tz_localize(None)
-        
-        if isinstance(data.columns, pd.MultiIndex):
-            data = (data.stack(level=0, future_stack=True)
-                    .rename_axis(['Date', 'Ticker'])
-                    .reset_index()
-                    .drop(columns=['Volume']))
-        else:
-            data = data.reset_index()
-            data['Ticker'] = tickers[0]
-            data = data.drop(columns=['Volume'])
+        if windows:
+            # The latest bar per ticker, with metrics over the recent bars that lead up to it
+            with stage(PIPELINE, 'analytics', windows=list(windows)):
+                history = engine.history(tickers)
+                if history.empty:
+                    data = data.reindex(columns=list(data.columns) + analytics_columns(windows))
+                else:
+                    data = add_analytics(add_gaps(history), windows).groupby('Ticker', observed=True).tail(1)
 
-        latest_data = data[data['Date'] == data['Date'].max()]
-        
-        # **Sort the DataFrame by Ticker**
-        latest_data = latest_data.sort_values(by=['Ticker']).reset_index(drop=True)
+        with stage(PIPELINE, 'filter'):
+            # Naive exchange-local times, like the historic and specific-date exports
+            data['Date'] = data['Date'].dt.tz_convert(EXCHANGE_TZ).dt.tz_localize(None)
+
+            # Each ticker's own last bar, sorted by Ticker
+            latest_data = last_bars(data)
         
         return latest_data
 
     except Exception as e:
-        print(f"Error fetching data: {e}")
+        log_event(logger, 'fetch_failed', logging.ERROR, pipeline=PIPELINE, error=str(e))
         return pd.DataFrame()
 
-def generate_realtime_data(tickers=None):
-    """Generate Excel file with realtime data in a single sheet"""
+def generate_realtime_data(output_path, tickers=None, progress=None, file_format='xlsx', analytics=None):
+    """Generate an export with realtime data at output_path, plus analytics columns if requested"""
     try:
-        output = BytesIO()
         all_data = pd.DataFrame()
+        windows = resolve_windows(analytics)
         
-        if tickers:
-            # Use provided tickers
-            for index, symbols in tickers.items():
-                print(f"Processing {index}...")
-                df = get_current_details(symbols)
-                if not df.empty:
-                    df['Index'] = index
-                    all_data = pd.concat([all_data, df], ignore_index=True)
-        else:
-            # Use default index components
-            components, _ = get_index_components()
-            for index, symbols in components.items():
-                print(f"Processing {index}...")
-                df = get_current_details(symbols)
-                if not df.empty:
-                    df['Index'] = index
-                    all_data = pd.concat([all_data, df], ignore_index=True)
-        
-        # Write all data to a single sheet
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            if not all_data.empty:
-                cols = ['Ticker', 'Date', 'Open', 'High', 'Low', 'Close', 'Adj Close']
-                all_data = all_data[cols]
-                all_data.to_excel(writer, sheet_name='Realtime Data', index=False)
-        
-        output.seek(0)
-        return output
+        # Fetch every ticker once, then attach the index labels it belongs to
+        with stage(PIPELINE, 'plan'):
+            plan = plan_fetch(tickers)
+        log_event(logger, 'processing', pipeline=PIPELINE, tickers=len(plan.symbols), indices=plan.indices)
+        plan.report(progress, 'downloading')
+        df = get_current_details(plan.symbols, windows)
+        record_missing(PIPELINE, plan, df['Ticker'] if df is not None and not df.empty else [])
+        if df is not None and not df.empty:
+            with stage(PIPELINE, 'attach'):
+                all_data = attach_indices(df, plan)
+        plan.report(progress, 'writing')
+
+        # Write all data to a single sheet (or table) in the requested format
+        cols = ['Ticker', 'Date', 'Open', 'High', 'Low', 'Close', 'Adj Close']
+        if windows:
+            cols += analytics_columns(windows)
+        with stage(PIPELINE, 'write', format=file_format):
+            write_export(all_data, output_path, file_format, sheet_name='Realtime Data', columns=cols)
+        size = record_export(PIPELINE, file_format, output_path, len(all_data))
+        log_event(logger, 'export_written', pipeline=PIPELINE, format=file_format, rows=len(all_data), bytes=size)
+
+        plan.report(progress, 'done')
+        return output_path
     
     except Exception as e:
-        print(f"Error generating realtime data: {str(e)}")
+        EXPORTS.inc(pipeline=PIPELINE, outcome='error')
+        log_event(logger, 'export_failed', logging.ERROR, pipeline=PIPELINE, error=str(e))
         return None
@@ -0,0 +1,67 @@
+import os
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+# Set STOCK_DATA_PRICE_DTYPE=float32 to halve the memory of long price frames
+PRICE_DTYPE = np.dtype(os.environ.get('STOCK_DATA_PRICE_DTYPE', 'float64'))
+
+def wide_to_long(data, tickers, drop=('Volume',), dtype=None, date_name='Date'):
+    """Reshape a downloaded (Ticker, Price) frame to one row per (Date, Ticker).
+
+    Equivalent to data.stack(level=0, future_stack=True).reset_index() minus
+    the dropped columns, but built straight from the NumPy block into one
+    preallocated array. Ticker comes back categorical (sorted categories, so
+    it sorts like strings) and prices use dtype, PRICE_DTYPE by default.
+    Single-ticker frames with flat price columns belong to tickers[0].
+    """
+    dtype = np.dtype(dtype or PRICE_DTYPE)
+    if isinstance(data.columns, pd.MultiIndex):
+        column_tickers = data.columns.get_level_values(0)
+        column_prices = data.columns.get_level_values(1)
+    else:
+        column_tickers = pd.Index([tickers[0]] * len(data.columns))
+        column_prices = data.columns
+
+    keep = ~column_prices.isin(list(drop))
+    column_tickers, column_prices = column_tickers[keep], column_prices[keep]
+    seen_prices = list(dict.fromkeys(column_prices))
+    prices = [p for p in PRICE_COLUMNS if p in seen_prices] + [p for p in seen_prices if p not in PRICE_COLUMNS]
+
+    # Rows follow the tickers' column order, like stack(); codes point into sorted categories
+    ticker_order, ticker_positions = pd.factorize(column_tickers)
+    categories = pd.Index(ticker_positions).sort_values()
+    n_dates, n_tickers, n_prices = len(data), len(ticker_positions), len(prices)
+
+    values = (data if keep.all() else data.iloc[:, np.flatnonzero(keep)]).to_numpy(dtype=dtype)
+    price_positions = pd.Index(prices).get_indexer(column_prices)
+
+    # (price, date, ticker) layout: every price column ends up contiguous, which is
+    # how pandas stores a float block, so the frame below wraps it without copying
+    complete = len(column_tickers) == n_tickers * n_prices
+    block = np.empty((n_prices, n_dates, n_tickers), dtype=dtype) if complete \
+        else np.full((n_prices, n_dates, n_tickers), np.nan, dtype=dtype)
+    block[price_positions, :, ticker_order] = values.T
+
+    codes = categories.get_indexer(ticker_positions)
+    long = pd.DataFrame(block.reshape(n_prices, n_dates * n_tickers).T, columns=prices, copy=False)
+    long.insert(0, date_name, data.index.repeat(n_tickers))
+    long.insert(1, 'Ticker', pd.Categorical.from_codes(np.tile(codes, n_dates), categories=categories))
+    return long
+
+def drop_unpriced(data):
+    """Rows with at least one OHLC price; union downloads pad closed markets with all-NaN rows"""
+    prices = [p for p in ('Open', 'High', 'Low', 'Close') if p in data.columns]
+    return data.dropna(subset=prices, how='all')
+
+def last_bars(data, date_name='Date'):
+    """Each ticker's own latest bar that has a price, sorted by Ticker.
+
+    Tickers trade on different calendars and clocks (^HSI is a day ahead of
+    New York, ^IBEX stops hours earlier), so one max-date cut across them
+    would leave NaN rows for some tickers and drop others entirely.
+    """
+    data = drop_unpriced(data)
+    data = data.sort_values(date_name, kind='stable').groupby('Ticker', observed=True).tail(1)
+    return data.sort_values('Ticker').reset_index(drop=True)
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+import datetime
+from config import CACHE_DIR
+from market_calendar import exchange_now
+from metrics import get_logger, log_event, RESULT_CACHE
+
+RESULT_CACHE_DIR = CACHE_DIR / 'results'
+
+# Seconds a result that can still change stays valid: quote snapshots, and ranges that include today
+REALTIME_TTL = float(os.environ.get('STOCK_DATA_REALTIME_RESULT_TTL', 60))
+CURRENT_DAY_TTL = float(os.environ.get('STOCK_DATA_CURRENT_DAY_RESULT_TTL', 300))
+
+# Seconds an export with tickers that had no data stays valid, so a later request retries them
+INCOMPLETE_TTL = float(os.environ.get('STOCK_DATA_INCOMPLETE_RESULT_TTL', 300))
+
+# STOCK_DATA_RESULT_CACHE=0 regenerates every export
+ENABLED = os.environ.get('STOCK_DATA_RESULT_CACHE', '1') != '0'
+
+# Pipelines whose output is a snapshot of the market right now
+_REALTIME_KINDS = ('realtime', 'all_data')
+
+logger = get_logger(__name__)
+
+def result_ttl(kind, params):
+    """Seconds a result stays valid, or None when it covers finished sessions only and never changes"""
+    if kind in _REALTIME_KINDS:
+        return REALTIME_TTL
+    last_date = params.get('end_date') or max(params.get('dates') or [''], default='')
+    if not last_date:
+        return CURRENT_DAY_TTL
+    last_date = datetime.date.fromisoformat(str(last_date)[:10])
+    return None if last_date < exchange_now().date() else CURRENT_DAY_TTL
+
+def incomplete_ttl(ttl):
+    """TTL for a result some tickers were missing from: never longer than INCOMPLETE_TTL"""
+    return INCOMPLETE_TTL if ttl is None else min(ttl, INCOMPLETE_TTL)
+
+def _link(source, destination):
+    """Hard-link source to destination, copying where links are not supported (other volume, FAT, ...)"""
+    os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+    if os.path.exists(destination):
+        # Never write through an existing link into another artifact
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+class ResultCache:
+    """Finished exports keyed by job key (pipeline, parameters, ticker set and format).
+
+    Artifacts are hard links to the first export of a key, so a hit costs one
+    link instead of a scrape, download and write. Entries live in an
+    append-only JSON-lines index that every process tails, so lookups are a
+    dict access and new entries from other workers are picked up cheaply.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, enabled=ENABLED):
+        self.directory = directory
+        self.index_path = directory / 'index.jsonl'
+        self.enabled = enabled
+        self._entries = {}
+        self._offset = 0
+        self._lines = 0
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def _artifact(self, key):
+        return self.directory / key[:2] / key
+
+    def _refresh(self):
+        """Apply index lines appended since the last read, by this or any other process"""
+        try:
+            with open(self.index_path, 'rb') as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if inode != self._inode:
+                    # First read, or another process compacted the index
+                    self._entries, self._offset, self._lines, self._inode = {}, 0, 0, inode
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # a writer is mid-line; picked up next time
+                    self._offset += len(line)
+                    self._lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get('deleted'):
+                        self._entries.pop(entry['key'], None)
+                    else:
+                        self._entries[entry['key']] = entry
+        except FileNotFoundError:
+            pass
+
+    def _append(self, entry):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        self._append({'key': key, 'deleted': True})
+        try:
+            os.remove(self._artifact(key))
+        except OSError:
+            pass
+
+    def fetch(self, key, output_path, kind=''):
+        """Link a valid cached result to output_path and return it, or None on a miss"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] is not None and entry['expires_at'] <= time.time():
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                try:
+                    _link(self._artifact(key), output_path)
+                except OSError:
+                    self._drop(key)
+                    entry = None
+        RESULT_CACHE.inc(kind=kind, outcome='hit' if entry else 'miss')
+        if entry is None:
+            return None
+        log_event(logger, 'result_cache_hit', kind=kind, key=key[:12], name=entry['name'])
+        return output_path
+
+    def store(self, key, file_path, ttl, kind=''):
+        """Keep file_path as the result for key; ttl=None never expires"""
+        if not self.enabled or not file_path or not os.path.exists(file_path):
+            return
+        now = time.time()
+        entry = {
+            'key': key,
+            'kind': kind,
+            'name': os.path.basename(file_path),
+            'size': os.path.getsize(file_path),
+            'created_at': now,
+            'expires_at': None if ttl is None else now + ttl,
+        }
+        with self._lock:
+            self._refresh()
+            artifact = self._artifact(key)
+            try:
+                if os.path.exists(artifact):
+                    os.remove(artifact)
+                _link(file_path, artifact)
+            except OSError as e:
+                log_event(logger, 'result_cache_store_failed', logging.WARNING, kind=kind, error=str(e))
+                return
+            self._entries[key] = entry
+            self._append(entry)
+            self._purge_expired(now)
+
+    def _purge_expired(self, now):
+        """Drop expired entries and rewrite the index once it is mostly superseded lines"""
+        for key in [k for k, e in self._entries.items() if e['expires_at'] is not None and e['expires_at'] <= now]:
+            self._drop(key)
+        self._refresh()
+        if self._lines > 2 * len(self._entries) + 100:
+            tmp_path = self.index_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in self._entries.values():
+                    f.write(json.dumps(entry) + '\n')
+            os.replace(tmp_path, self.index_path)
+            self._inode = None
+            self._refresh()
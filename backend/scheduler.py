@@ -0,0 +1,150 @@
+import os
+import time
+import datetime
+import logging
+import threading
+from apscheduler.schedulers.background import BackgroundScheduler
+from all_components import generate_all_data
+from realtime_data import generate_realtime_data
+from archive import get_archive
+from market_calendar import EXCHANGE_TZ, is_trading_day, exchange_now
+from config import CACHE_DIR, SCHEDULED_DAILY_DIR, SCHEDULED_REALTIME_DIR
+from metrics import get_logger, log_event
+
+# Set STOCK_DATA_SCHEDULER=0 to serve the UI without automated snapshots
+SCHEDULER_ENABLED = os.environ.get('STOCK_DATA_SCHEDULER', '1') != '0'
+
+# A job that could not start on time still runs if it is at most this late
+MISFIRE_GRACE_SECONDS = 15 * 60
+
+# Held by the one worker process that schedules snapshots when several serve the app
+SCHEDULER_LOCK_PATH = CACHE_DIR / 'scheduler.lock'
+
+logger = get_logger(__name__)
+
+_scheduler = None
+_lock_file = None
+_running = {}
+
+def _session_date(now):
+    """Session a run captures: before the open that is still the previous day's"""
+    if now.time() < datetime.time(9, 30):
+        return (now - datetime.timedelta(days=1)).date()
+    return now.date()
+
+def _exclusive(name):
+    """Skip a run while the previous run of the same job is still in progress"""
+    def decorator(func):
+        lock = _running.setdefault(name, threading.Lock())
+
+        def wrapper():
+            if not lock.acquire(blocking=False):
+                log_event(logger, 'task_skipped', logging.WARNING, task=name, reason='previous run in progress')
+                return
+            try:
+                func()
+            finally:
+                lock.release()
+        wrapper.__name__ = func.__name__
+        return wrapper
+    return decorator
+
+# Function to generate and save the all data file
+@_exclusive('all_data')
+def scheduled_download_all_data():
+    try:
+        session = _session_date(exchange_now())
+        if not is_trading_day(session):
+            log_event(logger, 'task_skipped', task='all_data', reason='not a trading day', session=session)
+            return
+        log_event(logger, 'task_started', task='all_data')
+        filename = f'scheduled_all_data_{time.strftime("%Y-%m-%d_%H%M%S")}.xlsx'
+        SCHEDULED_DAILY_DIR.mkdir(parents=True, exist_ok=True)
+        if generate_all_data(os.path.join(SCHEDULED_DAILY_DIR, filename)):
+            log_event(logger, 'task_finished', task='all_data', file=filename)
+        else:
+            log_event(logger, 'task_failed', logging.ERROR, task='all_data', error='no data was generated')
+    except Exception as e:
+        log_event(logger, 'task_failed', logging.ERROR, task='all_data', error=str(e))
+
+# Function to generate and save the real-time data file
+@_exclusive('realtime')
+def scheduled_download_realtime_data():
+    try:
+        if not is_trading_day(exchange_now()):
+            log_event(logger, 'task_skipped', task='realtime', reason='market closed today')
+            return
+        # The shared realtime engine only fetches bars newer than the previous run
+        log_event(logger, 'task_started', task='realtime')
+        filename = f'scheduled_realtime_data_{time.strftime("%Y-%m-%d_%H%M%S")}.xlsx'
+        SCHEDULED_REALTIME_DIR.mkdir(parents=True, exist_ok=True)
+        if generate_realtime_data(os.path.join(SCHEDULED_REALTIME_DIR, filename)):
+            log_event(logger, 'task_finished', task='realtime', file=filename)
+        else:
+            log_event(logger, 'task_failed', logging.ERROR, task='realtime', error='no data was generated')
+    except Exception as e:
+        log_event(logger, 'task_failed', logging.ERROR, task='realtime', error=str(e))
+
+# Roll the day's snapshot files into the Parquet archive and apply its retention
+@_exclusive('archive')
+def scheduled_compact_archive():
+    try:
+        log_event(logger, 'task_started', task='archive')
+        summary = get_archive().compact()
+        log_event(logger, 'task_finished', task='archive', sources=summary.get('sources', 0),
+                  partitions=summary.get('partitions', 0))
+    except Exception as e:
+        log_event(logger, 'task_failed', logging.ERROR, task='archive', error=str(e))
+
+def _claim_scheduler_lock():
+    """Take the host-wide scheduler lock without blocking; it is released when the process exits"""
+    global _lock_file
+    try:
+        import fcntl
+    except ImportError:
+        return True  # no fork-based serving without fcntl, so there is only this process
+    SCHEDULER_LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(SCHEDULER_LOCK_PATH, 'a')
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+def start_scheduler(exclusive=False):
+    """Start the snapshot jobs once per process; returns the running scheduler.
+
+    With exclusive, only the first worker process on the host to call it
+    schedules anything, so pre-fork workers do not each take the snapshots.
+    """
+    global _scheduler
+    if _scheduler is not None or not SCHEDULER_ENABLED:
+        return _scheduler
+    if exclusive and not _claim_scheduler_lock():
+        log_event(logger, 'scheduler_skipped', reason='another worker process schedules snapshots')
+        return None
+
+    # Overlapping or missed fire times collapse into a single run
+    scheduler = BackgroundScheduler(timezone=EXCHANGE_TZ, job_defaults={
+        'coalesce': True,
+        'max_instances': 1,
+        'misfire_grace_time': MISFIRE_GRACE_SECONDS,
+    })
+
+    # Previous session's closing snapshot at 1 AM Eastern
+    scheduler.add_job(scheduled_download_all_data, 'cron', day_of_week='tue-sat', hour=1, minute=0,
+                      id='download_all_data', replace_existing=True)
+
+    # Realtime snapshot every hour from 10 AM to 5 PM Eastern
+    scheduler.add_job(scheduled_download_realtime_data, 'cron', day_of_week='mon-fri', hour='10-17', minute=0,
+                      id='download_realtime_data', replace_existing=True)
+
+    # Archive compaction at 2 AM Eastern, after the closing snapshot
+    scheduler.add_job(scheduled_compact_archive, 'cron', hour=2, minute=0,
+                      id='compact_archive', replace_existing=True)
+
+    scheduler.start()
+    _scheduler = scheduler
+    return scheduler
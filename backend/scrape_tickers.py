@@ -1,81 +1,253 @@
+import os
+import json
+import logging
+import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 import pandas as pd
-from time import sleep
-from io import BytesIO
+from excel_sink import ExcelSink
+from config import CACHE_DIR
+from shared_cache import get_shared_cache
+from metrics import get_logger, log_event, stage, record_export, UPSTREAM_ERRORS
 
-def get_index_components():
-    """Scrape current components of major indices from SlickCharts"""
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-        "Referer": "https://www.google.com",
-    }
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
+    "Referer": "https://www.google.com",
+}
+
+ETF_CODES = [
+    'SPY', 'SSO', 'SPXL', 'RSP', 'QQQ', 'QLD', 'TQQQ', 'DIA', 'WEBL', 'IWF',
+    'XLK', 'XLV', 'XLY', 'XLC', 'XLF', 'XLI', 'XLP', 'XLU', 'XLB', 'XLRE',
+    'XLE', 'MDY', 'SPMD', 'SH', 'SDS', 'SPXS', 'PSQ', 'QID', 'SQQQ', 'RWM',
+    'GLD', 'SLV', 'USO', 'UNG'
+]
+
+OTHER_INDICES = [
+    'SPX', 'IXIC', 'DJI', 'N225', 'FTSE', 'FCHI', '^HSI', 'TA35.TA', '^IBEX'
+]
+
+INDICES = {
+    'SP500': 'https://www.slickcharts.com/sp500',
+    'Nasdaq100': 'https://www.slickcharts.com/nasdaq100',
+    'DowJones': 'https://www.slickcharts.com/dowjones',
+    'ETFs': ETF_CODES,
+    'Other': OTHER_INDICES
+}
+
+# Scraped components are reused for this many seconds before a background refresh
+COMPONENTS_TTL = int(os.environ.get('INDEX_COMPONENTS_TTL', 6 * 60 * 60))
+COMPONENTS_CACHE_PATH = CACHE_DIR / 'index_components.json'
+
+# Seconds one worker process may hold the refresh before another takes over
+REFRESH_LEASE_SECONDS = int(os.environ.get('INDEX_COMPONENTS_REFRESH_LEASE', 120))
+
+logger = get_logger(__name__)
+
+_session = None
+_cache = None
+_cache_mtime = None
+_cache_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+def _get_session():
+    """Pooled session so the SlickCharts pages share keep-alive connections"""
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=len(INDICES))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _session = session
+    return _session
+
+def _parse_components(content):
+    """Extract (symbol, company name) pairs from a SlickCharts components table"""
+    soup = BeautifulSoup(content, HTML_PARSER)
+    table = soup.find('table', {'class': 'table table-hover table-borderless table-sm'})
+
+    if not table:
+        return None
+
+    rows = table.find('tbody').find_all('tr')
+    tickers_with_names = []
+
+    for row in rows:
+        cols = row.find_all('td')
+        if len(cols) < 3:
+            continue
+
+        name_link = cols[1].find('a')
+        symbol_link = cols[2].find('a')
+
+        company_name = name_link.text.strip() if name_link else ''
+        symbol = symbol_link.text.strip() if symbol_link else ''
 
-    etf_codes = [
-            'SPY', 'SSO', 'SPXL', 'RSP', 'QQQ', 'QLD', 'TQQQ', 'DIA', 'WEBL', 'IWF',
-            'XLK', 'XLV', 'XLY', 'XLC', 'XLF', 'XLI', 'XLP', 'XLU', 'XLB', 'XLRE',
-            'XLE', 'MDY', 'SPMD', 'SH', 'SDS', 'SPXS', 'PSQ', 'QID', 'SQQQ', 'RWM',
-            'GLD', 'SLV', 'USO', 'UNG'
-        ]
-    
-    other_indices = [
-        'SPX', 'IXIC', 'DJI', 'N225', 'FTSE', 'FCHI', '^HSI', 'TA35.TA', '^IBEX'
-    ]
-    
-    indices = {
-        'SP500': 'https://www.slickcharts.com/sp500',
-        'Nasdaq100': 'https://www.slickcharts.com/nasdaq100',
-        'DowJones': 'https://www.slickcharts.com/dowjones',
-        'ETFs': etf_codes,
-        'Other': other_indices
+        if symbol:
+            tickers_with_names.append((symbol, company_name))
+
+    return tickers_with_names
+
+def _scrape_index(index, url, cached):
+    """Conditionally fetch one index page, returning the cached entry when it is unchanged"""
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    with stage('scrape', 'fetch', index=index):
+        response = _get_session().get(url, headers=headers, timeout=30)
+    if response.status_code == 304 and cached:
+        return cached
+    response.raise_for_status()
+
+    with stage('scrape', 'parse', index=index):
+        tickers_with_names = _parse_components(response.content)
+    if tickers_with_names is None:
+        UPSTREAM_ERRORS.inc(source='slickcharts', index=index)
+        log_event(logger, 'components_table_missing', logging.WARNING, index=index)
+        return cached
+
+    return {
+        'tickers': [[symbol, name] for symbol, name in tickers_with_names],
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
     }
 
-    components = {}
-    components_names = {}
+def _cache_file_mtime():
+    try:
+        return os.stat(COMPONENTS_CACHE_PATH).st_mtime
+    except OSError:
+        return None
+
+def _load_cache():
+    try:
+        with open(COMPONENTS_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _adopt_disk_cache():
+    """Take the disk copy when another process saved a newer one; returns the current cache"""
+    global _cache, _cache_mtime
+    with _cache_lock:
+        mtime = _cache_file_mtime()
+        if mtime is not None and mtime != _cache_mtime:
+            cache = _load_cache()
+            if cache and cache.get('fetched_at', 0) >= (_cache or {}).get('fetched_at', 0):
+                _cache = cache
+            _cache_mtime = mtime
+        return _cache
 
-    for index, url in indices.items():
-        try:
-            if index in ['ETFs', 'Other']:
-                # Just use symbol with empty name
-                components[index] = url
-                components_names[index] = [(symbol, '') for symbol in url]
-                continue
+def _save_cache(cache):
+    COMPONENTS_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = COMPONENTS_CACHE_PATH.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, COMPONENTS_CACHE_PATH)
 
-            response = requests.get(url, headers=headers)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            table = soup.find('table', {'class': 'table table-hover table-borderless table-sm'})
+def refresh_index_components():
+    """Refresh the cached components of every index.
 
-            if not table:
-                continue
+    Worker processes share the disk cache, so only the holder of the refresh
+    lease scrapes; the others wait for it and load what it saved.
+    """
+    with _refresh_lock:
+        known = (_cache or {}).get('fetched_at', 0)
+        with get_shared_cache().lease('components', 'refresh', ttl=REFRESH_LEASE_SECONDS,
+                                      wait=REFRESH_LEASE_SECONDS) as holder:
+            cache = _adopt_disk_cache()
+            if cache and cache.get('indices') and cache.get('fetched_at', 0) > known:
+                # Another worker refreshed while this one was waiting for the lease
+                log_event(logger, 'components_refreshed_elsewhere', holder=holder)
+                return cache
+            if not holder:
+                log_event(logger, 'components_refresh_lease_timeout', logging.WARNING)
+            return _scrape_all()
 
-            rows = table.find('tbody').find_all('tr')
-            tickers = []
-            tickers_with_names = []
+def _scrape_all():
+    """Scrape every index page concurrently and save the result to memory and disk"""
+    global _cache, _cache_mtime
+    previous = (_cache or {}).get('indices', {})
+    scraped = {index: url for index, url in INDICES.items() if isinstance(url, str)}
+    results = {}
 
-            for row in rows:
-                cols = row.find_all('td')
-                if len(cols) < 3:
-                    continue
+    with ThreadPoolExecutor(max_workers=len(scraped)) as executor:
+        futures = {index: executor.submit(_scrape_index, index, url, previous.get(index))
+                   for index, url in scraped.items()}
+        for index, future in futures.items():
+            try:
+                entry = future.result()
+            except Exception as e:
+                UPSTREAM_ERRORS.inc(source='slickcharts', index=index)
+                log_event(logger, 'scrape_failed', logging.ERROR, index=index, error=str(e))
+                entry = previous.get(index)
+            if entry:
+                results[index] = entry
 
-                name_link = cols[1].find('a')
-                symbol_link = cols[2].find('a')
+    cache = {'fetched_at': time.time(), 'indices': results}
+    with _cache_lock:
+        _cache = cache
+    try:
+        _save_cache(cache)
+        _cache_mtime = _cache_file_mtime()
+    except OSError as e:
+        log_event(logger, 'components_cache_save_failed', logging.ERROR, error=str(e))
+    return cache
 
-                company_name = name_link.text.strip() if name_link else ''
-                symbol = symbol_link.text.strip() if symbol_link else ''
+def _refresh_in_background():
+    if _refresh_lock.locked():
+        return
+    threading.Thread(target=refresh_index_components, daemon=True).start()
+
+def _current_cache():
+    """Cached components, refreshed synchronously only when nothing is cached at all"""
+    cache = _adopt_disk_cache()
+
+    if not cache or not cache.get('indices'):
+        return refresh_index_components()
+
+    if time.time() - cache.get('fetched_at', 0) > COMPONENTS_TTL:
+        # Serve the stale copy and refresh it without blocking the caller
+        _refresh_in_background()
+    return cache
+
+def get_index_components():
+    """Current components of major indices, scraped from SlickCharts and cached with a TTL"""
+    cached = _current_cache()['indices']
+
+    components = {}
+    components_names = {}
 
-                if symbol:
-                    tickers.append(symbol)
-                    tickers_with_names.append((symbol, company_name))
+    for index, url in INDICES.items():
+        if index in ['ETFs', 'Other']:
+            # Just use symbol with empty name
+            components[index] = list(url)
+            components_names[index] = [(symbol, '') for symbol in url]
+            continue
 
-            components[index] = tickers
-            components_names[index] = tickers_with_names
+        entry = cached.get(index)
+        if not entry:
+            continue
 
-        except Exception as e:
-            print(f"Error scraping {index}: {str(e)}")
+        components[index] = [symbol for symbol, _ in entry['tickers']]
+        components_names[index] = [(symbol, name) for symbol, name in entry['tickers']]
 
     return components, components_names
 
-def generate_index_name():
+def generate_index_name(output_path):
+    """Write the ticker -> company name / index membership sheet to output_path"""
     components, components_names = get_index_components()
 
     # Build ticker-to-name mapping
@@ -116,10 +288,10 @@ def generate_index_name():
     df.reset_index(inplace=True)
     df = df[['Ticker', 'Company Name', 'Dow Jones', 'Nasdaq 100', 'SP500', 'ETF', 'Other', 'Indices']]
 
-    # Save to in-memory Excel file
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='IndexComponents')
+    # Stream straight to the destination file
+    with stage('index', 'write', format='xlsx'):
+        with ExcelSink(output_path) as sink:
+            sink.write_frame(df, sheet_name='IndexComponents')
+    record_export('index', 'xlsx', output_path, len(df))
 
-    output.seek(0)
-    return output
\ No newline at end of file
+    return output_path
\ No newline at end of file
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import CACHE_DIR
+from sqlite_util import chunks
+
+SHARED_CACHE_PATH = CACHE_DIR / 'shared.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leases (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+"""
+
+class SharedCache:
+    """JSON values with optional TTLs in one SQLite file that every worker process opens.
+
+    Pre-fork workers use it to see each other's recent results (quotes, job
+    status) and take short leases so only one of them refreshes the same
+    upstream data at a time. Connections are per thread and opened lazily,
+    so nothing is inherited across a fork.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, namespace, key):
+        return self.get_many(namespace, [key]).get(key)
+
+    def get_many(self, namespace, keys, max_age=None):
+        """Unexpired values for the keys that have one, optionally only those written in the last max_age seconds"""
+        now = time.time()
+        oldest = now - max_age if max_age is not None else 0
+        found = {}
+        conn = self._connect()
+        for chunk in chunks(list(keys)):
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT key, value FROM entries WHERE namespace = ? AND key IN ({placeholders}) '
+                f'AND (expires_at IS NULL OR expires_at > ?) AND updated_at >= ?',
+                [namespace, *chunk, now, oldest])
+            found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def values(self, namespace):
+        """Every unexpired value in a namespace"""
+        rows = self._connect().execute(
+            'SELECT value FROM entries WHERE namespace = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (namespace, time.time()))
+        return [json.loads(value) for value, in rows]
+
+    def set(self, namespace, key, value, ttl=None):
+        self.set_many(namespace, {key: value}, ttl)
+
+    def set_many(self, namespace, values, ttl=None):
+        """Upsert values; ttl=None keeps them until overwritten or deleted"""
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        rows = [(namespace, key, json.dumps(value, default=str), now, expires_at) for key, value in values.items()]
+        if not rows:
+            return
+        conn = self._connect()
+        with self._transaction(conn):
+            conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', rows)
+            # Expired rows are dropped by whoever writes to the namespace next
+            conn.execute('DELETE FROM entries WHERE namespace = ? AND expires_at <= ?', (namespace, now))
+
+    def delete(self, namespace, key):
+        self._connect().execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (namespace, key))
+
+    @contextmanager
+    def _transaction(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _try_acquire(self, namespace, key, owner, ttl):
+        conn = self._connect()
+        now = time.time()
+        with self._transaction(conn):
+            conn.execute('DELETE FROM leases WHERE namespace = ? AND key = ? AND expires_at <= ?', (namespace, key, now))
+            cursor = conn.execute('INSERT OR IGNORE INTO leases VALUES (?, ?, ?, ?)', (namespace, key, owner, now + ttl))
+            return cursor.rowcount == 1
+
+    @contextmanager
+    def lease(self, namespace, key, ttl=60, wait=0.0, poll=0.2):
+        """Hold (namespace, key) across processes; yields True for the holder.
+
+        Others get False straight away, or once the holder releases it when
+        wait is set (at most wait seconds), and should then re-read what the
+        holder produced. A crashed holder's lease lapses after ttl seconds.
+        """
+        owner = f'{os.getpid()}-{threading.get_ident()}'
+        deadline = time.monotonic() + wait
+        acquired = self._try_acquire(namespace, key, owner, ttl)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(poll)
+            row = self._connect().execute('SELECT 1 FROM leases WHERE namespace = ? AND key = ? AND expires_at > ?',
+                                          (namespace, key, time.time())).fetchone()
+            if row is None:
+                break
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._connect().execute('DELETE FROM leases WHERE namespace = ? AND key = ? AND owner = ?',
+                                        (namespace, key, owner))
+
+_shared_cache = None
+
+def get_shared_cache():
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = SharedCache()
+    return _shared_cache
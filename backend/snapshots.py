@@ -0,0 +1,102 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from market_calendar import EXCHANGE_TZ
+
+# Regular session in exchange-local minutes of the day
+OPEN_MINUTE = 9 * 60 + 30
+CLOSE_MINUTE = 16 * 60
+
+MINUTES_PER_DAY = 24 * 60
+
+SNAPSHOT_RULES = {
+    'close': 'Last bar of the session',
+    'first_after_open': 'First bar after the open',
+    'at_or_before:HH:MM': 'Last bar at or before a time (Eastern)',
+}
+
+_AT_OR_BEFORE = re.compile(r'^at_or_before:(\d{1,2}):(\d{2})$')
+
+def parse_rule(rule):
+    """(side, minute) for a snapshot rule: the last bar at or before minute, or the first at or after it"""
+    rule = (rule or 'close').strip().lower()
+    if rule == 'close':
+        # Bars are stamped with their start, so the closing bar starts before the bell
+        return 'at_or_before', CLOSE_MINUTE - 1
+    if rule == 'first_after_open':
+        return 'at_or_after', OPEN_MINUTE
+    match = _AT_OR_BEFORE.match(rule)
+    if match:
+        hour, minute = int(match.group(1)), int(match.group(2))
+        if hour < 24 and minute < 60:
+            return 'at_or_before', hour * 60 + minute
+    raise ValueError(f"Unknown snapshot rule: {rule} (use close, first_after_open or at_or_before:HH:MM)")
+
+def normalize_rule(rule):
+    """Canonical spelling of a rule, so equal rules give equal job keys"""
+    side, minute = parse_rule(rule)
+    if (side, minute) == ('at_or_before', CLOSE_MINUTE - 1):
+        return 'close'
+    if side == 'at_or_after':
+        return 'first_after_open'
+    return f'at_or_before:{minute // 60:02d}:{minute % 60:02d}'
+
+# Rules used when a request does not choose one, e.g. STOCK_DATA_HISTORIC_SNAPSHOT=at_or_before:15:30
+HISTORIC_RULE = normalize_rule(os.environ.get('STOCK_DATA_HISTORIC_SNAPSHOT', 'close'))
+SPECIFIC_DATE_RULE = normalize_rule(os.environ.get('STOCK_DATA_SPECIFIC_DATE_SNAPSHOT', 'close'))
+
+def local_minutes(dates, tz=None):
+    """Exchange-local session days (datetime64[D]) and minutes of the day for a datetime column.
+
+    Aware dates are converted to the exchange zone; naive ones are read as
+    wall times in tz (the exchange zone when None), so DST shifts land on the
+    right local minute.
+    """
+    dates = pd.Series(dates)
+    if dates.dt.tz is None and tz is not None and str(tz) != str(EXCHANGE_TZ):
+        dates = dates.dt.tz_localize(tz)
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_convert(EXCHANGE_TZ).dt.tz_localize(None)
+    local = dates.to_numpy()
+    days = local.astype('datetime64[D]')
+    minutes = ((local - days) // np.timedelta64(1, 'm')).astype(np.int64)
+    return days, minutes
+
+def select_snapshots(data, rule='close', by='Ticker', date='Date', tz=None):
+    """One row per (by, exchange-local day) picked by a snapshot rule, in the frame's original order.
+
+    Only the distinct timestamps go through the timezone conversion; rows then
+    index into their local minutes, and the pick per (by, day) group is one
+    NumPy max/min reduction over dense group ids, with no per-row time
+    objects and no sort. Groups without a qualifying bar are left out.
+    """
+    if data.empty:
+        return data
+    side, cutoff = parse_rule(rule)
+    date_codes, stamps = pd.factorize(data[date])
+    stamp_days, stamp_minutes = local_minutes(stamps, tz)
+    session_ids, stamp_sessions = np.unique(stamp_days, return_inverse=True)
+    codes = data[by].cat.codes.to_numpy() if isinstance(data[by].dtype, pd.CategoricalDtype) \
+        else pd.factorize(data[by])[0]
+
+    minutes = stamp_minutes[date_codes]
+    group = codes.astype(np.int64) * len(session_ids) + stamp_sessions[date_codes]
+    n_groups = (int(codes.max()) + 1) * len(session_ids)
+    valid = (date_codes >= 0) & (codes >= 0)
+
+    if side == 'at_or_before':
+        eligible = (minutes <= cutoff) & valid
+        best = np.full(n_groups, -1, dtype=np.int64)
+        np.maximum.at(best, group[eligible], minutes[eligible])
+    else:
+        eligible = (minutes >= cutoff) & valid
+        best = np.full(n_groups, MINUTES_PER_DAY, dtype=np.int64)
+        np.minimum.at(best, group[eligible], minutes[eligible])
+    rows = np.flatnonzero(eligible & (minutes == best[group]))
+
+    # The same bar twice (a re-fetched minute) keeps its last copy
+    if len(rows) > np.count_nonzero((best >= 0) & (best < MINUTES_PER_DAY)):
+        _, last = np.unique(group[rows][::-1], return_index=True)
+        rows = np.sort(rows[::-1][last])
+    return data.iloc[rows]
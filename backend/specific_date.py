@@ -1,82 +1,172 @@
-import yfinance as yf
+import logging
+from downloader import download_bars
 import pandas as pd
-from io import BytesIO
-from scrape_tickers import get_index_components
+from exporters import write_export
+from reshape import wide_to_long, drop_unpriced
+from analytics import resolve_windows, analytics_columns, add_analytics, add_gaps
+from ticker_plan import plan_fetch, attach_indices
+from market_calendar import EXCHANGE_TZ, is_trading_day, previous_trading_day, exchange_now, trading_sessions
+from snapshots import select_snapshots, normalize_rule, SPECIFIC_DATE_RULE
+from metrics import get_logger, log_event, stage, record_export, record_missing, EXPORTS
 
-def get_specific_date_data(tickers, specific_date):
-    """Fetch data for a list of tickers on a specific date"""
+PIPELINE = 'specific_date'
+
+logger = get_logger(__name__)
+
+def resolve_trading_date(specific_date, roll=True):
+    """The session to fetch for a date: itself, the previous session when rolling, or None"""
+    day = pd.to_datetime(specific_date).date()
+    if day > exchange_now().date():
+        log_event(logger, 'date_skipped', logging.WARNING, date=day, reason='future')
+        return None
+    if is_trading_day(day):
+        return day
+    if not roll:
+        log_event(logger, 'date_skipped', logging.WARNING, date=day, reason='market closed')
+        return None
+    rolled = previous_trading_day(day)
+    log_event(logger, 'date_rolled', date=day, session=rolled)
+    return rolled
+
+DATE_RULES = {
+    'daily': 'Every trading day',
+    'weekly': 'Last trading day of each week',
+    'monthly': 'Last trading day of each month',
+    'monday': 'Every Monday', 'tuesday': 'Every Tuesday', 'wednesday': 'Every Wednesday',
+    'thursday': 'Every Thursday', 'friday': 'Every Friday',
+}
+
+_WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
+
+def expand_dates(start_date, end_date, rule):
+    """Dates in [start_date, end_date] selected by one of DATE_RULES"""
+    if rule not in DATE_RULES:
+        raise ValueError(f"Unknown date rule: {rule}")
+
+    if rule in _WEEKDAYS:
+        days = pd.date_range(start_date, end_date, freq='D')
+        return [day.date() for day in days if day.weekday() == _WEEKDAYS.index(rule)]
+
+    sessions = pd.DatetimeIndex(trading_sessions(start_date, end_date))
+    if rule == 'daily' or sessions.empty:
+        return [day.date() for day in sessions]
+
+    period = sessions.to_period('W' if rule == 'weekly' else 'M')
+    last_in_period = ~pd.Series(period).duplicated(keep='last').to_numpy()
+    return [day.date() for day in sessions[last_in_period]]
+
+def get_specific_date_data(tickers, specific_date, roll=True, windows=(), snapshot=None):
+    """Fetch one bar per ticker on a specific date, or on each date of a list.
+
+    All dates are served from one covering-range download; the bar kept per
+    date is picked by the snapshot rule (the session's last bar by default)
+    in one vectorized pass. With windows, returns, moving averages and
+    volatility run across the snapshots of each ticker.
+    """
     try:
         if not tickers:
             return pd.DataFrame()
 
-        # Define start and end for the date range
-        start_date = pd.to_datetime(specific_date)
-        end_date = start_date + pd.Timedelta(days=1)
+        requested = specific_date if isinstance(specific_date, (list, tuple, set)) else [specific_date]
+
+        # Weekends, holidays and future dates are resolved locally, without a round-trip
+        sessions = sorted({day for day in (resolve_trading_date(d, roll) for d in requested) if day is not None})
+        if not sessions:
+            return pd.DataFrame()
 
-        data = yf.download(tickers, start=start_date, end=end_date, interval="60m", group_by="ticker", auto_adjust=False)
+        # Define start and end for the covering date range; opening gaps also need the session before
+        start_date = pd.to_datetime(previous_trading_day(sessions[0], inclusive=False) if windows else sessions[0])
+        end_date = pd.to_datetime(sessions[-1]) + pd.Timedelta(days=1)
+
+        with stage(PIPELINE, 'download', tickers=len(tickers), dates=len(sessions)):
+            data = download_bars(tickers, start=start_date, end=end_date, interval="60m")
 
         if data.empty:
             return pd.DataFrame()
 
-        # Ensure datetime is not timezone-aware
-        data.index = data.index.tz_localize(None)
-        
-        if isinstance(data.columns, pd.MultiIndex):
-            data = (data.stack(level=0, future_stack=True)
-                    .rename_axis(['Date', 'Ticker'])
-                    .reset_index()
-                    .drop(columns=['Volume']))
-        else:
-            data = data.reset_index()
-            data['Ticker'] = tickers[0]
-            data = data.drop(columns=['Volume'])
-            
-        # Filter for specific date only
-        specific_data = data[data['Date'].dt.date == pd.to_datetime(specific_date).date()]
-
-        # Get the latest available data for each ticker
-        specific_data = specific_data.sort_values(['Ticker', 'Date']).groupby('Ticker').tail(1).reset_index(drop=True)
+        with stage(PIPELINE, 'reshape'):
+            # Naive exchange-local dates, whatever zone the download came back in
+            if data.index.tz is not None:
+                data.index = data.index.tz_convert(EXCHANGE_TZ).tz_localize(None)
+            # Filler rows for tickers whose market was closed would otherwise win the snapshot pick
+            data = drop_unpriced(wide_to_long(data, tickers))
+
+        if windows:
+            with stage(PIPELINE, 'analytics', step='gaps'):
+                data = add_gaps(data)
+
+        with stage(PIPELINE, 'filter'):
+            # Filter for the requested dates only
+            data['Snapshot'] = data['Date'].dt.normalize()
+            specific_data = data[data['Snapshot'].isin(pd.to_datetime(sessions))]
+
+            # Pick the snapshot bar for each ticker on each date
+            specific_data = (select_snapshots(specific_data, snapshot or SPECIFIC_DATE_RULE, tz=EXCHANGE_TZ)
+                             .sort_values(['Snapshot', 'Ticker']).reset_index(drop=True))
+
+        if windows:
+            with stage(PIPELINE, 'analytics', step='rolling', windows=list(windows)):
+                specific_data = (add_analytics(specific_data, windows)
+                                 .sort_values(['Snapshot', 'Ticker']).reset_index(drop=True))
+
+        specific_data['Snapshot'] = specific_data['Snapshot'].dt.strftime('%Y-%m-%d')
 
         return specific_data
 
     except Exception as e:
-        print(f"Error fetching data: {e}")
+        log_event(logger, 'fetch_failed', logging.ERROR, pipeline=PIPELINE, error=str(e))
         return pd.DataFrame()
 
-def generate_specific_date_data(specific_date, tickers=None):
-    """Generate Excel file with specific date data in a single sheet"""
+def generate_specific_date_data(output_path, specific_date, tickers=None, progress=None, file_format='xlsx',
+                                roll=True, per_date_sheets=False, analytics=None, snapshot=None):
+    """Generate an export with data for one date or a list of dates at output_path.
+
+    Closed days roll back to the previous session unless roll=False. Several
+    dates go into one sheet, or one sheet (row group) per date with per_date_sheets.
+    analytics (True or a list of windows) adds the analytics columns after OHLC;
+    snapshot picks the bar kept per date (see snapshots.SNAPSHOT_RULES).
+    """
     try:
-        output = BytesIO()
         all_data = pd.DataFrame()
+        windows = resolve_windows(analytics)
+        snapshot = normalize_rule(snapshot or SPECIFIC_DATE_RULE)
+        dates = list(specific_date) if isinstance(specific_date, (list, tuple, set)) else [specific_date]
+        label = str(dates[0]) if len(dates) == 1 else f'{min(dates)} to {max(dates)}'
         
-        if tickers:
-            # Use provided tickers
-            for index, symbols in tickers.items():
-                print(f"Processing {index} for {specific_date}...")
-                df = get_specific_date_data(symbols, specific_date)
-                if not df.empty:
-                    df['Index'] = index
-                    all_data = pd.concat([all_data, df], ignore_index=True)
-        else:
-            # Use default index components
-            components, _ = get_index_components()
-            for index, symbols in components.items():
-                print(f"Processing {index} for {specific_date}...")
-                df = get_specific_date_data(symbols, specific_date)
-                if not df.empty:
-                    df['Index'] = index
-                    all_data = pd.concat([all_data, df], ignore_index=True)
-
-        # Write all data to a single sheet
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            if not all_data.empty:
-                cols = ['Ticker', 'Date', 'Open', 'High', 'Low', 'Close', 'Adj Close']
-                all_data = all_data[cols]
-                all_data.to_excel(writer, sheet_name=f'Data_{specific_date}', index=False)
-        
-        output.seek(0)
-        return output
+        # Fetch every ticker once, then attach the index labels it belongs to
+        with stage(PIPELINE, 'plan'):
+            plan = plan_fetch(tickers)
+        log_event(logger, 'processing', pipeline=PIPELINE, tickers=len(plan.symbols), indices=plan.indices,
+                  dates=label, snapshot=snapshot)
+        plan.report(progress, 'downloading')
+        df = get_specific_date_data(plan.symbols, dates, roll=roll, windows=windows, snapshot=snapshot)
+        record_missing(PIPELINE, plan, df['Ticker'] if df is not None and not df.empty else [])
+        if df is not None and not df.empty:
+            with stage(PIPELINE, 'attach'):
+                all_data = attach_indices(df, plan)
+        plan.report(progress, 'writing')
+
+        # Write all data to a single sheet (or table) in the requested format
+        cols = ['Ticker', 'Date', 'Open', 'High', 'Low', 'Close', 'Adj Close']
+        if windows:
+            cols += analytics_columns(windows)
+        with stage(PIPELINE, 'write', format=file_format):
+            if len(dates) == 1:
+                write_export(all_data, output_path, file_format, sheet_name=f'Data_{dates[0]}', columns=cols)
+            elif per_date_sheets:
+                if not all_data.empty:
+                    all_data = all_data.sort_values('Snapshot', kind='stable')
+                write_export(all_data, output_path, file_format, sheet_name='Snapshots',
+                             columns=cols + ['Snapshot'], partition_by='Snapshot')
+            else:
+                write_export(all_data, output_path, file_format, sheet_name='Snapshots', columns=cols)
+        size = record_export(PIPELINE, file_format, output_path, len(all_data))
+        log_event(logger, 'export_written', pipeline=PIPELINE, format=file_format, rows=len(all_data), bytes=size)
+
+        plan.report(progress, 'done')
+        return output_path
     
     except Exception as e:
-        print(f"Error generating specific date data: {str(e)}")
-        return None
\ No newline at end of file
+        EXPORTS.inc(pipeline=PIPELINE, outcome='error')
+        log_event(logger, 'export_failed', logging.ERROR, pipeline=PIPELINE, error=str(e))
+        return None
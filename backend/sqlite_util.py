@@ -0,0 +1,7 @@
+# SQLite caps the number of bound parameters per statement
+PARAM_CHUNK = 500
+
+def chunks(items, size=PARAM_CHUNK):
+    """Successive slices of items small enough to bind as one statement's parameters"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,57 @@
+import pandas as pd
+from scrape_tickers import get_index_components
+
+class FetchPlan:
+    """Deduplicated ticker universe plus the ticker -> indices membership map.
+
+    Symbols are stripped and uppercased the way yfinance returns them, so
+    bars always find their membership rows.
+    """
+
+    def __init__(self, tickers):
+        self.indices = []
+        self.symbols = []
+        self.membership = {}
+
+        for index, symbols in tickers.items():
+            self.indices.append(index)
+            for symbol in symbols:
+                symbol = str(symbol).strip().upper()
+                if not symbol:
+                    continue
+                if symbol not in self.membership:
+                    self.membership[symbol] = []
+                    self.symbols.append(symbol)
+                if index not in self.membership[symbol]:
+                    self.membership[symbol].append(index)
+
+    def report(self, progress, state):
+        """Send the same progress state for every index in the plan"""
+        if progress:
+            for index in self.indices:
+                progress(index, state)
+
+    def membership_frame(self):
+        """One row per (Ticker, Index) pair, ordered the way the indices were given"""
+        order = {index: position for position, index in enumerate(self.indices)}
+        rows = [(symbol, index, order[index])
+                for symbol, indices in self.membership.items()
+                for index in indices]
+        frame = pd.DataFrame(rows, columns=['Ticker', 'Index', '_index_order'])
+        frame['Index'] = pd.Categorical(frame['Index'], categories=self.indices)
+        return frame
+
+def plan_fetch(tickers=None):
+    """Build a fetch plan from an uploaded ticker map or the default index components"""
+    if not tickers:
+        tickers, _ = get_index_components()
+    return FetchPlan(tickers)
+
+def attach_indices(data, plan):
+    """Fan rows fetched once per ticker back out to one row per index the ticker belongs to"""
+    if data is None or data.empty:
+        return pd.DataFrame()
+
+    data = data.merge(plan.membership_frame(), on='Ticker', how='inner')
+    data = data.sort_values(['_index_order', 'Ticker'], kind='stable')
+    return data.drop(columns=['_index_order']).reset_index(drop=True)
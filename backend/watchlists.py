@@ -0,0 +1,173 @@
+import io
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+import pandas as pd
+from config import CACHE_DIR, WATCHLIST_DIR
+
+# Parsed uploads, keyed by content hash, so the same file is only ever parsed once
+PARSE_CACHE_DIR = CACHE_DIR / 'watchlists'
+
+TABULAR_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+TEXT_EXTENSIONS = ('.txt',)
+WATCHLIST_EXTENSIONS = TABULAR_EXTENSIONS + TEXT_EXTENSIONS
+
+# Index label for plain-text lists, which carry tickers only
+TEXT_INDEX = 'Watchlist'
+
+class WatchlistError(ValueError):
+    """An upload or watchlist reference that cannot be turned into tickers"""
+
+def _extension(filename):
+    return os.path.splitext(filename or '')[1].lower()
+
+def _parse_tabular(content, extension):
+    if extension == '.csv':
+        df = pd.read_csv(io.BytesIO(content), dtype=str)
+    else:
+        df = pd.read_excel(io.BytesIO(content))
+    if 'Ticker' not in df.columns or 'Index' not in df.columns:
+        raise WatchlistError("Ticker file must contain 'Ticker' and 'Index' columns")
+
+    df = df.dropna(subset=['Ticker', 'Index'])
+    df['Ticker'] = df['Ticker'].astype(str).str.strip().str.upper()
+    index_ticker_map = {}
+    for index, ticker in df.groupby('Index'):
+        index_ticker_map[str(index)] = ticker['Ticker'].unique().tolist()
+    return index_ticker_map
+
+def _parse_text(content):
+    """One or more tickers per line, separated by whitespace or commas; # starts a comment"""
+    tickers = []
+    for line in content.decode('utf-8-sig').splitlines():
+        line = line.split('#', 1)[0]
+        tickers.extend(t.strip().upper() for t in line.replace(',', ' ').split() if t.strip())
+    return {TEXT_INDEX: list(dict.fromkeys(tickers))} if tickers else {}
+
+def parse_ticker_file(filename, content):
+    """Index -> tickers map from an xlsx/xls/csv sheet with Index and Ticker columns, or a plain-text list"""
+    extension = _extension(filename)
+    if extension in TABULAR_EXTENSIONS:
+        index_ticker_map = _parse_tabular(content, extension)
+    elif extension in TEXT_EXTENSIONS:
+        index_ticker_map = _parse_text(content)
+    else:
+        raise WatchlistError('Invalid file format. Please upload an Excel, CSV or text file.')
+
+    if not index_ticker_map:
+        raise WatchlistError('The uploaded file does not contain any tickers')
+    return index_ticker_map
+
+class ParseCache:
+    """Parsed ticker maps keyed by (extension, sha256 of the upload), in memory and on disk"""
+
+    def __init__(self, directory=PARSE_CACHE_DIR):
+        self.directory = directory
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def parse(self, filename, content):
+        """Parsed map for an upload plus its content hash; repeated uploads skip parsing"""
+        digest = hashlib.sha256(content).hexdigest()
+        key = f'{_extension(filename).lstrip(".")}-{digest}'
+        with self._lock:
+            cached = self._memory.get(key)
+        if cached is not None:
+            return cached, digest
+
+        path = self.directory / f'{key}.json'
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index_ticker_map = json.load(f)
+        except (OSError, ValueError):
+            index_ticker_map = parse_ticker_file(filename, content)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index_ticker_map, f)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._memory[key] = index_ticker_map
+        return index_ticker_map, digest
+
+class WatchlistStore:
+    """Named ticker maps persisted as one JSON file each and referenced by ID"""
+
+    def __init__(self, directory=WATCHLIST_DIR, parse_cache=None):
+        self.directory = directory
+        self.parse_cache = parse_cache or ParseCache()
+        self._lock = threading.Lock()
+
+    def _path(self, watchlist_id):
+        # IDs are generated hex strings; anything else cannot name a stored watchlist
+        if not watchlist_id or not all(c in '0123456789abcdef' for c in watchlist_id):
+            return None
+        return self.directory / f'{watchlist_id}.json'
+
+    def create(self, name, filename, content):
+        """Parse (or reuse the cached parse of) an upload and save it as a new watchlist"""
+        tickers, digest = self.parse_cache.parse(filename, content)
+        watchlist = {
+            'id': uuid.uuid4().hex[:12],
+            'name': (name or '').strip() or os.path.splitext(os.path.basename(filename))[0],
+            'source': os.path.basename(filename),
+            'sha256': digest,
+            'created_at': time.time(),
+            'tickers': tickers,
+        }
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(watchlist['id'])
+        tmp_path = path.with_suffix('.tmp')
+        with self._lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(watchlist, f)
+            os.replace(tmp_path, path)
+        return watchlist
+
+    def get(self, watchlist_id):
+        path = self._path(watchlist_id)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list(self):
+        """Every watchlist, newest first"""
+        watchlists = []
+        for path in self.directory.glob('*.json'):
+            watchlist = self.get(path.stem)
+            if watchlist:
+                watchlists.append(watchlist)
+        return sorted(watchlists, key=lambda w: w['created_at'], reverse=True)
+
+    def delete(self, watchlist_id):
+        path = self._path(watchlist_id)
+        if path is None:
+            return False
+        with self._lock:
+            try:
+                os.remove(path)
+                return True
+            except OSError:
+                return False
+
+def summary(watchlist):
+    """Watchlist without its ticker lists, for listings"""
+    tickers = watchlist['tickers']
+    return {
+        'id': watchlist['id'],
+        'name': watchlist['name'],
+        'source': watchlist['source'],
+        'created_at': watchlist['created_at'],
+        'indices': {index: len(symbols) for index, symbols in tickers.items()},
+        'tickers': len({symbol for symbols in tickers.values() for symbol in symbols}),
+    }
+
+watchlists = WatchlistStore()
@@ -0,0 +1,49 @@
+"""Production entry point: several pre-forked worker processes behind one port.
+
+    python wsgi.py                          # gunicorn with the settings below
+    gunicorn -c wsgi.py wsgi:app            # the same, from the gunicorn CLI
+
+Workers share the disk caches plus the SQLite shared cache (index components,
+recent quotes, job status), so adding workers does not multiply upstream
+traffic. Only one worker on the host runs the snapshot scheduler. gunicorn
+does not run on Windows, where this falls back to the threaded Flask server.
+"""
+import os
+from app import app
+from scheduler import start_scheduler
+
+# gunicorn settings, read both by `gunicorn -c wsgi.py` and by main() below
+bind = os.environ.get('STOCK_DATA_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('STOCK_DATA_WEB_WORKERS', min(4, os.cpu_count() or 1)))
+# Threads per worker keep long SSE streams and ?wait= downloads from blocking other requests
+worker_class = 'gthread'
+threads = int(os.environ.get('STOCK_DATA_WEB_THREADS', 16))
+# Exports can take minutes; SSE streams send keep-alives well within this
+timeout = int(os.environ.get('STOCK_DATA_WEB_TIMEOUT', 600))
+graceful_timeout = 30
+
+def post_fork(server, worker):
+    start_scheduler(exclusive=True)
+
+_SETTINGS = ('bind', 'workers', 'worker_class', 'threads', 'timeout', 'graceful_timeout', 'post_fork')
+
+def main():
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        start_scheduler()
+        app.run(host=bind.rsplit(':', 1)[0], port=int(bind.rsplit(':', 1)[1]), threaded=True)
+        return
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for name in _SETTINGS:
+                self.cfg.set(name, globals()[name])
+
+        def load(self):
+            return app
+
+    Server().run()
+
+if __name__ == '__main__':
+    main()